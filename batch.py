@@ -0,0 +1,58 @@
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+
+def _run_one(function, item):
+    """
+    Run function on one item and capture any error instead of raising it.
+    Returns (item, result, error).
+    """
+    try:
+        return item, function(item), None
+    except Exception as e:
+        return item, None, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+def run_batch(function, items, workers=1, chunksize=1):
+    """
+    Run function(item) for every item, spread over a pool of worker processes.
+
+    Args:
+        function: A picklable (module level) function taking one item.
+        items: The items to process. Outcomes come back in this order.
+        workers (int): Number of worker processes. 1 runs everything in this process.
+        chunksize (int): Number of items sent to a worker at a time.
+
+    Returns:
+        list: (item, result, error) per item. error is None on success, otherwise
+        the error message and traceback. A failed item does not stop the batch.
+    """
+    items = list(items)
+    runner = partial(_run_one, function)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(items) <= 1:
+        return [runner(item) for item in items]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(runner, items, chunksize=max(1, chunksize)))
+
+def report_errors(outcomes, report_path=None):
+    """
+    Print the failed items of a batch and optionally write them to a report file.
+    Returns the number of failures.
+    """
+    failures = [(item, error) for item, _, error in outcomes if error is not None]
+    for item, error in failures:
+        print(f"Failed: {item}: {error.splitlines()[0]}")
+
+    if report_path is not None:
+        with open(report_path, 'w', encoding='utf-8') as file:
+            for item, error in failures:
+                file.write(f"File: {item}\n")
+                file.write(error)
+                file.write("-" * 40 + "\n")
+
+    print(f"{len(outcomes) - len(failures)} of {len(outcomes)} files processed, {len(failures)} failed.")
+    return len(failures)
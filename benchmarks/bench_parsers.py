@@ -0,0 +1,183 @@
+"""
+Benchmark the sle and translate parsers on a synthetic corpus, and check that
+their output has not changed.
+
+Usage:
+    python benchmarks/bench_parsers.py [--patients N] [--episodes FEWEST MOST] [--rounds N]
+        [--update-baselines] [--update-golden]
+
+Every parser step is timed over the whole corpus, best of --rounds, and reported
+in MB of patient text per second, with its peak memory measured by tracemalloc
+in a separate round. Both are compared with parser_baselines.json, made on the
+same corpus settings; a step more than --tolerance slower or bigger is a regression.
+
+The golden check runs every step on a fixed corpus and compares a digest of its
+output with parser_golden.json. Any difference is reported. Run with
+--update-golden only when an output change is intended.
+
+Exits with status 1 on a regression or an output change.
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import sle
+import synthetic
+import translate
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+BASELINES_PATH = os.path.join(BENCHMARKS_FOLDER, 'parser_baselines.json')
+GOLDEN_PATH = os.path.join(BENCHMARKS_FOLDER, 'parser_golden.json')
+GOLDEN_CORPUS = {"patients": 60, "seed": 0, "labs": [2, 8], "episodes": [1, 12]}
+
+
+def extract(text):
+    return sle.extract_results_from_lines(text.splitlines(keepends=True))
+
+# Parser steps as (name, input from the patient text, step); consolidate_results
+# is given extract's output, so its input is made before it is timed
+STEPS = [
+    ("sle.extract_results_from_lines", lambda text: text.splitlines(keepends=True), sle.extract_results_from_lines),
+    ("sle.consolidate_results", extract, sle.consolidate_results),
+    ("translate.parse_lab_results", lambda text: text, translate.parse_lab_results),
+    ("translate.consolidate_fbc_data", lambda text: text, translate.consolidate_fbc_data),
+]
+
+
+def digest(outputs):
+    """
+    Return a digest of a step's outputs, frames by their CSV and result dicts by their JSON.
+    """
+    hasher = hashlib.sha256()
+    for output in outputs:
+        if hasattr(output, 'to_csv'):
+            hasher.update(output.to_csv().encode('utf-8'))
+        else:
+            hasher.update(json.dumps(output, sort_keys=True).encode('utf-8'))
+    return hasher.hexdigest()
+
+def run_step(step, inputs):
+    # sle prints every match; the printing stays in the timing but goes nowhere
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return [step(value) for value in inputs]
+
+def measure(step, inputs, rounds):
+    """
+    Return (best seconds, peak traced MB) of a step over every input.
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        run_step(step, inputs)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    run_step(step, inputs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak / 1e6
+
+def load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_json(path, value):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(value, file, indent=1, sort_keys=True)
+        file.write("\n")
+
+def corpus_texts(settings):
+    return [text for _, text in synthetic.generate_corpus(settings["patients"], settings["seed"],
+                                                          tuple(settings["labs"]), tuple(settings["episodes"]))]
+
+
+def benchmark(settings, rounds, tolerance, update):
+    """
+    Time every step on the benchmark corpus and compare it with the baselines.
+    Returns the number of regressions.
+    """
+    texts = corpus_texts(settings)
+    size_mb = sum(len(text.encode('utf-8')) for text in texts) / 1e6
+    print(f"Corpus: {settings['patients']} patients, {size_mb:.1f} MB")
+
+    stored = load_json(BASELINES_PATH)
+    baselines = stored["steps"] if stored and stored.get("corpus") == settings else None
+    if stored and baselines is None:
+        print("Baselines were made on other corpus settings, not comparing")
+
+    measured = {}
+    regressions = 0
+    for name, prepare, step in STEPS:
+        inputs = run_step(prepare, texts)
+        seconds, peak_mb = measure(step, inputs, rounds)
+        measured[name] = {"mb_per_s": round(size_mb / seconds, 2), "peak_mb": round(peak_mb, 2)}
+        line = f"{name}: {seconds:.3f}s, {size_mb / seconds:.1f} MB/s, peak {peak_mb:.1f} MB"
+        if baselines and name in baselines:
+            baseline = baselines[name]
+            slower = measured[name]["mb_per_s"] < baseline["mb_per_s"] * (1 - tolerance)
+            bigger = measured[name]["peak_mb"] > baseline["peak_mb"] * (1 + tolerance)
+            line += f" (baseline {baseline['mb_per_s']:.1f} MB/s, {baseline['peak_mb']:.1f} MB)"
+            if slower or bigger:
+                line += " REGRESSION: " + ", ".join(word for word, flag in (("slower", slower), ("more memory", bigger)) if flag)
+                regressions += 1
+        print(line)
+
+    if update:
+        save_json(BASELINES_PATH, {"corpus": settings, "steps": measured})
+        print(f"Baselines written to {BASELINES_PATH}")
+    return regressions
+
+def golden_check(update):
+    """
+    Compare a digest of every step's output on the golden corpus with the stored one.
+    Returns the number of steps whose output changed.
+    """
+    texts = corpus_texts(GOLDEN_CORPUS)
+    digests = {}
+    for name, prepare, step in STEPS:
+        digests[name] = digest(run_step(step, run_step(prepare, texts)))
+
+    if update:
+        save_json(GOLDEN_PATH, {"corpus": GOLDEN_CORPUS, "digests": digests})
+        print(f"Golden digests written to {GOLDEN_PATH}")
+        return 0
+    stored = load_json(GOLDEN_PATH)
+    if stored is None:
+        print("No golden digests yet, run with --update-golden")
+        return 0
+    changed = [name for name, value in digests.items() if stored["digests"].get(name) != value]
+    for name in changed:
+        print(f"Golden output changed: {name}")
+    if not changed:
+        print(f"Golden output unchanged for {len(digests)} steps")
+    return len(changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--labs', type=int, nargs=2, default=[2, 8], metavar=('FEWEST', 'MOST'))
+    parser.add_argument('--episodes', type=int, nargs=2, default=[5, 40], metavar=('FEWEST', 'MOST'))
+    parser.add_argument('--rounds', type=int, default=3, help="Timed rounds, the best is reported")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Share slower or bigger than the baseline allowed")
+    parser.add_argument('--update-baselines', action='store_true', help="Store this run's figures as the baselines")
+    parser.add_argument('--update-golden', action='store_true', help="Store this run's outputs as the golden outputs")
+    args = parser.parse_args()
+
+    settings = {"patients": args.patients, "seed": args.seed, "labs": args.labs, "episodes": args.episodes}
+    regressions = benchmark(settings, args.rounds, args.tolerance, args.update_baselines)
+    changed = golden_check(args.update_golden)
+    if regressions or changed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
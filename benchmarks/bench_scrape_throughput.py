@@ -0,0 +1,120 @@
+"""
+Measure end-to-end scraping throughput against the offline TrakCare stand-in
+(mock_trakcare.py), for every combination of driver count and wait poll interval.
+
+Usage:
+    python benchmarks/bench_scrape_throughput.py [--drivers 1 2 4] [--poll 0.1 0.5] [--patients N]
+        [--latency S] [--failure-rate F] [--session-ttl S] [--backend browser|http] [--direct]
+
+Browsers are started and logged in before the clock starts, so the figures are
+steady-state throughput. Reports patients per minute and labs per minute.
+The browser backend needs Chrome; the http backend does not.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import transcribe
+from driver_pool import DriverPool
+from http_backend import HttpBackend
+from mock_trakcare import MockTrakCare, start_server
+
+
+def start_pool(drivers, poll, timeout, site_url, headed):
+    """
+    Start and log in every driver of a pool, so the run does not time browser start-up.
+    """
+    pool = DriverPool(
+        drivers,
+        create_driver=lambda: transcribe.retry_operation(transcribe.setup_driver, not headed),
+        authenticate=lambda driver, wait: transcribe.retry_operation(transcribe.login, driver, transcribe.CREDENTIALS, wait, site_url),
+        is_authenticated=transcribe.is_logged_in,
+        recycle_after=10 ** 6,
+        wait_timeout=timeout,
+        poll_frequency=poll,
+    )
+    for pooled in [pool.acquire() for _ in range(drivers)]:
+        pool.release(pooled)
+    return pool
+
+def run(patients, drivers, scrape):
+    """
+    Scrape the patients on the given number of workers.
+    Returns (seconds, patients done, labs done, patients failed).
+    """
+    def scrape_one(patient):
+        try:
+            with transcribe.policy.budget(transcribe.PATIENT_BUDGET):
+                return scrape(patient).count("\n Lab : ")
+        except Exception as error:
+            print(f"Patient {patient} failed: {error}")
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=drivers) as executor:
+        labs = list(executor.map(scrape_one, patients))
+    seconds = time.perf_counter() - start
+    done = [count for count in labs if count is not None]
+    return seconds, len(done), sum(done), len(labs) - len(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--drivers', type=int, nargs='+', default=[1, 2, 4], help="Driver counts to compare")
+    parser.add_argument('--poll', type=float, nargs='+', default=[transcribe.POLL_FREQUENCY], help="Wait poll intervals to compare, in seconds")
+    parser.add_argument('--timeout', type=float, default=15, help="Seconds a wait may take")
+    parser.add_argument('--patients', type=int, default=12, help="Patients per run")
+    parser.add_argument('--backend', choices=['browser', 'http'], default='browser')
+    parser.add_argument('--direct', action='store_true', help="Open labs by address after the first")
+    parser.add_argument('--headed', action='store_true', help="Show the browsers instead of running them headless")
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds every request to the stand-in takes")
+    parser.add_argument('--jitter', type=float, default=0.5)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of requests failing with a 503")
+    parser.add_argument('--session-ttl', type=float, help="Seconds a login lasts")
+    parser.add_argument('--missing-rate', type=float, default=0.0, help="Share of patients without records")
+    parser.add_argument('--labs', type=int, nargs=2, default=(2, 8), metavar=('FEWEST', 'MOST'))
+    parser.add_argument('--episodes', type=int, nargs=2, default=(1, 12), metavar=('FEWEST', 'MOST'))
+    args = parser.parse_args()
+
+    site = MockTrakCare(args.latency, args.jitter, args.failure_rate, args.session_ttl, args.missing_rate,
+                        labs=tuple(args.labs), episodes=tuple(args.episodes))
+    server = start_server(site)
+    site_url = f"http://127.0.0.1:{server.server_port}"
+    patients = [str(10000000 + number) for number in range(args.patients)]
+    print(f"Stand-in at {site_url}: {args.latency}s latency, {args.failure_rate:.0%} failures, "
+          f"{args.patients} patients, {args.backend} backend")
+
+    polls = args.poll if args.backend == 'browser' else [None]
+    results = []
+    for drivers in args.drivers:
+        for poll in polls:
+            if args.backend == 'browser':
+                pool = start_pool(drivers, poll, args.timeout, site_url, args.headed)
+                try:
+                    seconds, done, labs, failed = run(
+                        patients, drivers, lambda patient: transcribe.scrape_with_browser(pool, patient, args.direct))
+                finally:
+                    pool.close()
+            else:
+                backend = HttpBackend(transcribe.CREDENTIALS, base_url=site_url, pool_size=drivers)
+                backend.login(transcribe.CREDENTIALS)
+                try:
+                    seconds, done, labs, failed = run(patients, drivers, lambda patient: transcribe.scrape_patient(transcribe.RetryingBackend(backend), patient))
+                finally:
+                    backend.close()
+            results.append((drivers, poll, seconds, done, labs, failed))
+
+    print()
+    for drivers, poll, seconds, done, labs, failed in results:
+        setting = f"{drivers} drivers" + (f", poll {poll}s" if poll is not None else "")
+        print(f"{setting}: {done} patients ({failed} failed), {labs} labs in {seconds:.1f}s: "
+              f"{done / seconds * 60:.1f} patients/min, {labs / seconds * 60:.1f} labs/min")
+    print(f"Requests served: {site.counts}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark the keyword-filtered scanner in sle.extract_results_from_lines against
+the old approach of running every pattern on every line.
+
+Usage:
+    python benchmarks/bench_sle_scan.py [cumulative history .txt] [--repeat N]
+
+The input file is repeated N times to simulate a large cumulative-history file.
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import sle
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output files\\25821273.txt')
+
+
+def legacy_scan(lines):
+    """
+    The previous scan loop: every pattern through re.findall on every dated line.
+    Only the number of matches is returned, which is enough to compare the work done.
+    """
+    date_line_pattern = re.compile(r"Date\s+collected\s+(\d{2}/\d{2}/\d{4})")
+    current_date = None
+    found = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        date_match = date_line_pattern.search(line)
+        if date_match:
+            current_date = date_match.group(1)
+            continue
+        if current_date is None:
+            continue
+        for test, pattern in sle.patterns.items():
+            found += len(re.findall(pattern, line, flags=re.DOTALL | re.IGNORECASE))
+    return found
+
+
+def compiled_scan(lines):
+    """
+    The same loop using the compiled, keyword-filtered scanner.
+    """
+    date_line_pattern = re.compile(r"Date\s+collected\s+(\d{2}/\d{2}/\d{4})")
+    current_date = None
+    found = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        date_match = date_line_pattern.search(line)
+        if date_match:
+            current_date = date_match.group(1)
+            continue
+        if current_date is None:
+            continue
+        for test, regex, _ in sle.candidate_patterns(line):
+            found += len(regex.findall(line))
+    return found
+
+
+def best_of(function, lines, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(lines)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', default=DEFAULT_INPUT)
+    parser.add_argument('--repeat', type=int, default=50, help="Times to repeat the input file")
+    parser.add_argument('--rounds', type=int, default=3, help="Timed rounds, the best is reported")
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8', errors='ignore') as file:
+        lines = file.readlines() * args.repeat
+    size_mb = sum(len(line) for line in lines) / 1e6
+    print(f"Input: {args.input} x{args.repeat} ({len(lines)} lines, {size_mb:.1f} MB)")
+
+    legacy_time, legacy_found = best_of(legacy_scan, lines, args.rounds)
+    compiled_time, compiled_found = best_of(compiled_scan, lines, args.rounds)
+    if legacy_found != compiled_found:
+        raise SystemExit(f"Match counts differ: {legacy_found} legacy vs {compiled_found} compiled")
+
+    print(f"All patterns per line: {legacy_time:.3f}s ({size_mb / legacy_time:.1f} MB/s)")
+    print(f"Keyword-filtered:      {compiled_time:.3f}s ({size_mb / compiled_time:.1f} MB/s)")
+    print(f"Speedup:               {legacy_time / compiled_time:.1f}x")
+
+    # Full extraction including result assembly, with its progress output discarded
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        results = sle.extract_results_from_lines(lines)
+        extract_time = time.perf_counter() - start
+    print(f"extract_results_from_lines: {extract_time:.3f}s, {len(results)} tests")
+
+
+if __name__ == "__main__":
+    main()
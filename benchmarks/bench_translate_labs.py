@@ -0,0 +1,77 @@
+"""
+Benchmark the episode tokenizer in translate.parse_lab_results against the old
+approach of splitting the text into episodes and running every pattern on each.
+
+Usage:
+    python benchmarks/bench_translate_labs.py [cumulative history .txt] [--repeat N]
+
+The input file is repeated N times to simulate a large multi-lab file.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import translate
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'output files\\25821273.txt')
+
+
+def legacy_parse(text):
+    """
+    The previous parser: re.split into episodes, then every pattern searched over each episode.
+    """
+    episodes = re.split(r'Episode\s+\w+', text)[1:]
+    results = {}
+    for episode in episodes:
+        date_match = re.search(r'Date collected\s+(\d{2}/\d{2}/\d{4})', episode)
+        if not date_match:
+            continue
+        date = datetime.strptime(date_match.group(1), '%d/%m/%Y').date()
+        results.setdefault(date, {test: '-' for test in translate.lab_tests})
+        for test, pattern in translate.lab_tests.items():
+            match = re.search(pattern, episode, re.DOTALL)
+            if match:
+                result_value = match.group(1).strip() if test in ["Histopathology", "LA"] else f"{match.group(1)} - {match.group(2)}" if len(match.groups()) > 1 else match.group(1)
+                results[date][test] = result_value
+    return pd.DataFrame.from_dict(results, orient='index')
+
+
+def best_of(function, text, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function(text)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?', default=DEFAULT_INPUT)
+    parser.add_argument('--repeat', type=int, default=50, help="Times to repeat the input file")
+    parser.add_argument('--rounds', type=int, default=3, help="Timed rounds, the best is reported")
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8', errors='ignore') as file:
+        text = file.read() * args.repeat
+    size_mb = len(text) / 1e6
+    print(f"Input: {args.input} x{args.repeat} ({text.count('Episode')} episodes, {size_mb:.1f} MB)")
+
+    legacy_time, legacy_df = best_of(legacy_parse, text, args.rounds)
+    tokenized_time, tokenized_df = best_of(translate.parse_lab_results, text, args.rounds)
+    if not legacy_df.equals(tokenized_df):
+        raise SystemExit("Results differ between the legacy and tokenized parsers")
+
+    print(f"Split and search every episode: {legacy_time:.3f}s ({size_mb / legacy_time:.1f} MB/s)")
+    print(f"Tokenized, compiled table:      {tokenized_time:.3f}s ({size_mb / tokenized_time:.1f} MB/s)")
+    print(f"Speedup:                        {legacy_time / tokenized_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import threading
+from webdriver_manager.chrome import ChromeDriverManager
+
+DRIVER_PATH_CACHE = ".chromedriver-path"  # Resolved chromedriver binary, reused across runs
+
+# Content a lean browser never downloads. Images are also switched off through preferences.
+BLOCKED_URL_PATTERNS = ["*.png", "*.jpg", "*.jpeg", "*.gif", "*.svg", "*.ico", "*.webp",
+                        "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+                        "*.mp4", "*.webm", "*.mp3", "*.ogg", "*.wav"]
+
+LEAN_PREFERENCES = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.default_content_setting_values.notifications": 2,
+    "profile.default_content_setting_values.media_stream": 2,
+}
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+_stats_lock = threading.Lock()
+bootstrap_stats = []  # (seconds to first login, RSS in MB) per browser started
+
+
+def chromedriver_path(refresh=False):
+    """
+    Return the chromedriver binary, resolving it with ChromeDriverManager only once.
+    The path is kept in memory and in DRIVER_PATH_CACHE, and the CHROMEDRIVER_PATH
+    environment variable overrides both. Pass refresh=True to resolve it again,
+    e.g. after Chrome was upgraded.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if os.environ.get("CHROMEDRIVER_PATH"):
+            return os.environ["CHROMEDRIVER_PATH"]
+        if not refresh and _driver_path and os.path.exists(_driver_path):
+            return _driver_path
+        if not refresh and os.path.exists(DRIVER_PATH_CACHE):
+            with open(DRIVER_PATH_CACHE, 'r', encoding='utf-8') as file:
+                cached = file.read().strip()
+            if os.path.exists(cached):
+                _driver_path = cached
+                return _driver_path
+
+        print("Resolving chromedriver...")
+        _driver_path = ChromeDriverManager().install()
+        with open(DRIVER_PATH_CACHE, 'w', encoding='utf-8') as file:
+            file.write(_driver_path)
+        return _driver_path
+
+def make_lean(chrome_options):
+    """
+    Run headless, hand control back once the DOM is ready instead of after every
+    resource has loaded, and skip images, fonts and media.
+    """
+    chrome_options.add_argument('--headless=new')
+    chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+    chrome_options.page_load_strategy = 'eager'
+    chrome_options.add_experimental_option('prefs', LEAN_PREFERENCES)
+
+def block_heavy_content(driver):
+    """
+    Stop the browser from downloading fonts and media. Preferences cannot switch these off.
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URL_PATTERNS})
+
+def _process_tree(root_pid):
+    """
+    Return root_pid and all its descendants, read from /proc.
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat', 'r') as file:
+                    parent = int(file.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+
+    pids, pending = [], [root_pid]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+def browser_rss(driver):
+    """
+    Return the resident memory in MB of the chromedriver process and the browser it runs,
+    or None where /proc is not available.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    total_kb = 0
+    for pid in _process_tree(driver.service.process.pid):
+        try:
+            with open(f'/proc/{pid}/status', 'r') as file:
+                for line in file:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return total_kb / 1024
+
+def record_bootstrap(driver, seconds):
+    """
+    Record how long a browser took from start to first login and its memory once logged in.
+    """
+    rss = browser_rss(driver)
+    with _stats_lock:
+        bootstrap_stats.append((seconds, rss))
+    rss_text = f", {rss:.0f} MB RSS" if rss is not None else ""
+    print(f"Browser ready in {seconds:.1f}s{rss_text}")
+
+def report_bootstrap():
+    """
+    Print time to first login and memory per browser, to size pools on a worker host.
+    """
+    with _stats_lock:
+        stats = list(bootstrap_stats)
+    if not stats:
+        return
+    times = [seconds for seconds, _ in stats]
+    print(f"Browsers started: {len(stats)}, time to first login mean {sum(times) / len(times):.1f}s, max {max(times):.1f}s")
+    sizes = [rss for _, rss in stats if rss is not None]
+    if sizes:
+        print(f"Browser RSS mean {sum(sizes) / len(sizes):.0f} MB, max {max(sizes):.0f} MB")
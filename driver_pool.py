@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from waits import MeasuredWait, DEFAULT_POLL
+
+
+class PooledDriver:
+    """
+    A web driver checked out of the pool, with its wait and usage count.
+    """
+    def __init__(self, driver, wait):
+        self.driver = driver
+        self.wait = wait
+        self.patients_served = 0
+
+
+class DriverPool:
+    """
+    A fixed number of long-lived, logged-in web drivers shared between workers.
+
+    Drivers are started lazily on first use and kept logged in between patients.
+    Before a driver is handed out its session is checked and it only logs in again
+    when the session has expired; a driver whose check fails is replaced. A driver
+    is quit and replaced after `recycle_after` patients, or straight away if a
+    patient failed on it.
+    """
+    def __init__(self, size, create_driver, authenticate, is_authenticated, recycle_after=25, wait_timeout=60,
+                 poll_frequency=DEFAULT_POLL, on_started=None):
+        self.size = size
+        self.create_driver = create_driver
+        self.authenticate = authenticate
+        self.is_authenticated = is_authenticated
+        self.recycle_after = recycle_after
+        self.wait_timeout = wait_timeout
+        self.poll_frequency = poll_frequency
+        self.on_started = on_started  # Called with (driver, seconds to first login) for every new driver
+
+        self._slots = queue.Queue()
+        self._live = set()
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._slots.put(None)  # Empty slot, a driver is started on first use
+
+    def _start(self):
+        start = time.perf_counter()
+        driver = self.create_driver()
+        with self._lock:
+            self._live.add(driver)
+        pooled = PooledDriver(driver, MeasuredWait(driver, self.wait_timeout, self.poll_frequency))
+        try:
+            self.authenticate(pooled.driver, pooled.wait)
+        except Exception:
+            self._discard(pooled)
+            raise
+        if self.on_started is not None:
+            self.on_started(driver, time.perf_counter() - start)
+        return pooled
+
+    def _discard(self, pooled):
+        if pooled is None:
+            return
+        with self._lock:
+            self._live.discard(pooled.driver)
+        try:
+            pooled.driver.quit()
+        except Exception as e:
+            print(f"Error while quitting driver: {e}")
+
+    def acquire(self):
+        """
+        Block until a driver is free and return it logged in.
+        """
+        pooled = self._slots.get()
+        try:
+            if pooled is not None:
+                try:
+                    authenticated = self.is_authenticated(pooled.driver)
+                except Exception as e:
+                    # The browser is gone, e.g. it crashed; start a new one in its place
+                    print(f"Pooled driver is not responding ({type(e).__name__}), starting a new one...")
+                    self._discard(pooled)
+                    pooled = None
+                else:
+                    if not authenticated:
+                        print("Session expired, logging in again...")
+                        self.authenticate(pooled.driver, pooled.wait)
+            if pooled is None:
+                pooled = self._start()
+        except Exception:
+            self._discard(pooled)
+            self._slots.put(None)
+            raise
+        return pooled
+
+    def release(self, pooled, healthy=True):
+        """
+        Return a driver to the pool, replacing it if it failed or is due for recycling.
+        """
+        pooled.patients_served += 1
+        if not healthy or pooled.patients_served >= self.recycle_after:
+            if healthy:
+                print(f"Recycling driver after {pooled.patients_served} patients...")
+            else:
+                print("Replacing driver after a failed patient...")
+            self._discard(pooled)
+            self._slots.put(None)
+        else:
+            self._slots.put(pooled)
+
+    @contextmanager
+    def session(self):
+        """
+        Check out a logged-in driver for the duration of the block.
+        Yields (driver, wait).
+        """
+        pooled = self.acquire()
+        healthy = False
+        try:
+            yield pooled.driver, pooled.wait
+            healthy = True
+        finally:
+            self.release(pooled, healthy)
+
+    def close(self):
+        """
+        Quit every driver the pool has started.
+        """
+        with self._lock:
+            live = list(self._live)
+            self._live.clear()
+        for driver in live:
+            try:
+                driver.quit()
+            except Exception as e:
+                print(f"Error while quitting driver: {e}")
@@ -0,0 +1,128 @@
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    mrn TEXT NOT NULL,
+    episode TEXT NOT NULL,
+    collected TEXT,
+    scraped_at REAL NOT NULL,
+    PRIMARY KEY (mrn, episode)
+);
+CREATE TABLE IF NOT EXISTS lab_contents (
+    mrn TEXT NOT NULL,
+    lab_key TEXT NOT NULL,
+    content TEXT NOT NULL,
+    scraped_at REAL NOT NULL,
+    PRIMARY KEY (mrn, lab_key)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    mrn TEXT PRIMARY KEY,
+    since TEXT NOT NULL
+);
+"""
+
+# Episode headers in the cumulative history text, e.g. "Episode\tST07049121\nDate collected\t25/02/2025"
+episode_pattern = re.compile(r"Episode\s+(\w+)\s*\n\s*Date\s+collected\s+(\d{2}/\d{2}/\d{4})")
+
+
+def to_iso(date):
+    """
+    Convert a dd/mm/yyyy date to yyyy-mm-dd. None and unparseable dates give None.
+    """
+    try:
+        return datetime.strptime(date, '%d/%m/%Y').strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+def parse_episodes(content):
+    """
+    Return the (episode number, collected date) pairs in a cumulative history.
+    """
+    return episode_pattern.findall(content)
+
+def lab_key(listed):
+    """
+    Identify a lab by its oldest episode number, which stays the same as new episodes are added.
+    """
+    return min(episode for episode, _ in listed)
+
+
+class EpisodeIndex:
+    """
+    Index of the episodes already scraped for each patient, in SQLite.
+
+    Episodes are keyed by episode number with their collected date, taken from the
+    cumulative history text. The content of each lab is kept too, so a lab whose
+    episode list holds nothing new is reused instead of opened again. A per-patient
+    "since" watermark makes labs whose episodes are all older than it be skipped.
+    """
+    def __init__(self, path="episodes.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def set_since(self, mrn, since):
+        """
+        Only scrape episodes collected on or after `since` (dd/mm/yyyy) for this patient.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO watermarks (mrn, since) VALUES (?, ?)",
+                                     (str(mrn), to_iso(since)))
+
+    def since(self, mrn):
+        with self._lock:
+            row = self._connection.execute("SELECT since FROM watermarks WHERE mrn = ?", (str(mrn),)).fetchone()
+        return row[0] if row else None
+
+    def known_episodes(self, mrn):
+        with self._lock:
+            rows = self._connection.execute("SELECT episode FROM episodes WHERE mrn = ?", (str(mrn),)).fetchall()
+        return {episode for episode, in rows}
+
+    def before_watermark(self, mrn, listed):
+        """
+        Check whether every listed episode was collected before the patient's watermark.
+        """
+        since = self.since(mrn)
+        if since is None or not listed:
+            return False
+        dates = [to_iso(date) for _, date in listed]
+        return all(date is not None and date < since for date in dates)
+
+    def unchanged_content(self, mrn, listed):
+        """
+        Return the stored content of a lab if none of its listed episodes are new, otherwise None.
+        """
+        if not listed or not {episode for episode, _ in listed} <= self.known_episodes(mrn):
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT content FROM lab_contents WHERE mrn = ? AND lab_key = ?",
+                                           (str(mrn), lab_key(listed))).fetchone()
+        return row[0] if row else None
+
+    def record_lab(self, mrn, listed, content):
+        """
+        Add the episodes in a lab's content to the index and keep the content.
+        """
+        mrn = str(mrn)
+        now = time.time()
+        # Dates from the content win over the listing, which may not show them
+        episodes = list(listed) + parse_episodes(content)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO episodes (mrn, episode, collected, scraped_at) VALUES (?, ?, ?, ?)",
+                [(mrn, episode, to_iso(date), now) for episode, date in episodes])
+            if listed:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO lab_contents (mrn, lab_key, content, scraped_at) VALUES (?, ?, ?, ?)",
+                    (mrn, lab_key(listed), content, now))
+
+    def close(self):
+        self._connection.close()
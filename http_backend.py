@@ -0,0 +1,227 @@
+import json
+import threading
+from html.parser import HTMLParser
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URL = "https://trakcarelabwebview.nhls.ac.za"
+
+# Endpoints behind the UI components transcribe.py clicks through, named after
+# the components (see the element IDs there). They and the JSON shapes parsed
+# below are not yet confirmed against the live site: record a session with
+# record_to, replace tests/recordings/http_session.* with it and adjust these
+# until tests/test_http_backend.py passes. Until then the backend gives itself
+# up after GIVE_UP_AFTER patients in a row fall back to the browser.
+ENDPOINTS = {
+    "login": "/trakcarelab/csp/SSUser.Logon.cls",
+    "patient_search": "/trakcarelab/csp/web.DEBDebtor.FindList.cls",
+    "episode_list": "/trakcarelab/csp/web.EPVisitNumber.List.cls",
+    "cumulative_history": "/trakcarelab/csp/web.EPVisitTestSet.CumulativeHistoryView.cls",
+}
+
+GIVE_UP_AFTER = 5  # Patients in a row that fell back to the browser before HTTP is no longer tried
+
+# Present on the logon page only, so a response containing it means the session expired
+LOGON_MARKER = "SSUser_Logon_0-item-USERNAME"
+
+
+class SessionExpired(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Turn HTML into text laid out like document.body.innerText:
+    table cells separated by tabs, blocks and rows by new lines.
+    """
+    BLOCK_TAGS = {"p", "div", "tr", "br", "li", "h1", "h2", "h3", "h4", "table", "section"}
+    SKIP_TAGS = {"script", "style"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skipping = 0
+        self.row_has_cell = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skipping += 1
+        elif tag in ("td", "th"):
+            if self.row_has_cell:
+                self.parts.append("\t")
+            self.row_has_cell = True
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+            if tag == "tr":
+                self.row_has_cell = False
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skipping -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping and data.strip():
+            if self.parts and self.parts[-1][-1] not in "\n\t":
+                self.parts.append(" ")
+            self.parts.append(" ".join(data.split()))
+
+def html_to_text(html):
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    lines = "".join(extractor.parts).split("\n")
+    return "\n".join(line.strip(" ") for line in lines if line.strip())
+
+
+class HttpBackend:
+    """
+    Fetch lab data with direct HTTP calls instead of driving the browser.
+
+    Offers the same steps as transcribe.SeleniumBackend: login, patient_search,
+    list_episodes, episode_listing and cumulative_history. One requests session with a pooled
+    connection adapter is shared by all worker threads. Connection errors and
+    gateway errors are retried briefly by the adapter, then raised as
+    requests.ConnectionError or HTTPError for the retry policy to class as the
+    site being down. An expired session is detected from the response and logged
+    in again once before giving up.
+
+    Pass record_to to append every exchange to a JSON lines file that
+    replay_server.py can serve back offline. Request bodies are never recorded,
+    so credentials do not end up in the recording.
+    """
+    def __init__(self, credentials, base_url=BASE_URL, pool_size=4, timeout=30, max_retries=3, record_to=None):
+        self.credentials = credentials
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.record_to = record_to
+        self._login_lock = threading.Lock()
+        self._generation = 0  # Logins so far; a request that expired only logs in again if none happened since
+        self._record_lock = threading.Lock()
+        self._listings = {}  # Episode rows of each lab, by the episode opened for it
+        self.fallbacks_in_a_row = 0
+        self.usable = True  # False once the endpoints look like they do not match the site
+
+        self.session = requests.Session()
+        # The last gateway error is returned rather than raised, so raise_for_status gives it as an HTTPError
+        retries = Retry(total=max_retries, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=None,
+                        raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _record(self, method, path, params, response):
+        with self._record_lock, open(self.record_to, "a", encoding="utf-8") as file:
+            file.write(json.dumps({
+                "method": method,
+                "path": path,
+                "query": urlencode(sorted((params or {}).items())),
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type", "text/html"),
+                "body": response.text,
+            }) + "\n")
+
+    def _send(self, method, step, params=None, data=None):
+        path = ENDPOINTS[step]
+        response = self.session.request(method, self.base_url + path, params=params, data=data, timeout=self.timeout)
+        if self.record_to:
+            self._record(method, path, params, response)
+        if response.status_code in (401, 403) or (step != "login" and LOGON_MARKER in response.text):
+            raise SessionExpired(f"Session expired during {step}")
+        response.raise_for_status()
+        return response
+
+    def _request(self, method, step, params=None):
+        generation = self._generation
+        try:
+            return self._send(method, step, params)
+        except SessionExpired:
+            self.login(self.credentials, expired_generation=generation)
+            return self._send(method, step, params)
+
+    def login(self, credentials, expired_generation=None):
+        """
+        Log in, replacing the session cookie every thread uses. With expired_generation,
+        the login is skipped if another thread logged in since that session expired.
+        The cookie jar is not cleared, as other threads may be using it mid-request;
+        the login response sets the new session cookie over the old one.
+        """
+        with self._login_lock:
+            if expired_generation is not None:
+                if expired_generation != self._generation:
+                    return  # Another thread already logged in again
+                print("Session expired, logging in again...")
+            print(f"Logging in over HTTP as {credentials['username']}")
+            response = self._send("POST", "login", data={"USERNAME": credentials["username"], "PASSWORD": credentials["password"]})
+            if LOGON_MARKER in response.text:
+                raise ValueError("Login was rejected")
+            self._generation += 1
+
+    def patient_search(self, patient):
+        """
+        Return the find list rows for a patient's MRN.
+        Expects {"rows": [{"DebtorID": ...}, ...]}.
+        """
+        rows = self._request("GET", "patient_search", {"HospitalMRN": patient}).json()["rows"]
+        if not rows:
+            raise NotFound(f"Patient {patient} not found")
+        print('Patient Found')
+        return rows
+
+    def list_episodes(self, rows):
+        """
+        Return the episode opened for each find list row, which is the row's
+        first episode like in the UI.
+        Expects {"rows": [{"EpisodeNumber": ..., "DateCollected": ...}, ...]} per row.
+        """
+        episodes = []
+        for row in rows:
+            episode_rows = self._request("GET", "episode_list", {"DebtorID": row["DebtorID"]}).json()["rows"]
+            if episode_rows:
+                episode = episode_rows[0]["EpisodeNumber"]
+                self._listings[episode] = [(r["EpisodeNumber"], r.get("DateCollected")) for r in episode_rows]
+                episodes.append(episode)
+        print("Number of Labs:", len(episodes))
+        return episodes
+
+    def episode_listing(self, episode):
+        """
+        Return the (episode, date) pairs listed for the lab opened through this episode.
+        """
+        return self._listings.get(episode, [])
+
+    def cumulative_history(self, episode):
+        """
+        Return the cumulative history of an episode as page text.
+        """
+        response = self._request("GET", "cumulative_history", {"EpisodeNumber": episode})
+        content = html_to_text(response.text)
+        if content == '':
+            raise ValueError("Copied content is empty. Must retry")
+        return content
+
+    def finish(self):
+        """
+        Nothing to tidy up between patients over HTTP.
+        """
+
+    def record_patient(self, answered):
+        """
+        Record whether the site answered a patient's requests as expected. After
+        GIVE_UP_AFTER patients in a row that it did not, the backend stops being
+        used, so a mismatch with the site does not cost every patient a round trip.
+        """
+        with self._record_lock:
+            self.fallbacks_in_a_row = 0 if answered else self.fallbacks_in_a_row + 1
+            if self.usable and self.fallbacks_in_a_row >= GIVE_UP_AFTER:
+                print(f"HTTP backend failed for {GIVE_UP_AFTER} patients in a row, using the browser from now on")
+                self.usable = False
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    mrn TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    lab_count INTEGER,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labs (
+    mrn TEXT NOT NULL,
+    lab INTEGER NOT NULL,
+    episode TEXT NOT NULL,
+    content TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (mrn, lab)
+);
+"""
+
+PENDING = 'pending'
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobStore:
+    """
+    Persistent record of which patients and labs have been scraped, in SQLite.
+
+    Each lab's content is saved as soon as it is captured, so a patient that fails
+    half way resumes from its first incomplete lab on the next run instead of
+    starting over. Checkpoints are dropped once a patient is done. One store can
+    be shared by all worker threads.
+    """
+    def __init__(self, path="jobs.sqlite"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock, self._connection:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def enqueue(self, mrns, rerun_done=False):
+        """
+        Add patients to the store and return the ones still to scrape, in input order.
+        Duplicate MRNs are collapsed. Finished patients are left out unless rerun_done is set.
+        """
+        unique_mrns = list(dict.fromkeys(str(mrn) for mrn in mrns))
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO patients (mrn, state, updated_at) VALUES (?, ?, ?)",
+                [(mrn, PENDING, now) for mrn in unique_mrns])
+            if rerun_done:
+                # Labs left over from an earlier finished run must be fetched again
+                self._connection.executemany(
+                    "DELETE FROM labs WHERE mrn IN (SELECT mrn FROM patients WHERE mrn = ? AND state = ?)",
+                    [(mrn, DONE) for mrn in unique_mrns])
+                self._connection.executemany(
+                    "UPDATE patients SET state = ?, updated_at = ? WHERE mrn = ? AND state = ?",
+                    [(PENDING, now, mrn, DONE) for mrn in unique_mrns])
+            states = dict(self._connection.execute("SELECT mrn, state FROM patients").fetchall())
+        return [mrn for mrn in unique_mrns if states[mrn] != DONE]
+
+    def start_patient(self, mrn, lab_count):
+        """
+        Mark a patient as in progress and return the labs already captured as {lab: (episode, content)}.
+        Checkpoints are dropped if the number of labs changed since they were taken,
+        because the labs are then no longer in the same rows.
+        """
+        mrn = str(mrn)
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT lab_count FROM patients WHERE mrn = ?", (mrn,)).fetchone()
+            if row is not None and row[0] is not None and row[0] != lab_count:
+                print(f"Lab count for {mrn} changed from {row[0]} to {lab_count}, discarding checkpoints")
+                self._connection.execute("DELETE FROM labs WHERE mrn = ?", (mrn,))
+            self._connection.execute(
+                "INSERT INTO patients (mrn, state, lab_count, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(mrn) DO UPDATE SET state = excluded.state, lab_count = excluded.lab_count, "
+                "error = NULL, updated_at = excluded.updated_at",
+                (mrn, IN_PROGRESS, lab_count, time.time()))
+            rows = self._connection.execute("SELECT lab, episode, content FROM labs WHERE mrn = ?", (mrn,)).fetchall()
+        return {lab: (episode, content) for lab, episode, content in rows}
+
+    def save_lab(self, mrn, lab, episode, content):
+        """
+        Checkpoint the content of one lab.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO labs (mrn, lab, episode, content, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (str(mrn), lab, str(episode), content, time.time()))
+
+    def finish_patient(self, mrn):
+        """
+        Mark a patient as done and drop their lab checkpoints, which are only
+        kept to resume patients that did not finish.
+        """
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE patients SET state = ?, error = NULL, updated_at = ? WHERE mrn = ?",
+                                     (DONE, time.time(), str(mrn)))
+            self._connection.execute("DELETE FROM labs WHERE mrn = ?", (str(mrn),))
+
+    def fail_patient(self, mrn, error):
+        self._execute("UPDATE patients SET state = ?, error = ?, updated_at = ? WHERE mrn = ?",
+                      (FAILED, str(error), time.time(), str(mrn)))
+
+    def patient_state(self, mrn):
+        """
+        Return (state, lab_count, labs captured, error) for a patient, or None if unknown.
+        """
+        rows = self._execute(
+            "SELECT state, lab_count, (SELECT COUNT(*) FROM labs WHERE labs.mrn = patients.mrn), error "
+            "FROM patients WHERE mrn = ?", (str(mrn),))
+        return rows[0] if rows else None
+
+    def close(self):
+        with self._lock:  # Not while another thread is mid-query
+            self._connection.close()
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+
+
+def fingerprint(*parts):
+    """
+    Return a short stable hash of the given values, used as a parser version.
+    Pass everything the parser output depends on, e.g. its pattern dicts.
+    """
+    text = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+def hash_file(path):
+    """
+    Return the sha256 of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Record of processed input files, stored as JSON.
+
+    Each entry keeps the input file's content hash, size and modification time, the
+    parser version that processed it and the output it produced. A file is only
+    processed again when its content, the parser version or its output changes.
+
+    Parsers with a pattern per test can also record a fingerprint of each pattern
+    and the tests the file produced. A changed pattern then only sends back the
+    files that produced its test, or whose text holds its keyword and so could
+    match it now, instead of every file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                self.entries = json.load(file)
+
+    def is_current(self, input_path, parser_version, patterns=None, keywords=None):
+        """
+        Check whether input_path was already processed by this parser version.
+        Unchanged files are recognised from their size and modification time
+        alone; the content is only hashed when those differ.
+
+        patterns is {test: fingerprint of its pattern} and keywords {test: lowercase
+        text every match of the pattern contains}. A test without a keyword could
+        match any file.
+        """
+        entry = self.entries.get(os.path.abspath(input_path))
+        if entry is None or entry['parser_version'] != parser_version:
+            return False
+        if entry['output'] is not None and not os.path.exists(entry['output']):
+            return False
+
+        stat = os.stat(input_path)
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            if stat.st_size != entry['size'] or hash_file(input_path) != entry['sha256']:
+                return False
+            # Touched but unchanged, remember the new modification time
+            entry['mtime_ns'] = stat.st_mtime_ns
+        return patterns is None or self._patterns_current(entry, input_path, patterns, keywords or {})
+
+    def _patterns_current(self, entry, input_path, patterns, keywords):
+        recorded = entry.get('patterns')
+        if recorded is None:
+            return False
+        changed = {test for test in patterns.keys() | recorded.keys() if patterns.get(test) != recorded.get(test)}
+        if not changed:
+            return True
+        if entry.get('tests') is None or changed & set(entry['tests']):
+            return False
+        added = [test for test in changed if test in patterns]
+        if added:
+            if any(keywords.get(test) is None for test in added):
+                return False
+            with open(input_path, 'r', encoding='utf-8', errors='ignore') as file:
+                text = file.read().lower()
+            if any(keywords[test] in text for test in added):
+                return False
+        # None of the changed patterns can match the file, so its output stands
+        entry['patterns'] = dict(patterns)
+        return True
+
+    def record(self, input_path, parser_version, output_path, patterns=None, tests=None):
+        """
+        Record that input_path was processed into output_path (None if it had no results),
+        optionally with the pattern fingerprints used and the tests it produced.
+        """
+        stat = os.stat(input_path)
+        self.entries[os.path.abspath(input_path)] = {
+            'sha256': hash_file(input_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'parser_version': parser_version,
+            'output': output_path,
+            'patterns': None if patterns is None else dict(patterns),
+            'tests': None if tests is None else sorted(tests),
+        }
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,383 @@
+"""
+Offline stand-in for the TrakCare lab web view, for measuring the scraper
+without touching the production system.
+
+Serves a small page with the element IDs transcribe.py clicks through (logon
+form, find list, lab rows, episode lists, action menu and cumulative history
+view) and the endpoints http_backend.HttpBackend calls, backed by synthetic
+patients from synthetic.py. Any MRN is found, unless it falls in missing_rate.
+Latency and failures can be injected, and sessions made to expire.
+
+Start it with
+    python mock_trakcare.py --port 8765 --latency 0.2 --failure-rate 0.02
+and point transcribe.main(site_url="http://127.0.0.1:8765") or
+HttpBackend(credentials, base_url="http://127.0.0.1:8765") at it.
+"""
+import argparse
+import html
+import json
+import random
+import threading
+import time
+import uuid
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from http_backend import ENDPOINTS, LOGON_MARKER
+from synthetic import generate_patient
+
+HOME_PATH = "/trakcarelab/csp/system.Home.cls"
+SESSION_COOKIE = "CSPSESSIONID"
+
+# The page behind HOME_PATH. Views are picked by the address after the #, like the
+# real site, and a stand-in for AngularJS's $http lets waits.network_idle see
+# requests still in flight.
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>TrakCare Lab WebView (offline)</title>
+<style>.hidden { display: none; } md-icon { display: inline-block; padding: 2px 6px; cursor: pointer; }</style>
+</head><body>
+<div id="logon"></div>
+<div id="history" class="hidden"></div>
+<script>
+var ENDPOINTS = __ENDPOINTS__;
+var LOGON = '#/Component/SSUser.Logon';
+var FIND = '#/Component/web.DEBDebtor.FindList';
+var HISTORY = '#/Component/web.EPVisitTestSet.CumulativeHistoryView';
+var http = {pendingRequests: []};
+window.angular = {element: function () { return {injector: function () { return {get: function () { return http; }}; }}; }};
+var menuEpisode = null;
+
+function request(method, path, params, form) {
+    var pending = {};
+    http.pendingRequests.push(pending);
+    var options = {method: method, credentials: 'same-origin'};
+    if (form) { options.body = new URLSearchParams(form); }
+    return fetch(path + (params ? '?' + new URLSearchParams(params) : ''), options).then(function (response) {
+        if (response.status === 401) { logOut(); throw new Error('Session expired'); }
+        if (!response.ok) { throw new Error(response.status + ' ' + response.statusText); }
+        return response;
+    }).finally(function () {
+        http.pendingRequests.splice(http.pendingRequests.indexOf(pending), 1);
+    });
+}
+
+function byId(id) { return document.getElementById(id); }
+
+function logOut() {
+    sessionStorage.removeItem('loggedIn');
+    if (byId('find')) { byId('find').remove(); }
+    if (location.hash !== LOGON) { location.hash = LOGON; } else { route(); }
+}
+
+function showLogon() {
+    byId('history').classList.add('hidden');
+    if (byId('SSUser_Logon_0-item-USERNAME')) { return; }
+    byId('logon').innerHTML = 'Username <input id="SSUser_Logon_0-item-USERNAME"> ' +
+        'Password <input id="SSUser_Logon_0-item-PASSWORD" type="password">';
+    byId('SSUser_Logon_0-item-PASSWORD').addEventListener('keydown', function (event) {
+        if (event.key !== 'Enter') { return; }
+        request('POST', ENDPOINTS.login, null, {USERNAME: byId('SSUser_Logon_0-item-USERNAME').value,
+                                                PASSWORD: byId('SSUser_Logon_0-item-PASSWORD').value})
+            .then(function (response) { return response.text(); })
+            .then(function (text) {
+                if (text.indexOf('SSUser_Logon_0-item-USERNAME') !== -1) { return; }
+                sessionStorage.setItem('loggedIn', '1');
+                byId('logon').innerHTML = '';
+                if (location.hash !== FIND) { location.hash = FIND; } else { route(); }
+            });
+    });
+}
+
+function buildFind() {
+    var find = document.createElement('div');
+    find.id = 'find';
+    find.innerHTML = '<div>Patient Find</div>' +
+        'MRN <input id="web_DEBDebtor_FindList_0-item-HospitalMRN"> ' +
+        'Surname <input id="web_DEBDebtor_FindList_0-item-SurnameParam">' +
+        '<div id="find-rows"></div>' +
+        '<div id="tc_ActionMenu" class="hidden"><a id="tc_ActionMenu-link-CumulativeHistory" href="javascript:void(0)">Cumulative History</a></div>';
+    document.body.insertBefore(find, byId('history'));
+    byId('web_DEBDebtor_FindList_0-item-HospitalMRN').addEventListener('keydown', function (event) {
+        if (event.key === 'Enter') { search(event.target.value); }
+    });
+    byId('tc_ActionMenu-link-CumulativeHistory').addEventListener('click', function () {
+        location.hash = HISTORY + '?EpisodeNumber=' + encodeURIComponent(menuEpisode);
+    });
+}
+
+function search(mrn) {
+    var rows = byId('find-rows');
+    rows.innerHTML = '';
+    byId('tc_ActionMenu').classList.add('hidden');
+    request('GET', ENDPOINTS.patient_search, {HospitalMRN: mrn})
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+            if (!data.rows.length) { rows.innerHTML = '<div>No matching records</div>'; return; }
+            data.rows.forEach(function (row, lab) {
+                var item = document.createElement('div');
+                item.innerHTML = '<md-icon id="web_DEBDebtor_FindList_0-row-' + lab + '-item-Episodes">folder</md-icon> ' +
+                    row.TestSet + '<div class="episodes"></div>';
+                item.querySelector('md-icon').addEventListener('click', function () {
+                    toggle(lab, row.DebtorID, item.querySelector('.episodes'));
+                });
+                rows.appendChild(item);
+            });
+        });
+}
+
+function toggle(lab, debtor, list) {
+    byId('tc_ActionMenu').classList.add('hidden');
+    if (list.childElementCount) { list.innerHTML = ''; return; }
+    request('GET', ENDPOINTS.episode_list, {DebtorID: debtor})
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+            data.rows.forEach(function (row, index) {
+                var prefix = 'web_EPVisitNumber_List_' + lab + '_0-row-' + index;
+                var item = document.createElement('div');
+                item.innerHTML = '<button id="' + prefix + '-misc-actionButton">&#8942;</button> ' +
+                    '<span id="' + prefix + '-item-EpisodeNumber">' + row.EpisodeNumber + ' ' + (row.DateCollected || '') + '</span>';
+                item.querySelector('button').addEventListener('click', function () {
+                    menuEpisode = row.EpisodeNumber;
+                    item.appendChild(byId('tc_ActionMenu'));
+                    byId('tc_ActionMenu').classList.remove('hidden');
+                });
+                list.appendChild(item);
+            });
+        });
+}
+
+function showHistory(episode) {
+    byId('find').classList.add('hidden');
+    var view = byId('history');
+    view.innerHTML = '';
+    view.classList.remove('hidden');
+    request('GET', ENDPOINTS.cumulative_history, {EpisodeNumber: episode})
+        .then(function (response) { return response.text(); })
+        .then(function (body) {
+            view.innerHTML = '<div id="web_EPVisitTestSet_CumulativeHistoryView_0-header-caption">Episode Cumulative Results</div>' + body;
+        });
+}
+
+function route() {
+    var hash = decodeURIComponent(location.hash);
+    if (hash !== LOGON && sessionStorage.getItem('loggedIn') && !byId('find')) { buildFind(); }
+    if (hash.indexOf(HISTORY) === 0 && byId('find')) {
+        showHistory(new URLSearchParams(hash.split('?')[1] || '').get('EpisodeNumber'));
+    } else if (hash === FIND && byId('find')) {
+        byId('history').classList.add('hidden');
+        byId('find').classList.remove('hidden');
+    } else {
+        sessionStorage.removeItem('loggedIn');
+        if (byId('find')) { byId('find').remove(); }
+        showLogon();
+    }
+}
+
+window.addEventListener('hashchange', route);
+route();
+</script>
+</body></html>
+"""
+
+
+def text_to_html(text):
+    """
+    Lay out cumulative history text as HTML whose text reads back the same:
+    runs of tab separated lines become table rows and other lines blocks.
+    """
+    parts = []
+    in_table = False
+    for line in text.split("\n"):
+        if "\t" in line:
+            if not in_table:
+                parts.append("<table>")
+                in_table = True
+            parts.append("<tr>" + "".join(f"<td>{html.escape(cell)}</td>" for cell in line.split("\t")) + "</tr>")
+            continue
+        if in_table:
+            parts.append("</table>")
+            in_table = False
+        parts.append(f"<div>{html.escape(line)}</div>" if line.strip() else "<div><br></div>")
+    if in_table:
+        parts.append("</table>")
+    return "\n".join(parts)
+
+
+class MockTrakCare:
+    """
+    State of the stand-in site: synthetic patients, sessions and injected faults.
+
+    Every data request waits latency seconds, varied by up to jitter either way
+    (0.5 for +-50%), and fails with a 503 at failure_rate. Sessions expire
+    session_ttl seconds after login, if given. A missing_rate share of MRNs has
+    no records. labs and episodes are the (fewest, most) ranges of each patient.
+    """
+    def __init__(self, latency=0.2, jitter=0.5, failure_rate=0.0, session_ttl=None, missing_rate=0.0,
+                 seed=0, labs=(2, 8), episodes=(1, 12)):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.session_ttl = session_ttl
+        self.missing_rate = missing_rate
+        self.seed = seed
+        self.labs = labs
+        self.episodes = episodes
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._patients = {}
+        self._episodes = {}  # Episode number to (MRN, lab)
+        self._sessions = {}  # Session id to expiry time, None if it never expires
+        self.counts = {}  # Requests served by kind, with injected failures and expired sessions
+
+    def count(self, kind):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def patient(self, mrn):
+        with self._lock:
+            if mrn not in self._patients:
+                missing = random.Random(f"{self.seed}:missing:{mrn}").random() < self.missing_rate
+                labs = [] if missing else generate_patient(mrn, self.seed, self.labs, self.episodes)
+                self._patients[mrn] = labs
+                for lab, content in enumerate(labs):
+                    for episode, _ in content["episodes"]:
+                        self._episodes[episode] = (mrn, lab)
+            return self._patients[mrn]
+
+    def lab_of(self, episode):
+        with self._lock:
+            mrn, lab = self._episodes.get(episode, (None, None))
+        return None if mrn is None else self.patient(mrn)[lab]
+
+    def delay(self):
+        with self._lock:
+            factor = self._rng.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(max(self.latency * factor, 0))
+
+    def injected_failure(self):
+        with self._lock:
+            return self._rng.random() < self.failure_rate
+
+    def login(self):
+        session = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session] = time.monotonic() + self.session_ttl if self.session_ttl else None
+        return session
+
+    def valid_session(self, session):
+        with self._lock:
+            if session not in self._sessions:
+                return False
+            expiry = self._sessions[session]
+            return expiry is None or time.monotonic() < expiry
+
+
+def make_handler(site):
+    login_page = f'<html><body><input id="{LOGON_MARKER}"></body></html>'.encode("utf-8")
+    page = PAGE.replace("__ENDPOINTS__", json.dumps(ENDPOINTS)).encode("utf-8")
+    steps = {path: step for step, path in ENDPOINTS.items()}
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type="text/html; charset=utf-8", headers=()):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in headers:
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, value):
+            self._send(200, json.dumps(value).encode("utf-8"), "application/json")
+
+        def _session(self):
+            cookie = SimpleCookie(self.headers.get("Cookie", ""))
+            return cookie[SESSION_COOKIE].value if SESSION_COOKIE in cookie else None
+
+        def _serve(self):
+            url = urlsplit(self.path)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                query.update({name: values[-1] for name, values in parse_qs(self.rfile.read(length).decode("utf-8")).items()})
+
+            if url.path in ("/", HOME_PATH):
+                self._send(200, page)
+                return
+            step = steps.get(url.path)
+            if step is None:
+                self._send(404, b"Not found")
+                return
+
+            site.count(step)
+            site.delay()
+            if site.injected_failure():
+                site.count("injected_failure")
+                self._send(503, b"Service Unavailable")
+                return
+
+            if step == "login":
+                session = site.login()
+                self._send(200, b"<html><body>Logged in</body></html>",
+                           headers=[("Set-Cookie", f"{SESSION_COOKIE}={session}; Path=/")])
+                return
+            if not site.valid_session(self._session()):
+                site.count("session_expired")
+                self._send(401, login_page)
+                return
+
+            if step == "patient_search":
+                mrn = query.get("HospitalMRN", "").strip()
+                self._json({"rows": [{"DebtorID": f"{mrn}-{lab}", "TestSet": content["name"]}
+                                     for lab, content in enumerate(site.patient(mrn))]})
+            elif step == "episode_list":
+                mrn, _, lab = query.get("DebtorID", "").rpartition("-")
+                labs = site.patient(mrn)
+                rows = labs[int(lab)]["episodes"] if lab.isdigit() and int(lab) < len(labs) else []
+                self._json({"rows": [{"EpisodeNumber": episode, "DateCollected": collected} for episode, collected in rows]})
+            else:
+                content = site.lab_of(query.get("EpisodeNumber", ""))
+                if content is None:
+                    self._send(404, b"Unknown episode")
+                    return
+                self._send(200, ("<html><body>" + text_to_html(content["text"]) + "</body></html>").encode("utf-8"))
+
+        do_GET = _serve
+        do_POST = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+def start_server(site, port=0):
+    """
+    Serve the site on localhost in a background thread.
+    Returns the server; its base URL is http://127.0.0.1:<server.server_port>.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve an offline stand-in for the TrakCare lab web view.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds every data request takes")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Share the latency varies by either way")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with a 503")
+    parser.add_argument("--session-ttl", type=float, help="Seconds a login lasts")
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="Share of MRNs without records")
+    parser.add_argument("--labs", type=int, nargs=2, default=(2, 8), metavar=("FEWEST", "MOST"))
+    parser.add_argument("--episodes", type=int, nargs=2, default=(1, 12), metavar=("FEWEST", "MOST"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    site = MockTrakCare(args.latency, args.jitter, args.failure_rate, args.session_ttl, args.missing_rate,
+                        args.seed, tuple(args.labs), tuple(args.episodes))
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(site))
+    print(f"Serving the offline TrakCare on http://127.0.0.1:{args.port}{HOME_PATH}")
+    server.serve_forever()
@@ -0,0 +1,152 @@
+import queue
+import threading
+import traceback
+import pandas as pd
+from timing import spans
+from translate import consolidate_fbc_data, parse_lab_results, combine_results, save_translation, lab_tests
+
+_STOP = object()
+
+
+def merge_fbc_frames(frames):
+    """
+    Merge per-lab Full Blood Count frames in lab order.
+    Where labs overlap the earlier lab wins, as the first result is the one kept
+    when the whole text is parsed at once.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    merged = frames[0]
+    for frame in frames[1:]:
+        merged = merged.combine_first(frame)
+    return merged[columns]
+
+def merge_chem_frames(frames):
+    """
+    Merge per-lab chemistry frames in lab order.
+    A later lab's result replaces an earlier one for the same date and test,
+    as with later episodes when the whole text is parsed at once. Only the '-'
+    placeholder counts as no result; any other value, None included, is kept.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    results = {}
+    for frame in frames:
+        for date, row in frame.to_dict(orient='index').items():
+            merged = results.setdefault(date, {test: '-' for test in lab_tests})
+            for test, value in row.items():
+                if not (isinstance(value, str) and value == '-'):
+                    merged[test] = value
+    return pd.DataFrame.from_dict(results, orient='index')
+
+
+class LabPipeline:
+    """
+    Parse labs while the scrapers are still capturing the next ones.
+
+    Scraper threads push each lab's content with submit_lab as soon as it is
+    captured and call finish_patient once all of a patient's labs are in. Parser
+    threads take labs off a bounded queue, so scrapers block when parsing falls
+    behind. Each lab is parsed on its own; when the last lab of a patient is
+    parsed the labs are merged in lab order and the patient's sheet is written.
+    With text_folder set, the patient's text file is written as well.
+    """
+    def __init__(self, parse_workers=2, queue_size=20, text_folder=None):
+        self.text_folder = text_folder
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._patients = {}
+        self.outputs = {}
+        self.errors = {}
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(parse_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _state(self, patient):
+        return self._patients.setdefault(patient, {"contents": {}, "parsed": {}, "expected": None, "failed": None})
+
+    def submit_lab(self, patient, lab, content):
+        """
+        Queue one lab's content for parsing. Blocks while the queue is full.
+        """
+        with self._lock:
+            self._state(patient)["contents"][lab] = content
+        self._queue.put((patient, lab, content))
+
+    def finish_patient(self, patient, lab_count):
+        """
+        Mark that all lab_count labs of a patient have been submitted.
+        """
+        with self._lock:
+            state = self._state(patient)
+            state["expected"] = lab_count
+            ready = len(state["parsed"]) == lab_count
+        if ready:
+            self._finalise(patient)
+
+    def discard_patient(self, patient):
+        """
+        Forget a patient's labs, e.g. before scraping them again on another backend.
+        """
+        with self._lock:
+            self._patients.pop(patient, None)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            patient, lab, content = item
+            try:
+                with spans.span("translate.extract", patient=str(patient), lab=lab, size=len(content)):
+                    parsed = (consolidate_fbc_data(content), parse_lab_results(content))
+                failure = None
+            except Exception as e:
+                parsed, failure = None, f"Lab {lab}: {type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+            with self._lock:
+                state = self._patients.get(patient)
+                if state is None or state["contents"].get(lab) is not content:
+                    continue  # Discarded or submitted again since
+                state["parsed"][lab] = parsed
+                state["failed"] = state["failed"] or failure
+                ready = state["expected"] is not None and len(state["parsed"]) == state["expected"]
+            if ready:
+                self._finalise(patient)
+
+    def _finalise(self, patient):
+        with self._lock:
+            state = self._patients.pop(patient, None)
+        if state is None:
+            return
+        labs = sorted(state["parsed"])
+
+        try:
+            if self.text_folder is not None:
+                with open(self.text_folder + str(patient) + '.txt', 'w', encoding='utf-8') as file:
+                    for lab in labs:
+                        file.write(f"\n Lab : {lab} {state['contents'][lab]}\n")
+            if state["failed"]:
+                raise ValueError(state["failed"])
+
+            fbc_df = merge_fbc_frames([state["parsed"][lab][0] for lab in labs])
+            chem_df = merge_chem_frames([state["parsed"][lab][1] for lab in labs])
+            self.outputs[patient] = save_translation(combine_results(fbc_df, chem_df), patient)
+        except Exception as e:
+            print(f"Could not build the sheet for patient {patient}: {e}")
+            self.errors[patient] = str(e)
+
+    def close(self):
+        """
+        Wait for every queued lab to be parsed and stop the parser threads.
+        Returns the number of patients whose sheet could not be built.
+        """
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        print(f"Pipeline built {len(self.outputs)} sheets, {len(self.errors)} failed.")
+        return len(self.errors)
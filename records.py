@@ -0,0 +1,78 @@
+import json
+import os
+import re
+from collections import defaultdict
+from sle import consolidate_results, save_sheet
+
+# Fields of a structured result record, as serialised from the cumulative history table
+RECORD_FIELDS = ["test", "value", "flag", "unit", "reference_range", "collected", "episode", "lab"]
+
+flag_pattern = re.compile(r"^(.*?\d)\s*([HL])$")
+number_pattern = re.compile(r"^([<>]?)\s*(\d+(?:\.\d*)?|\.\d+)$")
+
+
+def split_flag(value):
+    """
+    Split a trailing H/L flag off a value: "2.1 H" gives ("2.1", "H"), "56" gives ("56", "").
+    """
+    value = (value or "").strip()
+    match = flag_pattern.match(value)
+    if match:
+        return match.group(1), match.group(2)
+    return value, ""
+
+def parse_result(raw):
+    """
+    Split a raw result into its number, comparator and H/L flag: "2.1 H" gives
+    (2.1, "", "H") and ">60" gives (60.0, ">", ""). Results that are not a number,
+    e.g. "Negative", give None for the number.
+    """
+    value, flag = split_flag(raw)
+    match = number_pattern.match(value)
+    if not match:
+        return None, "", flag
+    return float(match.group(2)), match.group(1), flag
+
+def normalise_records(raw_records, lab=None):
+    """
+    Fill in every record field and move flags written into the value to the flag field.
+    """
+    records = []
+    for raw in raw_records:
+        record = {field: (raw.get(field) or "") for field in RECORD_FIELDS}
+        value, flag = split_flag(record["value"])
+        record["value"] = value
+        record["flag"] = record["flag"].strip() or flag
+        if lab is not None:
+            record["lab"] = lab
+        records.append(record)
+    return records
+
+def records_to_results(records):
+    """
+    Group records into {test: {date: value}}, the shape sle.extract_results_from_lines
+    returns, with the flag after the value as in the page text (e.g. "2.1 H").
+    """
+    results = defaultdict(dict)
+    for record in records:
+        if not record["collected"] or not record["test"]:
+            continue
+        value = f"{record['value']} {record['flag']}" if record["flag"] else record["value"]
+        results[record["test"]][record["collected"]] = value
+    return results
+
+def save_records(records, patient_id, records_folder, sheets_folder):
+    """
+    Save a patient's records as JSON and build their sheet straight from them.
+    Returns the sheet path, or None when there were no dated results.
+    """
+    os.makedirs(records_folder, exist_ok=True)
+    os.makedirs(sheets_folder, exist_ok=True)
+    with open(os.path.join(records_folder, f"{patient_id}.json"), 'w', encoding='utf-8') as file:
+        json.dump(records, file, indent=1)
+
+    results = records_to_results(records)
+    if not results:
+        print(f"No dated results in the records for {patient_id}.")
+        return None
+    return save_sheet(consolidate_results(results), patient_id, sheets_folder)
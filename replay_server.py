@@ -0,0 +1,76 @@
+"""
+Local stand-in for the TrakCare endpoints that replays recorded responses.
+
+Record a session with HttpBackend(record_to="session.jsonl"), then serve it with
+    python replay_server.py session.jsonl --port 8765
+and point the backend at it with HttpBackend(credentials, base_url="http://127.0.0.1:8765").
+Requests are matched on method, path and query string; unknown requests get a 404.
+"""
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+
+def load_recording(path):
+    """
+    Load a JSON lines recording into {(method, path, query): response}.
+    The last response recorded for a request wins.
+    """
+    responses = {}
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                exchange = json.loads(line)
+                responses[(exchange["method"], exchange["path"], exchange["query"])] = exchange
+    return responses
+
+def make_handler(responses):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        def _replay(self):
+            url = urlsplit(self.path)
+            query = urlencode(sorted(parse_qsl(url.query)))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+
+            exchange = responses.get((self.command, url.path, query))
+            if exchange is None:
+                self.send_error(404, f"No recorded response for {self.command} {self.path}")
+                return
+
+            body = exchange["body"].encode("utf-8")
+            self.send_response(exchange["status"])
+            self.send_header("Content-Type", exchange["content_type"])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = _replay
+        do_POST = _replay
+
+        def log_message(self, format, *args):
+            pass
+
+    return ReplayHandler
+
+def start_server(recording_path, port=0):
+    """
+    Serve a recording on localhost in a background thread.
+    Returns the server; its base URL is http://127.0.0.1:<server.server_port>.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(load_recording(recording_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded TrakCare responses.")
+    parser.add_argument("recording", help="JSON lines file written by HttpBackend(record_to=...)")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(load_recording(args.recording)))
+    print(f"Replaying {args.recording} on http://127.0.0.1:{args.port}")
+    server.serve_forever()
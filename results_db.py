@@ -0,0 +1,187 @@
+import argparse
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from records import parse_result
+
+DB_PATH = "results.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    source TEXT NOT NULL,
+    patient TEXT NOT NULL,
+    test TEXT NOT NULL,
+    collected TEXT NOT NULL,
+    raw TEXT NOT NULL,
+    numeric REAL,
+    comparator TEXT NOT NULL,
+    flag TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    PRIMARY KEY (source, patient, test, collected)
+);
+CREATE INDEX IF NOT EXISTS results_test_collected ON results (test, collected, numeric);
+CREATE INDEX IF NOT EXISTS results_patient_test ON results (patient, test, collected);
+"""
+
+relative_since_pattern = re.compile(r"^(\d+)\s*([dwmy])$")
+RELATIVE_DAYS = {"d": 1, "w": 7, "m": 30.44, "y": 365.25}
+
+
+def since_date(since, today=None):
+    """
+    Turn a yyyy-mm-dd date, or a period back from today such as "6m", "90d",
+    "2w" or "1y", into a yyyy-mm-dd date.
+    """
+    match = relative_since_pattern.match(since.strip().lower())
+    if not match:
+        return date.fromisoformat(since.strip()).isoformat()
+    days = int(match.group(1)) * RELATIVE_DAYS[match.group(2)]
+    return ((today or date.today()) - timedelta(days=round(days))).isoformat()
+
+
+class ResultsDatabase:
+    """
+    Results of every patient in SQLite, one row per source, patient, test and
+    collected date, for questions across patients.
+
+    Values are parsed when they are loaded: "2.1 H" is kept as 2.1 with flag H and
+    ">60" as 60 with comparator ">", next to the raw value. Indexes on
+    (test, collected) and (patient, test) serve cohort queries and time series;
+    the numeric value in the first lets value filters run on the index alone, and
+    the date in the second returns time series already in order.
+    """
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(SCHEMA)
+        self._connection.commit()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def load(self, source, rows, patient=None):
+        """
+        Load a frame of results store rows from the given source, replacing what was
+        loaded before for the same patients. Returns the number of rows loaded.
+        With the patient they belong to given, no rows removes what was loaded for them.
+        """
+        if rows is None or rows.empty:
+            if patient is not None:
+                with self._lock, self._connection:
+                    self._connection.execute("DELETE FROM results WHERE source = ? AND patient = ?", (source, str(patient)))
+            return 0
+        records = []
+        for patient, test, collected, raw, unit in zip(rows["patient"], rows["test"], rows["collected"],
+                                                       rows["raw"], rows["unit"]):
+            numeric, comparator, flag = parse_result(raw)
+            records.append((source, str(patient), test, collected.isoformat(), raw, numeric, comparator, flag, unit))
+        with self._lock, self._connection:
+            self._connection.executemany("DELETE FROM results WHERE source = ? AND patient = ?",
+                                         [(source, patient) for patient in dict.fromkeys(record[1] for record in records)])
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results (source, patient, test, collected, raw, numeric, comparator, flag, unit)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+        return len(records)
+
+    def series(self, patient, test, source=None):
+        """
+        Return a patient's results for a test, oldest first, as
+        (collected, raw, numeric, comparator, flag, unit, source) tuples.
+        """
+        sql = ("SELECT collected, raw, numeric, comparator, flag, unit, source FROM results"
+               " WHERE patient = ? AND test = ?")
+        parameters = [str(patient), test]
+        if source is not None:
+            sql += " AND source = ?"
+            parameters.append(source)
+        return self._execute(sql + " ORDER BY collected", parameters)
+
+    def cohort(self, test, above=None, below=None, since=None, until=None, flag=None, source=None):
+        """
+        Return the results of a test matching every given filter, as
+        (patient, collected, raw, numeric, flag, source) tuples ordered by patient and date.
+        above and below compare the numeric value, since and until (yyyy-mm-dd) the
+        collected date, and flag is "H" or "L".
+        """
+        sql = "SELECT patient, collected, raw, numeric, flag, source FROM results WHERE test = ?"
+        parameters = [test]
+        for condition, value in (("collected >= ?", since), ("collected <= ?", until),
+                                 ("numeric > ?", above), ("numeric < ?", below),
+                                 ("flag = ?", flag), ("source = ?", source)):
+            if value is not None:
+                sql += " AND " + condition
+                parameters.append(value)
+        return self._execute(sql + " ORDER BY patient, collected", parameters)
+
+    def tests(self):
+        """
+        Return every test with its number of results and patients.
+        """
+        return self._execute("SELECT test, COUNT(*), COUNT(DISTINCT patient) FROM results GROUP BY test ORDER BY test")
+
+    def close(self):
+        self._connection.close()
+
+
+def load_store(database, store_folder):
+    """
+    Load every source of a results store into the database.
+    """
+    from results_store import ResultsStore
+    store = ResultsStore(store_folder)
+    for source in store.sources():
+        print(f"Loaded {database.load(source, store.read(source))} {source} results.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query lab results across patients.")
+    parser.add_argument("--db", default=DB_PATH, help="Results database")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    series_parser = commands.add_parser("series", help="One patient's results for a test over time")
+    series_parser.add_argument("patient")
+    series_parser.add_argument("test")
+    series_parser.add_argument("--source")
+
+    cohort_parser = commands.add_parser("cohort", help="Results of a test across patients")
+    cohort_parser.add_argument("test")
+    cohort_parser.add_argument("--above", type=float, help="Numeric value above this")
+    cohort_parser.add_argument("--below", type=float, help="Numeric value below this")
+    cohort_parser.add_argument("--since", help="Collected on or after a yyyy-mm-dd date, or e.g. 6m, 90d")
+    cohort_parser.add_argument("--until", help="Collected on or before a yyyy-mm-dd date")
+    cohort_parser.add_argument("--flag", choices=["H", "L"])
+    cohort_parser.add_argument("--source")
+    cohort_parser.add_argument("--patients", action="store_true", help="Only list the matching patients")
+
+    commands.add_parser("tests", help="Tests with their number of results and patients")
+
+    load_parser = commands.add_parser("load-store", help="Load a results store into the database")
+    load_parser.add_argument("--store", default="results store//", help="Results store folder")
+    args = parser.parse_args()
+
+    database = ResultsDatabase(args.db)
+    start = time.perf_counter()
+    if args.command == "series":
+        rows = database.series(args.patient, args.test, args.source)
+    elif args.command == "cohort":
+        rows = database.cohort(args.test, args.above, args.below, args.since and since_date(args.since),
+                               args.until, args.flag, args.source)
+        if args.patients:
+            rows = [(patient,) for patient in dict.fromkeys(row[0] for row in rows)]
+    elif args.command == "tests":
+        rows = database.tests()
+    else:
+        load_store(database, args.store)
+        rows = []
+    elapsed = time.perf_counter() - start
+
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+    if args.command != "load-store":
+        print(f"{len(rows)} rows in {elapsed * 1000:.1f} ms")
+    database.close()
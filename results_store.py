@@ -0,0 +1,220 @@
+import argparse
+import os
+import time
+import uuid
+from datetime import date, datetime
+import pandas as pd
+from records import parse_result
+from sle import consolidate_results, save_sheet
+from translate import save_translation, translation_sheet
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:  # Only the results store needs pyarrow
+    pa = pc = ipc = None
+
+STORE_FOLDER = "results store//"
+STORE_COLUMNS = ["patient", "test", "collected", "raw", "numeric", "flag", "unit"]
+SHEET_SOURCES = ("sle", "translate")  # Sources export_excel can lay out as sheets
+FLUSH_ROWS = 200000  # Rows buffered before they are written out as a new part file
+
+
+def store_schema():
+    return pa.schema([
+        ("patient", pa.string()),
+        ("test", pa.string()),
+        ("collected", pa.date32()),
+        ("raw", pa.string()),
+        ("numeric", pa.float64()),
+        ("flag", pa.string()),
+        ("unit", pa.string()),
+    ])
+
+def to_date(collected):
+    """
+    Return a collected date as a date, from a date or a dd/mm/yyyy string.
+    """
+    if isinstance(collected, datetime):
+        return collected.date()
+    if isinstance(collected, date):
+        return collected
+    return datetime.strptime(collected, '%d/%m/%Y').date()
+
+def result_rows(patient, results, units=None):
+    """
+    Turn {test: {collected date: raw value}} into long-format store rows.
+    Missing results, written as '-' or left empty in the sheets, are left out.
+    """
+    units = units or {}
+    rows = []
+    for test, date_values in results.items():
+        for collected, raw in date_values.items():
+            if raw is None or (isinstance(raw, float) and raw != raw):
+                continue
+            raw = str(raw).strip()
+            if raw in ('', '-'):
+                continue
+            numeric, _, flag = parse_result(raw)
+            rows.append((str(patient), test, to_date(collected), raw, numeric, flag, units.get(test, "")))
+    return pd.DataFrame(rows, columns=STORE_COLUMNS)
+
+
+class ResultsStore:
+    """
+    Long-format results of every patient, one row per test and collected date,
+    kept as Arrow IPC files.
+
+    Each source (sle, translate) is a partition folder of part files. Rows are
+    buffered and written out as a new part file every flush_rows rows and on close,
+    so writers never share a file. Part files are uncompressed, so reading them
+    memory-maps them instead of copying them into memory.
+
+    A patient's rows are always written together. When a patient is written again,
+    reads only return the rows from the newest part file holding that patient.
+    A patient written again without any rows gets a tombstone row, with only the
+    patient set, so their older rows are dropped as well.
+    """
+    def __init__(self, folder=STORE_FOLDER, flush_rows=FLUSH_ROWS):
+        if pa is None:
+            raise RuntimeError("The results store needs pyarrow: pip install pyarrow")
+        self.folder = folder
+        self.flush_rows = flush_rows
+        self._pending = {}
+        self._pending_rows = 0
+
+    def partition(self, source):
+        return os.path.join(self.folder, f"source={source}")
+
+    def append(self, source, rows, patient=None):
+        """
+        Add a frame of STORE_COLUMNS rows from the given source.
+        With the patient they belong to given, no rows writes a tombstone for them.
+        """
+        if rows is None or rows.empty:
+            if patient is None:
+                return
+            rows = pd.DataFrame([(str(patient), None, None, None, None, None, None)], columns=STORE_COLUMNS)
+        self._pending.setdefault(source, []).append(rows)
+        self._pending_rows += len(rows)
+        if self._pending_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows of each source out as a new part file.
+        """
+        for source, frames in self._pending.items():
+            table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True)[STORE_COLUMNS],
+                                         schema=store_schema(), preserve_index=False)
+            self._write_part(source, table)
+        self._pending = {}
+        self._pending_rows = 0
+
+    def _write_part(self, source, table):
+        os.makedirs(self.partition(source), exist_ok=True)
+        # Part names sort in the order they were written
+        path = os.path.join(self.partition(source), f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.arrow")
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(path + '.tmp', path)  # Readers never see a half-written part
+        return path
+
+    def close(self):
+        self.flush()
+
+    def part_files(self, source):
+        """
+        Return the part files of a source, oldest first.
+        """
+        folder = self.partition(source)
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.endswith('.arrow')]
+
+    def sources(self):
+        if not os.path.isdir(self.folder):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(self.folder) if name.startswith('source='))
+
+    def read_table(self, source, patients=None, tests=None):
+        """
+        Read a source's rows as an Arrow table, memory-mapping its part files.
+        Optionally keep only some patients and tests.
+        """
+        tables = []
+        seen = pa.array([], pa.string())
+        for path in reversed(self.part_files(source)):
+            table = ipc.open_file(pa.memory_map(path, 'r')).read_all()
+            if len(seen):
+                table = table.filter(pc.invert(pc.is_in(table["patient"], value_set=seen)))
+            seen = pa.concat_arrays([seen, pc.unique(table["patient"])])
+            table = table.filter(pc.is_valid(table["test"]))  # Tombstones only hide older rows
+            if patients is not None:
+                table = table.filter(pc.is_in(table["patient"], value_set=pa.array([str(p) for p in patients], pa.string())))
+            if tests is not None:
+                table = table.filter(pc.is_in(table["test"], value_set=pa.array(list(tests), pa.string())))
+            tables.append(table)
+        if not tables:
+            return store_schema().empty_table()
+        return pa.concat_tables(reversed(tables))
+
+    def read(self, source, patients=None, tests=None):
+        """
+        Read a source's rows as a pandas frame with STORE_COLUMNS.
+        """
+        return self.read_table(source, patients, tests).to_pandas()
+
+    def compact(self, source):
+        """
+        Rewrite a source's part files as a single part, dropping superseded rows.
+        """
+        parts = self.part_files(source)
+        if len(parts) <= 1:
+            return
+        self._write_part(source, self.read_table(source))
+        for path in parts:
+            os.remove(path)
+
+    def export_excel(self, patient, source, output_folder):
+        """
+        Write a patient's sheet from the store, laid out like the sheets its source writes.
+        Returns the sheet path, or None when the store has no rows for the patient.
+        Raises ValueError for a source without a sheet layout.
+        """
+        if source not in SHEET_SOURCES:
+            raise ValueError(f"No sheet layout for source '{source}', expected one of {', '.join(SHEET_SOURCES)}")
+        rows = self.read(source, patients=[patient])
+        if rows.empty:
+            return None
+        results = {}
+        for test, collected, raw in zip(rows["test"], rows["collected"], rows["raw"]):
+            if source == "translate":
+                results.setdefault(test, {})[collected] = raw
+            else:
+                results.setdefault(test, {})[collected.strftime('%d/%m/%Y')] = raw
+        os.makedirs(output_folder, exist_ok=True)
+        if source == "translate":
+            return save_translation(translation_sheet(results), patient, output_folder)
+        return save_sheet(consolidate_results(results), str(patient), output_folder)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export sheets from the results store or compact it.")
+    parser.add_argument("command", choices=["export", "compact"])
+    parser.add_argument("patients", nargs="*", help="Patients to export, all of them if none are given")
+    parser.add_argument("--store", default=STORE_FOLDER, help="Results store folder")
+    parser.add_argument("--source", default="sle", choices=SHEET_SOURCES, help="Results source")
+    parser.add_argument("--output", default="store sheets//", help="Folder for exported sheets")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "compact":
+        for source in store.sources():
+            store.compact(source)
+    else:
+        patients = args.patients or sorted(store.read_table(args.source)["patient"].unique().to_pylist())
+        for patient in patients:
+            store.export_excel(patient, args.source, args.output)
@@ -0,0 +1,211 @@
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from selenium.common.exceptions import (ElementClickInterceptedException, ElementNotInteractableException,
+                                        NoSuchElementException, StaleElementReferenceException,
+                                        TimeoutException, WebDriverException)
+from http_backend import NotFound, SessionExpired
+
+# Failure classes
+NOT_FOUND = "not_found"  # The patient or element is not there; waiting again will not help
+SESSION_EXPIRED = "session_expired"  # Logged out; only a new login helps
+TRANSIENT = "transient"  # The page was mid-update, e.g. a stale or covered element
+SITE_DOWN = "site_down"  # The site is not answering
+TIMEOUT = "timeout"  # A wait ran out; diagnosed further from the page where possible
+UNKNOWN = "unknown"
+
+# Error messages of a browser that could not reach the site
+SITE_DOWN_MARKERS = ("net::ERR_", "ERR_CONNECTION", "ERR_NAME_NOT_RESOLVED", "ERR_TIMED_OUT",
+                     "502 Bad Gateway", "503 Service", "504 Gateway")
+
+
+class RetryError(RuntimeError):
+    """
+    A step that failed for good, with the class of its last failure.
+    """
+    def __init__(self, message, failure):
+        super().__init__(message)
+        self.failure = failure
+
+
+class RetryRule:
+    """
+    How often a class of failure is retried and how long to wait before each retry.
+    The wait starts at delay seconds and is multiplied by factor after every attempt, up to max_delay.
+    """
+    def __init__(self, attempts, delay=0.0, factor=2.0, max_delay=60.0):
+        self.attempts = attempts
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+
+    def backoff(self, attempt):
+        return min(self.delay * self.factor ** (attempt - 1), self.max_delay)
+
+DEFAULT_RULES = {
+    NOT_FOUND: RetryRule(1),
+    SESSION_EXPIRED: RetryRule(1),
+    TRANSIENT: RetryRule(4, delay=0.5, max_delay=4),
+    SITE_DOWN: RetryRule(3, delay=10, max_delay=60),
+    TIMEOUT: RetryRule(2, delay=2),
+    UNKNOWN: RetryRule(3, delay=1, max_delay=5),
+}
+
+
+def classify(error):
+    """
+    Return the failure class of an exception from its type and message alone.
+    """
+    if isinstance(error, NotFound):
+        return NOT_FOUND
+    if isinstance(error, SessionExpired):
+        return SESSION_EXPIRED
+    if isinstance(error, (StaleElementReferenceException, ElementClickInterceptedException,
+                          ElementNotInteractableException, NoSuchElementException)):
+        return TRANSIENT
+    if isinstance(error, TimeoutException):
+        return TIMEOUT
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError)):
+        return SITE_DOWN
+    if isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code >= 500:
+        return SITE_DOWN
+    if isinstance(error, WebDriverException) and any(marker in str(error) for marker in SITE_DOWN_MARKERS):
+        return SITE_DOWN
+    if isinstance(error, ValueError) and "empty" in str(error).lower():
+        return TRANSIENT  # Content copied before the page had rendered it
+    return UNKNOWN
+
+
+class CircuitBreaker:
+    """
+    Pauses every worker once the site looks down.
+
+    After threshold site-down failures in a row, with no success or other kind of
+    failure in between, the breaker opens for cooldown seconds and every step waits
+    before its next attempt. After the pause steps go ahead again; one more site-down
+    failure opens it again straight away, a success closes it. Once the breaker has
+    been open for give_up_after seconds without the site answering in between, steps
+    that would wait fail instead; the first step after a pause always goes ahead.
+    """
+    def __init__(self, threshold=3, cooldown=120, give_up_after=1800):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.give_up_after = give_up_after
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.open_until = 0.0
+        self.open_since = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.open_since = None
+
+    def record_failure(self, failure):
+        with self._lock:
+            if failure != SITE_DOWN:
+                self.failures = 0  # The site answered, just not as hoped
+                self.open_since = None
+                return
+            self.failures += 1
+            now = time.monotonic()
+            if self.failures >= self.threshold and now >= self.open_until:
+                self.open_until = now + self.cooldown
+                self.open_since = self.open_since or now
+                print(f"Site looks down after {self.failures} failures in a row, pausing all workers for {self.cooldown}s")
+
+    def wait(self):
+        """
+        Block while the breaker is open. Returns the seconds waited.
+        Raises RetryError once the site has been down for longer than give_up_after.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                remaining = self.open_until - now
+                # Only while still open: after the pause a step must get through to find out whether the site is back
+                if remaining > 0 and self.open_since is not None and now - self.open_since > self.give_up_after:
+                    raise RetryError(f"Site down for over {self.give_up_after}s, giving up", SITE_DOWN)
+            if remaining <= 0:
+                return waited
+            pause = min(remaining, 5.0)
+            time.sleep(pause)
+            waited += pause
+
+
+class RetryPolicy:
+    """
+    Runs steps with retries chosen by the class of each failure.
+
+    A failure is classified with classify, and TIMEOUT failures are passed to the
+    diagnose callback, when one is given, which can look at the page to tell
+    a missing patient, an expired session or a dead site apart from a slow page.
+    Each class has its own number of attempts and backoff. All steps of a patient
+    share a time budget, set with budget(); time spent paused by the circuit breaker
+    does not count against it.
+    """
+    def __init__(self, rules=None, breaker=None):
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.breaker = breaker or CircuitBreaker()
+        self._local = threading.local()
+
+    @contextmanager
+    def budget(self, seconds):
+        """
+        Give every step run by this thread inside the block a shared time budget.
+        """
+        self._local.deadline = time.monotonic() + seconds if seconds is not None else None
+        try:
+            yield
+        finally:
+            self._local.deadline = None
+
+    def remaining(self):
+        deadline = getattr(self._local, "deadline", None)
+        return None if deadline is None else deadline - time.monotonic()
+
+    def _pause_for_breaker(self):
+        waited = self.breaker.wait()
+        if waited and getattr(self._local, "deadline", None) is not None:
+            self._local.deadline += waited
+
+    def run(self, operation, *args, diagnose=None, attempts_seen=None):
+        """
+        Run operation(*args) until it succeeds or its failure class runs out of attempts.
+        Raises RetryError with the last failure class. attempts_seen, a dict, is
+        filled with the number of attempts and the last failure class.
+        """
+        step = operation.__name__
+        attempt = 0
+        attempts_seen = attempts_seen if attempts_seen is not None else {}
+        while True:
+            self._pause_for_breaker()
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                raise RetryError(f"{step} not started, the patient's time budget is used up.", attempts_seen.get("failure", UNKNOWN))
+
+            attempt += 1
+            attempts_seen["attempts"] = attempt
+            try:
+                result = operation(*args)
+            except Exception as e:
+                failure = classify(e)
+                if failure == TIMEOUT and diagnose is not None:
+                    failure = diagnose(e, step) or TIMEOUT
+                attempts_seen["failure"] = failure
+                self.breaker.record_failure(failure)
+                rule = self.rules[failure]
+                print(f"Error in {step} ({failure}): {e}. This was Attempt  {attempt} of {rule.attempts}.")
+                if attempt >= rule.attempts:
+                    raise RetryError(f"{step} failed after {attempt} attempts ({failure}).", failure) from e
+
+                delay = rule.backoff(attempt)
+                remaining = self.remaining()
+                if remaining is not None and remaining < delay:
+                    raise RetryError(f"{step} failed ({failure}) and the patient's time budget is used up.", failure) from e
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
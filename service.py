@@ -0,0 +1,371 @@
+"""
+Long-running scraping service: batches of MRNs come in over HTTP and are worked
+through by a fixed pool of scraper workers, one pooled browser each.
+
+    python service.py --port 8000 --workers 3
+
+Endpoints, all JSON:
+    POST /jobs                 {"mrns": [...], "rerun": false} -> 202 {"id": ..., "queued": n}
+                               429 with Retry-After when the queue is full
+    GET  /jobs                 Status of every job, finished ones for JOB_RETENTION seconds
+    GET  /jobs/<id>            Status and progress of one job, per patient
+    GET  /jobs/<id>/results    One JSON line per patient as it finishes, until the
+                               job is done; ?text=1 adds each patient's page text
+    GET  /health               Workers, queued patients and queue capacity
+
+The service listens on 127.0.0.1 unless told otherwise. Results hold patient lab
+text, so when TOKEN_VARIABLE is set every request but /health must carry it as
+"Authorization: Bearer <token>", and the service will not listen on any other
+address without one.
+
+Patients are scraped with transcribe.process_patient, so they go through the job
+store, the retry policy and the fault log like in a transcribe.py run.
+"""
+import argparse
+import hmac
+import itertools
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import transcribe
+from http_backend import BASE_URL
+from job_store import JobStore, DONE, FAILED
+from timing import spans
+
+PORT = 8000  # Published by compose.yaml
+HOST = "127.0.0.1"  # Only this machine; the container listens on every address, behind a token
+TOKEN_VARIABLE = "LABLINK_SERVICE_TOKEN"  # Environment variable holding the bearer token
+MAX_QUEUED = 1000  # Patients waiting for a worker before new jobs are turned away
+RETRY_AFTER = 60  # Seconds a turned away client is asked to wait
+JOB_RETENTION = 3600  # Seconds a finished job and its results stay available
+CLOSE_TIMEOUT = 30  # Seconds close waits for each worker to finish its patient
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    A batch of patients submitted together, with the result of each one as it finishes.
+    """
+    def __init__(self, job_id, mrns):
+        self.id = job_id
+        self.mrns = mrns
+        self.created = time.time()
+        self.finished = None
+        self.states = {mrn: "queued" for mrn in mrns}
+        self.results = []  # In the order the patients finished
+        self._changed = threading.Condition()
+
+    def start(self, mrn):
+        with self._changed:
+            self.states[mrn] = "running"
+
+    def finish(self, result):
+        with self._changed:
+            self.states[result["mrn"]] = result["state"]
+            self.results.append(result)
+            if len(self.results) == len(self.mrns):
+                self.finished = time.time()
+            self._changed.notify_all()
+
+    def wait_for_result(self, index, timeout=None):
+        """
+        Block until the job has more than index results. Returns False once the job
+        finished without reaching it, or the timeout ran out.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: len(self.results) > index or self.finished is not None, timeout) \
+                and len(self.results) > index
+
+    def status(self, store=None):
+        """
+        Return the job's progress. With the job store, running patients show the
+        labs captured so far.
+        """
+        with self._changed:
+            states = dict(self.states)
+            finished = self.finished
+        values = list(states.values())
+        counts = {state: values.count(state) for state in ("queued", "running", DONE, FAILED)}
+        patients = {}
+        for mrn, state in states.items():
+            patients[mrn] = {"state": state}
+            if state == "running" and store is not None:
+                patient = store.patient_state(mrn)
+                if patient is not None and patient[1] is not None:
+                    patients[mrn]["labs"] = f"{patient[2]}/{patient[1]}"
+        job_state = "done" if finished else ("queued" if counts["queued"] == len(states) else "running")
+        return {"id": self.id, "state": job_state, "created": self.created, "finished": finished,
+                "total": len(states), **counts, "patients": patients}
+
+
+class ScrapeService:
+    """
+    Queues patients of submitted jobs to a bounded pool of scraper workers.
+
+    Admission control: at most max_queued patients wait for a worker, and a job
+    that does not fit as a whole is turned away with QueueFull so the client can
+    retry later. Patients finished by an earlier run are not scraped again unless
+    the job asks for a rerun; their result is returned straight away. A patient
+    already queued or being scraped for another job is not queued again, the
+    later job gets the result of that scrape. Finished jobs are forgotten after
+    retention seconds.
+    """
+    def __init__(self, workers=transcribe.POOL_SIZE, max_queued=MAX_QUEUED, use_http=False, site_url=BASE_URL,
+                 direct=transcribe.DIRECT_NAVIGATION, lean_browser=transcribe.LEAN_BROWSER, retention=JOB_RETENTION):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.direct = direct
+        self.store = JobStore(transcribe.JOB_STORE_PATH)
+        self.pool = transcribe.make_driver_pool(workers, lean_browser=lean_browser, site_url=site_url)
+        self.http_backend = transcribe.connect_http_backend(workers, site_url) if use_http else None
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._queue = queue.Queue()
+        self._in_flight = {}  # Patients queued or being scraped, with the jobs waiting for them
+        self._running = set()
+        self._threads = [threading.Thread(target=self._work, name=f"scraper-{number}", daemon=True)
+                         for number in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, mrns, rerun=False):
+        """
+        Queue a job's patients and return the job. Raises QueueFull if they do not fit,
+        and ValueError if there are none.
+        """
+        mrns = list(dict.fromkeys(str(mrn).strip() for mrn in mrns if str(mrn).strip()))
+        if not mrns:
+            raise ValueError("no MRNs given")
+        with self._lock:
+            new_mrns = [mrn for mrn in mrns if mrn not in self._in_flight]
+            if self._queued + len(new_mrns) > self.max_queued:
+                raise QueueFull(f"{self._queued} patients queued, room for {self.max_queued - self._queued} more")
+            self._expire_jobs()
+            job = Job(str(next(self._ids)), mrns)
+            self.jobs[job.id] = job
+            to_scrape = self.store.enqueue(new_mrns, rerun)
+            self._queued += len(to_scrape)
+            # Patients another job is already scraping get that scrape's result
+            attached = [mrn for mrn in mrns if mrn in self._in_flight]
+            for mrn in attached:
+                self._in_flight[mrn].append(job)
+                if mrn in self._running:
+                    job.start(mrn)
+            for mrn in to_scrape:
+                self._in_flight[mrn] = [job]
+        for mrn in new_mrns:
+            if mrn not in to_scrape:
+                job.finish(self._result(mrn, skipped=True))
+        for mrn in to_scrape:
+            self._queue.put(mrn)
+        print(f"Job {job.id}: {len(mrns)} patients, {len(to_scrape)} to scrape, {len(attached)} already in progress")
+        return job
+
+    def _expire_jobs(self):
+        # Called with the lock held
+        cutoff = time.time() - self.retention
+        for job_id in [job.id for job in self.jobs.values() if job.finished is not None and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+    def _result(self, mrn, skipped=False):
+        state, lab_count, _, error = self.store.patient_state(mrn) or (FAILED, None, 0, "Unknown patient")
+        result = {"mrn": mrn, "state": DONE if state == DONE else FAILED, "labs": lab_count}
+        if skipped:
+            result["skipped"] = True
+        if state != DONE:
+            result["error"] = error
+        return result
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            mrn = item
+            with self._lock:
+                self._queued -= 1
+                self._running.add(mrn)
+                jobs = list(self._in_flight[mrn])
+            for job in jobs:
+                job.start(mrn)
+            try:
+                transcribe.process_patient(self.pool, mrn, self.http_backend, self.store, None, self.direct)
+                result = self._result(mrn)
+            except Exception as e:  # Keep the worker alive whatever went wrong
+                self.store.fail_patient(mrn, e)
+                result = {"mrn": mrn, "state": FAILED, "labs": None, "error": f"{type(e).__name__}: {e}"}
+            with self._lock:
+                self._running.discard(mrn)
+                jobs = self._in_flight.pop(mrn)
+            for job in jobs:
+                job.finish(dict(result))
+            with self._lock:
+                self._expire_jobs()
+
+    def health(self):
+        with self._lock:
+            return {"workers": self.workers, "queued": self._queued, "capacity": self.max_queued,
+                    "jobs": len(self.jobs)}
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        self.pool.close()
+        if self.http_backend is not None:
+            self.http_backend.close()
+        for thread in self._threads:
+            thread.join(timeout=CLOSE_TIMEOUT)
+        self.store.close()
+
+
+def patient_text(mrn):
+    path = transcribe.TEXT_FOLDER + mrn + '.txt'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def make_handler(service, token=None):
+    """
+    Return the request handler class for a service. With a token, every request
+    but /health needs it as a bearer token and is refused with 401 otherwise.
+    """
+    class ServiceHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _authorised(self):
+            if token is None or urlsplit(self.path).path.rstrip("/") == "/health":
+                return True
+            given = self.headers.get("Authorization", "")
+            if given.startswith("Bearer ") and hmac.compare_digest(given[len("Bearer "):].encode(), token.encode()):
+                return True
+            self._json(401, {"error": "Missing or wrong bearer token"}, [("WWW-Authenticate", "Bearer")])
+            return False
+
+        def _json(self, status, value, headers=()):
+            body = json.dumps(value).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for name, header in headers:
+                self.send_header(name, header)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _stream_results(self, job, with_text):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            index = 0
+            while job.wait_for_result(index):
+                result = dict(job.results[index])
+                if with_text:
+                    result["text"] = patient_text(result["mrn"]) if result["state"] == DONE else None
+                self._chunk(json.dumps(result).encode("utf-8") + b"\n")
+                index += 1
+            self._chunk(b"")
+
+        def do_GET(self):
+            if not self._authorised():
+                return
+            url = urlsplit(self.path)
+            parts = [part for part in url.path.split("/") if part]
+            job = service.jobs.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+            if parts == ["health"]:
+                self._json(200, service.health())
+            elif parts == ["jobs"]:
+                self._json(200, [job.status() for job in list(service.jobs.values())])
+            elif job is not None:
+                if len(parts) == 2:
+                    self._json(200, job.status(service.store))
+                elif parts[2] == "results":
+                    self._stream_results(job, parse_qs(url.query).get("text", ["0"])[-1] not in ("0", "false", ""))
+                else:
+                    self._json(404, {"error": "Not found"})
+            else:
+                self._json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if not self._authorised():
+                return
+            if urlsplit(self.path).path.rstrip("/") != "/jobs":
+                self._json(404, {"error": "Not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                mrns = body["mrns"]
+                if isinstance(mrns, str) or not isinstance(mrns, list):
+                    raise ValueError("mrns must be a list")
+            except (ValueError, KeyError, TypeError) as e:
+                self._json(400, {"error": f"Expected {{\"mrns\": [...]}}: {e}"})
+                return
+            try:
+                job = service.submit(mrns, bool(body.get("rerun")))
+            except QueueFull as e:
+                self._json(429, {"error": str(e)}, [("Retry-After", str(RETRY_AFTER))])
+                return
+            except ValueError as e:
+                self._json(400, {"error": f"Expected {{\"mrns\": [...]}}: {e}"})
+                return
+            self._json(202, {"id": job.id, "queued": len(job.mrns), "status": f"/jobs/{job.id}",
+                             "results": f"/jobs/{job.id}/results"})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ServiceHandler
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt  # docker stop sends SIGTERM; shut down like on Ctrl+C
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape batches of MRNs submitted over HTTP.")
+    parser.add_argument("--host", default=HOST, help=f"Address to listen on; other than 127.0.0.1 needs {TOKEN_VARIABLE}")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=transcribe.POOL_SIZE, help="Scraper workers, one browser each")
+    parser.add_argument("--max-queued", type=int, default=MAX_QUEUED, help="Patients waiting before jobs are turned away")
+    parser.add_argument("--http", action="store_true", help="Fetch over direct HTTP first, falling back to the browser")
+    parser.add_argument("--direct", action="store_true", help="Open labs by address after the first")
+    parser.add_argument("--lean", action="store_true", help="Headless browsers without images, fonts or media")
+    parser.add_argument("--site-url", default=BASE_URL, help="Address of the site, e.g. a local mock_trakcare.py")
+    parser.add_argument("--retention", type=float, default=JOB_RETENTION, help="Seconds finished jobs are kept")
+    parser.add_argument("--spans", default=transcribe.SPANS_PATH, help="Append step timings to this file")
+    args = parser.parse_args()
+
+    token = os.environ.get(TOKEN_VARIABLE) or None
+    if token is None and args.host not in ("127.0.0.1", "localhost", "::1"):
+        parser.error(f"listening on {args.host} needs a bearer token in {TOKEN_VARIABLE}")
+    if args.spans:
+        spans.configure(args.spans)
+    service = ScrapeService(args.workers, args.max_queued, args.http, args.site_url, args.direct, args.lean,
+                            args.retention)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service, token))
+    server.daemon_threads = True
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Listening on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.server_close()
+        service.close()
+        spans.report()
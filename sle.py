@@ -1,8 +1,13 @@
+import argparse
 import os
 import re
 import pandas as pd
+from batch import run_batch, report_errors
+from manifest import Manifest, fingerprint
+from timing import spans
 from collections import defaultdict
 from datetime import datetime
+from functools import lru_cache, partial
 
 # ------------------- CONFIGURATION ------------------- #
 input_folder = "textfiles//"
@@ -58,6 +63,114 @@ patterns = {
     "RF": fr"Rheumatoid\s+factor\s*\(RF\)\s+{value_pattern}\s+IU/mL",
 }
 
+# Units of the tests whose pattern only accepts one unit, kept with their results in the results store
+test_units = {
+    # Blood creatinine is reported in umol/L; in mmol/L the pattern only matches urine creatinine lines
+    "Blood Creatinine": "umol/L",
+    "Urine Creatinine": "mmol/L",
+    "Calcium": "mmol/L",
+    "Urea": "mmol/L",
+    "Sodium": "mmol/L",
+    "ESR": "mm/hr",
+    "CRP": "mg/L",
+    "ALP": "U/L",
+    "GGT": "U/L",
+    "AST": "U/L",
+    "ALT": "U/L",
+    "Complement C3": "g/L",
+    "Complement C4": "g/L",
+    "Cholesterol": "mmol/L",
+    "HbA1c": "%",
+    "TSH": "mIU/L",
+    "eGFR": "mL/min/1.73 m2",
+    "MCV": "fL",
+    "Hb": "g/L",
+    "HIV Viral Load": "copies/mL",
+    "ACCP": "U/mL",
+    "RF": "IU/mL",
+}
+
+# ------------------- SCANNER ------------------- #
+# A literal that every match of the test's pattern contains (case-insensitive).
+# Lines without the keyword cannot match, so the full regex is skipped for them.
+# Tests missing from here are tried on every line.
+pattern_keywords = {
+    "Blood Creatinine": "creatinine",
+    "Urine Creatinine": "creatinine",
+    "Calcium": "calcium",
+    "Urea": "urea",
+    "Sodium": "sodium",
+    "ESR": "esr",
+    "CRP": "c-reactive",
+    "ALP": "alkaline phosphatase",
+    "GGT": "gamma-glutamyl transferase",
+    "AST": "aspartate transaminase",
+    "ALT": "alanine transaminase",
+    "Complement C3": "complement",
+    "Complement C4": "complement",
+    "AB2GPEL IgG": "anti-beta",
+    "AB2GPEL IgM": "anti-beta",
+    "ADNAEL": "anti-double",
+    "ANAIF_Positive": "anti-nuclear",
+    "ANAIF_Negative": "anti-nuclear",
+    "Cholesterol": "cholesterol",
+    "HbA1c": "hba1c",
+    "TSH": "tsh",
+    "eGFR": "egfr",
+    "MCV": "mcv",
+    "Hb": "hb",
+    "HIV Serology": "hiv",
+    "HIV Viral Load": "hiv",
+    "ACCP": "anti-ccp",
+    "Hep B": "hb",
+    "RF": "rheumatoid",
+}
+
+def compile_patterns():
+    """
+    Compile every test pattern once, keeping the order of `patterns`.
+    Returns a list of (test, compiled pattern, keyword) tuples.
+    """
+    compiled = []
+    for test, pattern in patterns.items():
+        keyword = pattern_keywords.get(test)
+        compiled.append((test, re.compile(pattern, re.DOTALL | re.IGNORECASE), keyword and keyword.lower()))
+    return compiled
+
+compiled_patterns = compile_patterns()
+
+# Bump when the extraction logic changes in a way that changes its output.
+# Changes to `patterns` are picked up by the pattern fingerprints on their own,
+# and only send back the files the changed patterns can affect.
+PARSER_REVISION = 1
+parser_version = fingerprint(PARSER_REVISION)
+pattern_versions = {test: fingerprint(pattern, pattern_keywords.get(test)) for test, pattern in patterns.items()}
+
+def matched_patterns(tests):
+    """
+    Return the patterns behind the given result tests. ANAIF results come from
+    either ANAIF pattern and Hep B results are named after their marker.
+    """
+    matched = set()
+    for test in tests:
+        if test in patterns:
+            matched.add(test)
+        elif test == "ANAIF":
+            matched.update(("ANAIF_Positive", "ANAIF_Negative"))
+        else:
+            matched.add("Hep B")
+    return matched
+
+def candidate_patterns(line):
+    """
+    Return the compiled patterns that can match this line, in `patterns` order.
+    """
+    if not line.isascii():
+        # Case folding of non-ASCII text differs between str.lower and re.IGNORECASE
+        return compiled_patterns
+    lowered = line.lower()
+    return [entry for entry in compiled_patterns if entry[2] is None or entry[2] in lowered]
+
 
 def extract_results_from_lines(lines):
     results = defaultdict(dict)
@@ -83,9 +196,9 @@ def extract_results_from_lines(lines):
             # We haven't encountered a date yet, skip
             continue
 
-        # Apply each pattern to the current line
-        for test, pattern in patterns.items():
-            matches = re.findall(pattern, line, flags=re.DOTALL | re.IGNORECASE)
+        # Apply each pattern that can match to the current line
+        for test, regex, _ in candidate_patterns(line):
+            matches = regex.findall(line)
             if matches:
                 print(f"Matches found for '{test}' on line {line_number}: {matches}")
                 for match in matches:
@@ -142,50 +255,184 @@ def extract_results_from_lines(lines):
 
     return results
 
+@lru_cache(maxsize=None)
+def parse_date(date):
+    """
+    Parse a dd/mm/yyyy date once; repeated dates come from the cache.
+    """
+    return datetime.strptime(date, '%d/%m/%Y')
+
 def consolidate_results(all_results):
     print("Consolidating results into DataFrame...")
-    # Collect all dates
-    all_dates = set()
-    for test_name, date_results in all_results.items():
-        all_dates.update(date_results.keys())
+    # Gather (test, date, value) records, then pivot them into the test x date matrix in one step
+    records = [(test_name, d, val) for test_name, date_values in all_results.items() for d, val in date_values.items()]
 
     # Sort dates chronologically
-    all_dates = sorted(all_dates, key=lambda x: pd.to_datetime(x, format='%d/%m/%Y'))
-    formatted_dates = [pd.to_datetime(d, dayfirst=True).strftime('%Y-%m-%d') for d in all_dates]
+    all_dates = sorted({d for _, d, _ in records}, key=parse_date)
+    formatted = {d: parse_date(d).strftime('%Y-%m-%d') for d in all_dates}
 
-    df = pd.DataFrame(index=all_results.keys(), columns=formatted_dates)
-    for test_name, date_values in all_results.items():
-        for d, val in date_values.items():
-            fd = pd.to_datetime(d, dayfirst=True).strftime('%Y-%m-%d')
-            df.at[test_name, fd] = val
+    long_df = pd.DataFrame(records, columns=["test", "date", "value"], dtype=object)
+    long_df["date"] = long_df["date"].map(formatted)
+    long_df = long_df.drop_duplicates(subset=["test", "date"], keep="last")
+    df = long_df.pivot(index="test", columns="date", values="value")
+    df = df.reindex(index=list(all_results.keys()), columns=list(dict.fromkeys(formatted.values())))
+    df.index.name = df.columns.name = None
 
     df = df.fillna('-')
     return df
 
-def process_text_files(input_folder, output_folder):
+def save_sheet(df, patient_id, output_folder):
+    """
+    Save a patient's consolidated results to <output_folder>/<patient_id>.xlsx.
+    """
+    output_file = os.path.join(output_folder, f"{patient_id}.xlsx")
+    print(f"Saving extracted results for '{patient_id}' to {output_file}")
+
+    with pd.ExcelWriter(output_file, date_format='yyyy-mm-dd', datetime_format='yyyy-mm-dd') as writer:
+        df.to_excel(writer, sheet_name=patient_id[:31], index=True)
+    return output_file
+
+def extract_text_file(filepath):
+    """
+    Extract the results of one patient's text file.
+    Returns (patient id, {test: {date: value}}), with no results if nothing was found.
+    """
+    filename = os.path.basename(filepath)
+    print(f"Processing file: {filename}")
+    with spans.span("sle.extract", file=filename) as span:
+        with open(filepath, 'r', encoding='utf-8', errors='ignore') as file:
+            lines = file.readlines()
+
+        results = extract_results_from_lines(lines)
+        span["size"] = sum(len(line) for line in lines)
+        span["tests"] = len(results)
+    if not results:
+        print(f"No matching results found in {filename}.")
+    return os.path.splitext(filename)[0], results
+
+def process_text_file(filepath, output_folder):
+    """
+    Extract the results of one patient's text file and save them as a sheet.
+    Returns the path of the saved sheet, or None if nothing was found.
+    """
+    return save_results(filepath, *extract_text_file(filepath), output_folder)
+
+def text_file_sheet(filepath, output_folder):
+    """
+    Like process_text_file, but returns (sheet path, patterns that matched) for the manifest.
+    """
+    patient_id, results = extract_text_file(filepath)
+    return save_results(filepath, patient_id, results, output_folder), matched_patterns(results)
+
+def save_results(filepath, patient_id, results, output_folder):
+    """
+    Save a text file's extracted results as a sheet, or return None if there are none.
+    """
+    if not results:
+        return None
+
+    with spans.span("sle.consolidate", file=os.path.basename(filepath)) as span:
+        df = consolidate_results(results)
+        span["cells"] = df.size
+    with spans.span("sle.save", file=os.path.basename(filepath)):
+        return save_sheet(df, patient_id, output_folder)
+
+def text_file_rows(filepath):
+    """
+    Extract one patient's text file into long-format results store rows.
+    """
+    from results_store import result_rows
+    patient_id, results = extract_text_file(filepath)
+    with spans.span("sle.consolidate", file=os.path.basename(filepath)) as span:
+        rows = result_rows(patient_id, results, test_units)
+        span["rows"] = len(rows)
+    return rows
+
+def process_text_files(input_folder, output_folder, workers=1, chunksize=1, force=False, store_folder=None, db_path=None):
+    """
+    Extract every .txt file in input_folder, optionally spread over worker processes.
+    Files are handled in name order and a failing file does not stop the batch;
+    failures are listed in batch_errors.txt in the output folder.
+
+    Files already extracted by the current patterns, and whose content has not
+    changed since, are skipped using manifest.json in the output folder. After
+    a pattern changes, only the files that matched it or hold its keyword are
+    extracted again. Pass force=True to extract everything again.
+
+    With store_folder set, the results are appended to the results store there
+    instead of being saved as one sheet per patient. With db_path set, they are
+    loaded into that results database instead.
+    """
     print("Starting Extraction...")
-    for filename in os.listdir(input_folder):
+    store = database = None
+    if store_folder is not None and db_path is not None:
+        raise ValueError("Give either a results store or a results database, not both")
+    if store_folder is not None:
+        from results_store import ResultsStore
+        store = ResultsStore(store_folder)
+        manifest = Manifest(os.path.join(store_folder, "manifest-sle.json"))
+    elif db_path is not None:
+        from results_db import ResultsDatabase
+        database = ResultsDatabase(db_path)
+        manifest = Manifest(os.path.splitext(db_path)[0] + "-sle-manifest.json")
+    else:
+        manifest = Manifest(os.path.join(output_folder, "manifest.json"))
+    filepaths = []
+    skipped = 0
+    for filename in sorted(os.listdir(input_folder)):
         if filename.endswith('.txt'):
             filepath = os.path.join(input_folder, filename)
-            print(f"Processing file: {filename}")
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as file:
-                lines = file.readlines()
-
-            results = extract_results_from_lines(lines)
-            if not results:
-                print(f"No matching results found in {filename}.")
+            if not force and manifest.is_current(filepath, parser_version, pattern_versions, pattern_keywords):
+                skipped += 1
                 continue
+            filepaths.append(filepath)
+    print(f"{skipped} files unchanged since the last extraction, {len(filepaths)} to process.")
 
-            df = consolidate_results(results)
-            patient_id = os.path.splitext(filename)[0]
-            output_file = os.path.join(output_folder, f"{patient_id}.xlsx")
-            print(f"Saving extracted results for '{patient_id}' to {output_file}")
+    if store is not None or database is not None:
+        outcomes = run_batch(text_file_rows, filepaths, workers, chunksize)
+    else:
+        outcomes = run_batch(partial(text_file_sheet, output_folder=output_folder), filepaths, workers, chunksize)
+    report_errors(outcomes, os.path.join(output_folder, "batch_errors.txt"))
 
-            with pd.ExcelWriter(output_file, date_format='yyyy-mm-dd', datetime_format='yyyy-mm-dd') as writer:
-                df.to_excel(writer, sheet_name=patient_id[:31], index=True)
+    for index, (filepath, output, error) in enumerate(outcomes):
+        if error is None:
+            if store is not None:
+                tests = matched_patterns(set(output["test"]))
+                store.append("sle", output, os.path.splitext(os.path.basename(filepath))[0])
+                output = store.partition("sle")
+            elif database is not None:
+                tests = matched_patterns(set(output["test"]))
+                database.load("sle", output, os.path.splitext(os.path.basename(filepath))[0])
+                output = db_path
+            else:
+                output, tests = output
+                outcomes[index] = (filepath, output, error)
+            manifest.record(filepath, parser_version, output, pattern_versions, tests)
+    if store is not None:
+        store.close()
+    if database is not None:
+        database.close()
+    manifest.save()
 
     print("Extraction Completed.")
+    return outcomes
 
 if __name__ == "__main__":
-    process_text_files(input_folder, part1_output_folder)
+    parser = argparse.ArgumentParser(description="Extract lab results from text files into sheets.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=1, help="Files sent to a worker at a time")
+    parser.add_argument("--force", action="store_true", help="Extract unchanged files again")
+    parser.add_argument("--store", nargs="?", const="results store//", default=None,
+                        help="Append the results to this results store instead of writing sheets")
+    parser.add_argument("--db", nargs="?", const="results.sqlite", default=None,
+                        help="Load the results into this results database instead of writing sheets")
+    parser.add_argument("--spans", nargs="?", const="spans.jsonl", default=None,
+                        help="Append step timings to this file and print a summary at the end")
+    args = parser.parse_args()
+
+    if args.spans is not None:
+        spans.configure(args.spans)
+    process_text_files(input_folder, part1_output_folder, args.workers, args.chunksize, args.force, args.store, args.db)
     print("Check the full_output folder for results.")
+    if args.spans is not None:
+        spans.report()
@@ -0,0 +1,286 @@
+"""
+Synthetic patients laid out like the TrakCare cumulative history pages.
+
+Every patient is a list of labs (the rows of the find list). A lab is one test set
+with its episodes, newest first, and the text of its cumulative history as the
+browser copies it: chemistry lines, Full Blood Count tables, serology results,
+lupus anticoagulant screens or histopathology reports. Patients are generated
+from their MRN and a seed, so the same MRN always gives the same labs.
+
+Write a corpus of patient text files, laid out like the ones transcribe.py writes, with
+    python synthetic.py "synthetic files" --patients 500 --episodes 5 40
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+EPISODE_PREFIXES = ["ST", "SA", "XF", "XG", "XD", "STM"]
+AUTHORISERS = ["Instrument", "CJ Andrews", "N Tshapile", "M Yalezo", "Z Mankune", "NN Zenze"]
+
+# Chemistry tests as (line format, low, high, decimals). Values outside low and
+# high are flagged H or L like in the real reports
+CHEMISTRY = {
+    "Creatinine": ("Creatinine {value} umol/L 49 - 90 eGFR (MDRD formula) >60 mL/min/1.73 m2"
+                   " eGFR (CKD-EPI formula) {egfr} mL/min/1.73 m2", 49, 90, 0),
+    "Sodium": ("Sodium {value} mmol/L 136 - 145", 136, 145, 0),
+    "Potassium": ("Potassium {value} mmol/L 3.5 - 5.1", 3.5, 5.1, 1),
+    "Urea": ("Urea {value} mmol/L 2.1 - 7.1", 2.1, 7.1, 1),
+    "Calcium": ("Calcium {value} mmol/L 2.10 - 2.50", 2.10, 2.50, 2),
+    "CRP": ("C-Reactive protein {value} mg/L <10", 0, 10, 0),
+    "ESR": ("ESR {value} mm/hr 0 - 15", 0, 15, 0),
+    "ALP": ("Alkaline phosphatase (ALP) {value} U/L 53 - 128", 53, 128, 0),
+    "GGT": ("Gamma-glutamyl transferase (GGT) {value} U/L <68", 0, 68, 0),
+    "AST": ("Aspartate transaminase (AST) {value} U/L 15 - 40", 15, 40, 0),
+    "ALT": ("Alanine transaminase (ALT) {value} U/L 10 - 40", 10, 40, 0),
+    "Complement C3": ("Complement C3 {value} g/L 0.90 - 1.80", 0.90, 1.80, 2),
+    "Complement C4": ("Complement C4 {value} g/L 0.10 - 0.40", 0.10, 0.40, 2),
+    "Urine protein": ("Urine protein {value} g/L", 0, 0.15, 2),
+    "Urine protein creat ratio": ("Urine protein\tcreat ratio {value} g/mmol creat <0.015", 0, 0.015, 3),
+    "Cholesterol": ("Cholesterol {value} mmol/L <5.0", 3.0, 5.0, 1),
+    "HbA1c": ("HbA1c {value} % <6.5", 4.0, 6.5, 1),
+    "TSH": ("TSH {value} mIU/L 0.27 - 4.20", 0.27, 4.20, 2),
+    "RF": ("Rheumatoid factor (RF) {value} IU/mL <14", 0, 14, 0),
+}
+
+# Test sets, one per lab, with the chemistry tests they report
+TEST_SETS = {
+    "U&E": ["Creatinine", "Sodium", "Potassium", "Urea"],
+    "Creatinine": ["Creatinine"],
+    "Calcium": ["Calcium"],
+    "CRP": ["CRP"],
+    "ESR": ["ESR"],
+    "LFT": ["ALP", "GGT", "AST", "ALT"],
+    "Complement": ["Complement C3", "Complement C4"],
+    "Urine protein": ["Urine protein", "Urine protein creat ratio"],
+    "Lipids": ["Cholesterol"],
+    "HbA1c": ["HbA1c"],
+    "TSH": ["TSH"],
+    "RF": ["RF"],
+}
+
+# Full Blood Count rows as (name written in the table, low, high, decimals)
+FBC_ROWS = [
+    ("White Cell Cou", 3.9, 12.6, 2),
+    ("Red Cell Count", 3.8, 4.8, 2),
+    ("Haemoglobin", 12.0, 15.0, 1),
+    ("Haematocrit", 0.36, 0.46, 3),
+    ("MCV", 83.1, 101.6, 1),
+    ("MCH", 27.8, 34.8, 1),
+    ("Platelet Count", 186, 454, 0),
+]
+FBC = "FBC"
+
+HISTOPATHOLOGY_LINES = {
+    "CLINICAL": ["A {age} year old woman with a rash on the face and arms.", "Known SLE, on hydroxychloroquine.",
+                 "Proteinuria for {months} months, ?lupus nephritis.", "Renal biopsy taken.",
+                 "Skin biopsy of the left forearm.", "Discoid lesions for {months} months."],
+    "MACROSCOPIC": ["The specimen container is labelled with the patient's details.",
+                    "Specimen consists of {count} cores of tan tissue, the largest {size} x 1mm.",
+                    "A skin ellipse measuring {size} x 4mm, bisected and embedded in total."],
+    "MICROSCOPIC": ["Sections show {count} glomeruli, of which none are globally sclerosed.",
+                    "There is mesangial hypercellularity and matrix expansion.",
+                    "The epidermis shows interface dermatitis with basal vacuolar change.",
+                    "No granulomas or malignancy are seen."],
+    "DIAGNOSIS": ["Kidney biopsy:", "* Lupus nephritis, ISN/RPS class {roman}.", "Skin biopsy:",
+                  "* Interface dermatitis, in keeping with cutaneous lupus."],
+}
+
+
+def flagged(rng, low, high, decimals):
+    """
+    Return a value in or, now and then, just outside the range, with its H or L flag.
+    """
+    spread = (high - low) or high or 1
+    value = rng.uniform(low - spread * 0.3, high + spread * 0.3)
+    value = max(value, 0)
+    text = f"{value:.{decimals}f}"
+    if value > high:
+        return text + " H"
+    if value < low:
+        return text + " L"
+    return text
+
+def episode_number(rng):
+    return rng.choice(EPISODE_PREFIXES) + f"{rng.randrange(10 ** 7):08d}"
+
+def collected_dates(rng, count, newest):
+    """
+    Return count distinct collection dates, newest first, going back from newest.
+    """
+    dates = []
+    day = newest
+    for _ in range(count):
+        dates.append(day)
+        day -= timedelta(days=rng.randint(1, 120))
+    return dates
+
+def page_header(rng, mrn, episode):
+    return (f"Patient Find >> Episode Cumulative Results\n"
+            f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d} \n"
+            f" Dr {rng.choice(AUTHORISERS)}\n"
+            f"MRN{mrn}\n{episode}\n\t\nPATIENT\n\t\nSYNTHETIC\n\t\n01/01/1970\n\t\t\t\n• • •\n"
+            f"Episode Cumulative Results\n\n")
+
+def episode_block(rng, episode, collected):
+    authorised = collected + timedelta(days=rng.randint(0, 2))
+    return (f"Episode\t{episode}\n"
+            f"Date collected\t{collected:%d/%m/%Y}\n"
+            f"Time collected\t{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}\n"
+            f"Authorised by {rng.choice(AUTHORISERS)} on {authorised:%d/%m/%Y} at "
+            f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}\n\n")
+
+def serology_results(rng):
+    """
+    Serology lines of one episode: antinuclear, anti-dsDNA, anti-beta 2 glycoprotein,
+    anti-CCP, HIV and hepatitis B results, each there or not.
+    """
+    status = lambda: rng.choice(["Positive", "Negative", "Negative"])
+    lines = []
+    if rng.random() < 0.8:
+        ana = status()
+        lines.append("Anti-nuclear antibodies (IFA): Result using HEP-2 cells " +
+                     (f"Positive Titre {rng.choice([80, 160, 320, 640, 1280])} Pattern Homogenous" if ana == "Positive" else "Negative"))
+    if rng.random() < 0.6:
+        lines.append(f"Anti-double stranded DNA antibody (ELISA): IgG Result {status()} Value {rng.randint(1, 300)} IU/mL")
+    if rng.random() < 0.4:
+        lines.append(f"Anti-beta 2 glycoprotein-1 antibody (ELISA): IgG result {status()} Value {rng.uniform(0, 40):.1f} U/mL "
+                     f"IgM Result {status()} Value {rng.uniform(0, 40):.1f} U/mL")
+    if rng.random() < 0.3:
+        lines.append(f"Anti-CCP antibodies (ELISA): Result {status()} Value {rng.uniform(0, 300):.1f} U/mL")
+    if rng.random() < 0.4:
+        lines.append(f"HIV antibody test: {status()}")
+        if rng.random() < 0.5:
+            lines.append(f"HIV Viral Load {rng.choice(['<50', str(rng.randint(50, 500000))])} copies/mL")
+    if rng.random() < 0.3:
+        lines.append(f"HBsAg: {status()}")
+        lines.append(f"Anti-HBs: {rng.randint(0, 1000)} IU/mL")
+    return lines or [f"HIV antibody test: {status()}"]
+
+def lupus_anticoagulant(rng):
+    """
+    Lines of a lupus anticoagulant screen, ending in the normalised ratio.
+    """
+    screen, confirm = rng.uniform(30, 60), rng.uniform(30, 40)
+    ratio = screen / confirm
+    return ["Lupus Anticoagulant:", "",
+            f"Screen Patient {screen:.2f} sec Screen Control 33.50 sec Screen Ratio {screen / 33.5:.2f}", "",
+            f"Confirm Patient {confirm:.2f} sec Confirm Control 34.30 sec Confirm Ratio {confirm / 34.3:.2f}", "",
+            f"Normalised LAC Ratio {ratio:.2f}{' H' if ratio > 1.2 else ''} <1.20"]
+
+def histopathology_report(rng, episode):
+    """
+    Lines of a histopathology report, from CLINICAL to the pathologist's name.
+    """
+    fill = {"age": rng.randint(18, 70), "months": rng.randint(1, 24), "count": rng.randint(2, 30),
+            "size": rng.randint(3, 20), "roman": rng.choice(["II", "III", "IV", "V"])}
+    lines = [f"EPISODE NUMBER: {episode}", ""]
+    for section, choices in HISTOPATHOLOGY_LINES.items():
+        lines.append(f"{section}:")
+        lines.extend(line.format(**fill) for line in rng.sample(choices, rng.randint(2, len(choices))))
+        lines.append("")
+    lines.append(f"PATHOLOGIST: Dr {rng.choice(AUTHORISERS[1:])}")
+    return lines
+
+# Test sets reported as blocks of lines per episode, by the function writing the lines
+BLOCK_SETS = {
+    "Serology": lambda rng, episode: serology_results(rng),
+    "Lupus anticoagulant": lambda rng, episode: lupus_anticoagulant(rng),
+    "Histopathology": histopathology_report,
+}
+
+def block_history(rng, mrn, write_block, episodes):
+    """
+    Cumulative history text of a test set reported as a block of lines per episode.
+    """
+    parts = [page_header(rng, mrn, episodes[0][0])]
+    for episode, collected in episodes:
+        parts.append(episode_block(rng, episode, collected))
+        parts.append("\n".join(write_block(rng, episode)) + "\n\n")
+    return "".join(parts)
+
+def chemistry_history(rng, mrn, tests, episodes):
+    """
+    Cumulative history text of a chemistry test set: one block per episode.
+    """
+    parts = [page_header(rng, mrn, episodes[0][0])]
+    for episode, collected in episodes:
+        parts.append(episode_block(rng, episode, collected))
+        lines = []
+        for test in tests:
+            line, low, high, decimals = CHEMISTRY[test]
+            lines.append(line.format(value=flagged(rng, low, high, decimals), egfr=rng.randint(40, 120)))
+        parts.append("\n".join(lines) + "\n\n")
+    return "".join(parts)
+
+def fbc_history(rng, mrn, episodes):
+    """
+    Cumulative history text of a Full Blood Count: one table with a column per episode.
+    """
+    parts = [page_header(rng, mrn, episodes[0][0])]
+    parts.append("Date Collected\t" + "\t".join(f"{collected:%d/%m/%Y}" for _, collected in episodes) + "\n")
+    parts.append("Time Collected\t" + "\t".join(rng.choice(["?", f"{rng.randint(0, 23):02d}:00"]) for _ in episodes) + "\n")
+    parts.append("Episode\t" + "\t".join(episode for episode, _ in episodes) + "\n")
+    for name, low, high, decimals in FBC_ROWS:
+        parts.append(name + "\t" + "\t".join(flagged(rng, low, high, decimals) for _ in episodes) + "\n")
+    return "".join(parts) + "\n"
+
+def generate_patient(mrn, seed=0, labs=(2, 8), episodes=(1, 12), newest=date(2025, 3, 1)):
+    """
+    Return a patient's labs as dicts with the test set name, the episodes as
+    (episode, dd/mm/yyyy) pairs, newest first, and the cumulative history text.
+    labs and episodes are (fewest, most) ranges.
+    """
+    rng = random.Random(f"{seed}:{mrn}")
+    patient = []
+    for _ in range(rng.randint(*labs)):
+        name = rng.choice([FBC] + list(TEST_SETS) + list(BLOCK_SETS))
+        dates = collected_dates(rng, rng.randint(*episodes), newest - timedelta(days=rng.randint(0, 60)))
+        lab_episodes = [(episode_number(rng), collected) for collected in dates]
+        if name == FBC:
+            text = fbc_history(rng, mrn, lab_episodes)
+        elif name in BLOCK_SETS:
+            text = block_history(rng, mrn, BLOCK_SETS[name], lab_episodes)
+        else:
+            text = chemistry_history(rng, mrn, TEST_SETS[name], lab_episodes)
+        patient.append({"name": name, "episodes": [(episode, f"{collected:%d/%m/%Y}") for episode, collected in lab_episodes],
+                        "text": text})
+    return patient
+
+def patient_text(labs):
+    """
+    Join a patient's labs into one text, laid out like the text files transcribe.py writes.
+    """
+    return "".join(f"\n Lab : {lab+1} {content['text']}\n" for lab, content in enumerate(labs))
+
+def generate_corpus(patients=100, seed=0, labs=(2, 8), episodes=(1, 12), first_mrn=10000000):
+    """
+    Yield (MRN, text) for the given number of synthetic patients.
+    """
+    for number in range(patients):
+        mrn = str(first_mrn + number)
+        yield mrn, patient_text(generate_patient(mrn, seed, labs, episodes))
+
+def write_corpus(folder, patients=100, seed=0, labs=(2, 8), episodes=(1, 12)):
+    """
+    Write a synthetic corpus as one <MRN>.txt file per patient. Returns the bytes written.
+    """
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    for mrn, text in generate_corpus(patients, seed, labs, episodes):
+        with open(os.path.join(folder, mrn + '.txt'), 'w', encoding='utf-8') as file:
+            written += file.write(text)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a corpus of synthetic cumulative history text files.")
+    parser.add_argument("folder", help="Folder for the patient text files")
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--labs", type=int, nargs=2, default=(2, 8), metavar=("FEWEST", "MOST"))
+    parser.add_argument("--episodes", type=int, nargs=2, default=(1, 12), metavar=("FEWEST", "MOST"))
+    args = parser.parse_args()
+
+    written = write_corpus(args.folder, args.patients, args.seed, tuple(args.labs), tuple(args.episodes))
+    print(f"Wrote {args.patients} patients, {written / 1e6:.1f} MB, to {args.folder}")
@@ -0,0 +1,23 @@
+import pytest
+from batch import report_errors, run_batch
+
+
+def reciprocal(number):
+    return 1 / number
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failures_are_collected_and_outcomes_keep_the_input_order(workers):
+    outcomes = run_batch(reciprocal, [4, 0, 2, 0, 1], workers=workers, chunksize=2)
+    assert [item for item, _, _ in outcomes] == [4, 0, 2, 0, 1]
+    assert [result for _, result, _ in outcomes] == [0.25, None, 0.5, None, 1.0]
+    errors = [error for _, _, error in outcomes]
+    assert [error is None for error in errors] == [True, False, True, False, True]
+    assert errors[1].startswith("ZeroDivisionError: division by zero\nTraceback")
+
+
+def test_failures_are_written_to_the_report(tmp_path):
+    outcomes = run_batch(reciprocal, [1, 0])
+    report = tmp_path / "batch_errors.txt"
+    assert report_errors(outcomes, str(report)) == 1
+    assert report.read_text(encoding="utf-8").startswith("File: 0\nZeroDivisionError")
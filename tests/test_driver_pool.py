@@ -0,0 +1,33 @@
+from driver_pool import DriverPool
+
+
+class FakeDriver:
+    def __init__(self, crashed=False):
+        self.crashed = crashed
+        self.quit_called = False
+
+    def quit(self):
+        self.quit_called = True
+
+
+def is_authenticated(driver):
+    if driver.crashed:
+        raise ConnectionError("browser crashed")
+    return True
+
+
+def test_driver_failing_the_session_check_is_replaced():
+    started = []
+
+    def create_driver():
+        started.append(FakeDriver())
+        return started[-1]
+
+    pool = DriverPool(1, create_driver, lambda driver, wait: None, is_authenticated)
+    with pool.session() as (driver, wait):
+        pass
+    driver.crashed = True
+    with pool.session() as (replacement, wait):
+        assert replacement is not driver
+    assert driver.quit_called and len(started) == 2
+    pool.close()
@@ -0,0 +1,63 @@
+import os
+import threading
+import requests
+import replay_server
+import transcribe
+from http_backend import HttpBackend, SessionExpired, GIVE_UP_AFTER
+
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings")
+
+
+class FakeResponse:
+    text = "ok"
+
+
+def test_expired_session_is_logged_in_again_once_for_all_threads():
+    backend = HttpBackend({"username": "user", "password": "secret"}, base_url="http://127.0.0.1:9")
+    threads = 4
+    arrived = threading.Barrier(threads)
+    state = {"expired": True, "logins": 0}
+
+    def send(method, step, params=None, data=None):
+        if step == "login":
+            state["logins"] += 1
+            state["expired"] = False
+        elif state["expired"]:
+            arrived.wait(5)  # Every thread has seen the session expire before any logs in
+            raise SessionExpired(f"Session expired during {step}")
+        return FakeResponse()
+
+    backend._send = send
+    workers = [threading.Thread(target=backend._request, args=("GET", "patient_search")) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+    assert state["logins"] == 1
+    backend.close()
+
+
+def test_recorded_session_replays_into_the_same_patient_text():
+    server = replay_server.start_server(os.path.join(RECORDINGS, "http_session.jsonl"))
+    backend = HttpBackend(transcribe.CREDENTIALS, base_url=f"http://127.0.0.1:{server.server_port}")
+    try:
+        backend.login(transcribe.CREDENTIALS)
+        content = transcribe.scrape_patient(backend, "10000001")
+    finally:
+        backend.close()
+        server.shutdown()
+    with open(os.path.join(RECORDINGS, "http_session.txt"), 'r', encoding='utf-8', newline='') as file:
+        assert content == file.read()
+    assert content.count("\n Lab : ") == 3
+
+
+def test_backend_is_given_up_after_patients_in_a_row_fall_back():
+    backend = HttpBackend({"username": "user", "password": "secret"}, base_url="http://127.0.0.1:9")
+    for _ in range(GIVE_UP_AFTER - 1):
+        backend.record_patient(False)
+    backend.record_patient(True)
+    assert backend.usable
+    for _ in range(GIVE_UP_AFTER):
+        backend.record_patient(False)
+    assert not backend.usable
+    backend.close()
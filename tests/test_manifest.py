@@ -0,0 +1,74 @@
+import os
+import sle
+from manifest import Manifest
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_only_files_a_changed_pattern_can_affect_are_processed_again(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    patterns = {"Sodium": "a", "Urea": "b"}
+    keywords = {"Sodium": "sodium", "Urea": "urea", "Calcium": "calcium"}
+    sodium = write(tmp_path / "sodium.txt", "Sodium 140 mmol/L\n")
+    urea = write(tmp_path / "urea.txt", "Urea 5.1 mmol/L\nCalcium mentioned\n")
+    manifest.record(sodium, "v1", None, patterns, {"Sodium"})
+    manifest.record(urea, "v1", None, patterns, {"Urea"})
+
+    changed = {"Sodium": "c", "Urea": "b"}
+    assert not manifest.is_current(sodium, "v1", changed, keywords)
+    assert manifest.is_current(urea, "v1", changed, keywords)
+
+    added = {**patterns, "Calcium": "d"}
+    assert manifest.is_current(sodium, "v1", added, keywords)
+    assert not manifest.is_current(urea, "v1", added, keywords)
+    assert not manifest.is_current(sodium, "v1", {**patterns, "Hep B": "e"}, keywords)
+
+
+def test_changing_a_pattern_extracts_only_the_files_it_matches_again(tmp_path, monkeypatch):
+    inputs = tmp_path / "textfiles"
+    inputs.mkdir()
+    write(inputs / "1001.txt", "Date collected 01/02/2025\nSodium 140 mmol/L\n")
+    write(inputs / "1002.txt", "Date collected 01/02/2025\nUrea 5.1 mmol/L\n")
+    output = tmp_path / "sheets"
+    output.mkdir()
+
+    assert len(sle.process_text_files(str(inputs), str(output))) == 2
+    assert sle.process_text_files(str(inputs), str(output)) == []
+    monkeypatch.setitem(sle.pattern_versions, "Sodium", "changed")
+    outcomes = sle.process_text_files(str(inputs), str(output))
+    assert [(item, error) for item, _, error in outcomes] == [(str(inputs / "1001.txt"), None)]
+    assert outcomes[0][1] == str(output / "1001.xlsx")
+
+
+def test_unchanged_files_are_skipped_until_the_parser_version_changes(tmp_path):
+    path = str(tmp_path / "manifest.json")
+    manifest = Manifest(path)
+    text = write(tmp_path / "1001.txt", "Sodium 140 mmol/L\n")
+    assert not manifest.is_current(text, "v1")
+    manifest.record(text, "v1", None)
+    manifest.save()
+
+    manifest = Manifest(path)
+    assert manifest.is_current(text, "v1")
+    assert not manifest.is_current(text, "v2")
+
+
+def test_touched_files_are_only_processed_again_when_their_content_changed(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    text = write(tmp_path / "1001.txt", "Sodium 140 mmol/L\n")
+    manifest.record(text, "v1", None)
+    stat = os.stat(text)
+    os.utime(text, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert manifest.is_current(text, "v1")
+    write(tmp_path / "1001.txt", "Sodium 141 mmol/L\n")
+    assert not manifest.is_current(text, "v1")
+
+
+def test_a_missing_output_is_written_again(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    text = write(tmp_path / "1001.txt", "Sodium 140 mmol/L\n")
+    manifest.record(text, "v1", str(tmp_path / "1001.xlsx"))
+    assert not manifest.is_current(text, "v1")
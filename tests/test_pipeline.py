@@ -0,0 +1,50 @@
+import os
+from datetime import date
+import pandas as pd
+import pipeline
+import synthetic
+from pipeline import LabPipeline, merge_chem_frames, merge_fbc_frames
+from translate import combine_results, consolidate_fbc_data, lab_tests, parse_lab_results
+
+
+def patient_labs(mrn):
+    return [f"\n Lab : {number} {lab['text']}\n" for number, lab in enumerate(synthetic.generate_patient(mrn, 0, (3, 6), (2, 8)), 1)]
+
+
+def test_merged_labs_match_a_whole_text_parse():
+    for mrn in ("10000001", "10000002", "10000003"):
+        labs = patient_labs(mrn)
+        whole = parse_lab_results("".join(labs))
+        merged = merge_chem_frames([parse_lab_results(lab) for lab in labs])
+        pd.testing.assert_frame_equal(merged.sort_index(), whole.sort_index())
+        whole_fbc = consolidate_fbc_data("".join(labs))
+        merged_fbc = merge_fbc_frames([consolidate_fbc_data(lab) for lab in labs])
+        pd.testing.assert_frame_equal(merged_fbc.sort_index(), whole_fbc.sort_index(), check_dtype=False)
+
+
+def test_merge_keeps_a_later_none_and_only_masks_the_placeholder():
+    day = date(2025, 1, 1)
+    test = next(iter(lab_tests))
+    first = pd.DataFrame.from_dict({day: {name: '-' for name in lab_tests} | {test: "5"}}, orient='index')
+    second = pd.DataFrame.from_dict({day: {name: '-' for name in lab_tests} | {test: None}}, orient='index')
+    third = pd.DataFrame.from_dict({day: {name: '-' for name in lab_tests}}, orient='index')
+    merged = merge_chem_frames([first, second, third])
+    assert merged.loc[day, test] is None
+    assert (merged.loc[day].drop(test) == '-').all()
+
+
+def test_a_patient_is_finalised_once_with_the_labs_in_order(tmp_path, monkeypatch):
+    sheets = {}
+    monkeypatch.setattr(pipeline, "save_translation", lambda frame, patient: sheets.setdefault(patient, frame))
+    contents = [lab["text"] for lab in synthetic.generate_patient("10000001", 0, (3, 6), (2, 8))]
+    lab_pipeline = LabPipeline(parse_workers=3, text_folder=str(tmp_path) + os.sep)
+    for lab in reversed(range(1, len(contents) + 1)):  # Out of order, as parallel scrapers finish them
+        lab_pipeline.submit_lab("10000001", lab, contents[lab - 1])
+    lab_pipeline.finish_patient("10000001", len(contents))
+    assert lab_pipeline.close() == 0
+
+    text = (tmp_path / "10000001.txt").read_text(encoding="utf-8")
+    assert text == "".join(patient_labs("10000001"))
+    whole = combine_results(consolidate_fbc_data(text), parse_lab_results(text))
+    pd.testing.assert_frame_equal(sheets["10000001"], whole, check_dtype=False)
+    assert lab_pipeline.outputs == {"10000001": sheets["10000001"]}
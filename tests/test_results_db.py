@@ -0,0 +1,48 @@
+from datetime import date
+from results_db import ResultsDatabase, since_date
+from results_store import result_rows
+
+
+def database_with_results(tmp_path):
+    database = ResultsDatabase(str(tmp_path / "results.sqlite"))
+    database.load("sle", result_rows("1001", {"eGFR": {"01/02/2025": ">60", "01/01/2025": "45 L"},
+                                              "Urea": {"01/02/2025": "2.1 H"}}, {"Urea": "mmol/L"}))
+    database.load("sle", result_rows("1002", {"eGFR": {"15/01/2025": "75"}}))
+    return database
+
+
+def test_values_are_parsed_into_number_comparator_and_flag(tmp_path):
+    database = database_with_results(tmp_path)
+    assert database.series("1001", "eGFR") == [("2025-01-01", "45 L", 45.0, "", "L", "", "sle"),
+                                               ("2025-02-01", ">60", 60.0, ">", "", "", "sle")]
+    assert database.series("1001", "Urea") == [("2025-02-01", "2.1 H", 2.1, "", "H", "mmol/L", "sle")]
+    assert database.series("1001", "Urea", source="translate") == []
+
+
+def test_cohorts_combine_every_filter(tmp_path):
+    database = database_with_results(tmp_path)
+    assert [row[:3] for row in database.cohort("eGFR", above=50)] == [("1001", "2025-02-01", ">60"),
+                                                                       ("1002", "2025-01-15", "75")]
+    assert [row[:2] for row in database.cohort("eGFR", since="2025-01-10", until="2025-01-31")] == [("1002", "2025-01-15")]
+    assert [row[:2] for row in database.cohort("eGFR", flag="L")] == [("1001", "2025-01-01")]
+    assert database.cohort("eGFR", below=40) == []
+
+
+def test_loading_a_patient_again_replaces_their_results(tmp_path):
+    database = database_with_results(tmp_path)
+    database.load("sle", result_rows("1001", {"eGFR": {"01/03/2025": "58"}}))
+    assert [row[1] for row in database.series("1001", "eGFR")] == ["58"]
+    assert database.series("1001", "Urea") == []
+
+
+def test_periods_count_back_from_today():
+    assert since_date("2025-01-10") == "2025-01-10"
+    assert since_date("2w", today=date(2025, 3, 1)) == "2025-02-15"
+    assert since_date("1y", today=date(2025, 3, 1)) == "2024-03-01"
+
+
+def test_loading_a_patient_again_without_results_removes_them(tmp_path):
+    database = database_with_results(tmp_path)
+    database.load("sle", result_rows("1001", {}), "1001")
+    assert [row[0] for row in database.cohort("eGFR")] == ["1002"]
+    assert database.series("1001", "eGFR") == []
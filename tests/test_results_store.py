@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+import synthetic
+from results_store import ResultsStore, result_rows
+from sle import text_file_rows
+from translate import translate_text, translation_rows
+
+
+def patient_text(mrn):
+    return "".join(f"\n Lab : {number} {lab['text']}\n"
+                   for number, lab in enumerate(synthetic.generate_patient(mrn, 0, (3, 6), (2, 8)), 1))
+
+
+def test_rows_are_read_back_with_their_parsed_values(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    store.append("sle", result_rows("1001", {"eGFR": {"01/02/2025": ">60", "03/02/2025": "-"},
+                                             "Urea": {"01/02/2025": "7.5 H"}}, {"Urea": "mmol/L"}))
+    assert store.read("sle").empty  # Buffered until flushed
+    store.flush()
+
+    rows = store.read("sle")
+    assert list(zip(rows["test"], rows["raw"], rows["numeric"], rows["flag"], rows["unit"])) == [
+        ("eGFR", ">60", 60.0, "", ""), ("Urea", "7.5 H", 7.5, "H", "mmol/L")]
+    assert list(store.read("sle", tests=["Urea"])["raw"]) == ["7.5 H"]
+    assert store.read("translate").empty
+
+
+def test_the_newest_part_holding_a_patient_wins(tmp_path):
+    store = ResultsStore(str(tmp_path), flush_rows=1)
+    store.append("sle", result_rows("1001", {"Urea": {"01/02/2025": "5.1", "01/03/2025": "5.3"}}))
+    store.append("sle", result_rows("1002", {"Urea": {"01/02/2025": "6.2"}}))
+    store.append("sle", result_rows("1001", {"Urea": {"01/04/2025": "5.9"}}))
+    assert len(store.part_files("sle")) == 3
+
+    rows = store.read("sle")
+    assert sorted(zip(rows["patient"], rows["raw"])) == [("1001", "5.9"), ("1002", "6.2")]
+    store.compact("sle")
+    assert len(store.part_files("sle")) == 1
+    assert sorted(zip(store.read("sle")["patient"], store.read("sle")["raw"])) == [("1001", "5.9"), ("1002", "6.2")]
+
+
+def test_a_patient_written_again_without_rows_is_dropped(tmp_path):
+    store = ResultsStore(str(tmp_path))
+    store.append("sle", result_rows("1001", {"Blood Urea": {"01/02/2025": "5.1"}}), "1001")
+    store.append("sle", result_rows("1002", {"Blood Urea": {"01/02/2025": "6.2"}}), "1002")
+    store.flush()
+    store.append("sle", result_rows("1001", {}), "1001")
+    store.flush()
+
+    rows = store.read("sle")
+    assert list(rows["patient"]) == ["1002"]
+    store.compact("sle")
+    assert list(store.read("sle")["patient"]) == ["1002"]
+
+
+def test_translate_sheets_are_exported_in_the_translate_layout(tmp_path):
+    labs = patient_text("10000001")
+    (tmp_path / "10000001.txt").write_text(labs, encoding="utf-8")
+    store = ResultsStore(str(tmp_path / "store"))
+    store.append("translate", translation_rows(str(tmp_path / "10000001.txt")), "10000001")
+    store.flush()
+
+    sheet = pd.read_excel(store.export_excel("10000001", "translate", str(tmp_path / "out")), index_col=0, dtype=str)
+    sheet.columns = [collected.date() for collected in sheet.columns]
+    expected = translate_text(labs, "10000001")
+    expected = expected.where(expected != '-').dropna(how='all').dropna(axis=1, how='all')
+    pd.testing.assert_frame_equal(sheet, expected, check_names=False)
+    with pytest.raises(ValueError):
+        store.export_excel("10000001", "unknown", str(tmp_path / "out"))
+
+
+def test_rows_carry_the_units_of_their_tests(tmp_path):
+    path = tmp_path / "10000001.txt"
+    path.write_text(patient_text("10000001") + patient_text("10000002"), encoding="utf-8")
+    translated = translation_rows(str(path))
+    extracted = text_file_rows(str(path))
+    assert {"White Cell Count", "Haemoglobin", "Creatinine"} <= set(translated["test"])
+    assert "Blood Creatinine" in set(extracted["test"])
+    measured = translated[~translated["test"].isin(["Histopathology", "LA"])]
+    assert (measured["unit"] != "").all()
+    assert set(extracted.loc[extracted["test"] == "Blood Creatinine", "unit"]) == {"umol/L"}
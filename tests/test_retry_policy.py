@@ -0,0 +1,30 @@
+import pytest
+from retry_policy import CircuitBreaker, RetryError, SITE_DOWN, TRANSIENT
+
+
+def test_breaker_gives_up_only_while_open():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05, give_up_after=0.01)
+    breaker.record_failure(SITE_DOWN)
+    breaker.wait()  # Opened just now, not down long enough to give up
+    breaker.record_failure(SITE_DOWN)
+    with pytest.raises(RetryError):
+        breaker.wait()
+
+
+def test_breaker_lets_a_step_through_after_a_long_outage():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.02, give_up_after=0.01)
+    breaker.record_failure(SITE_DOWN)
+    breaker.wait()
+    assert breaker.wait() == 0  # Pause over: the next step goes ahead to try the site
+    breaker.record_success()
+    breaker.record_failure(SITE_DOWN)
+    breaker.wait()  # A new outage starts its own clock
+
+
+def test_other_failures_end_an_outage():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.02, give_up_after=0.01)
+    breaker.record_failure(SITE_DOWN)
+    breaker.wait()
+    breaker.record_failure(TRANSIENT)
+    breaker.record_failure(SITE_DOWN)
+    breaker.wait()
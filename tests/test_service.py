@@ -0,0 +1,82 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+import pytest
+import service
+
+
+@pytest.fixture
+def scrape_service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scrape_service = service.ScrapeService(workers=2)
+    yield scrape_service
+    scrape_service.close()
+
+
+def test_empty_batch_is_refused(scrape_service):
+    with pytest.raises(ValueError):
+        scrape_service.submit([])
+    with pytest.raises(ValueError):
+        scrape_service.submit(["", "  "])
+    assert scrape_service.jobs == {}
+
+
+def test_patient_in_flight_is_scraped_once_for_every_job(scrape_service, monkeypatch):
+    release = threading.Event()
+    scraped = []
+
+    def process_patient(pool, mrn, http_backend, store, index, direct):
+        scraped.append(mrn)
+        release.wait(5)
+        store.start_patient(mrn, 1)
+        store.finish_patient(mrn)
+
+    monkeypatch.setattr(service.transcribe, "process_patient", process_patient)
+    first = scrape_service.submit(["777"])
+    second = scrape_service.submit(["777", "888"])
+    release.set()
+    assert first.wait_for_result(0, 5) and second.wait_for_result(1, 5)
+    assert sorted(scraped) == ["777", "888"]
+    assert first.status()["state"] == "done" and second.status()["done"] == 2
+
+
+def test_finished_jobs_expire(scrape_service, monkeypatch):
+    monkeypatch.setattr(service.transcribe, "process_patient",
+                        lambda pool, mrn, http_backend, store, index, direct: store.finish_patient(mrn))
+    scrape_service.retention = 0
+    old = scrape_service.submit(["777"])
+    assert old.wait_for_result(0, 5)
+    scrape_service.submit(["888"])
+    assert old.id not in scrape_service.jobs
+
+
+@pytest.fixture
+def server(scrape_service):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), service.make_handler(scrape_service, token="secret"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def request(url, token=None, body=None):
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data, headers), timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def test_requests_without_the_token_are_refused(server, scrape_service):
+    assert request(server + "/jobs", body={"mrns": ["777"]}) == 401
+    assert request(server + "/jobs", token="wrong", body={"mrns": ["777"]}) == 401
+    assert request(server + "/jobs") == 401
+    assert scrape_service.jobs == {}
+    assert request(server + "/jobs", token="secret") == 200
+    assert request(server + "/health") == 200
@@ -0,0 +1,45 @@
+from timing import Spans, SPANS_FILE_VARIABLE, SPANS_RUN_VARIABLE
+import waits
+from waits import WaitTimes
+
+
+def test_spans_written_to_a_file_are_not_kept_in_memory(tmp_path, monkeypatch):
+    monkeypatch.delenv(SPANS_FILE_VARIABLE, raising=False)  # Undoes configure's setting after the test
+    monkeypatch.delenv(SPANS_RUN_VARIABLE, raising=False)
+    spans = Spans()
+    spans.configure(str(tmp_path / "spans.jsonl"))
+    for _ in range(3):
+        with spans.span("step"):
+            pass
+    assert len(spans.records) == 0
+    assert spans.report()["step"]["count"] == 3
+
+
+def test_wait_times_keep_totals_only():
+    wait_times = WaitTimes()
+    for seconds in (1.0, 3.0, 2.0):
+        wait_times.record("find_data", seconds)
+    assert wait_times.report() == {"find_data": (3, 2.0, 3.0)}
+
+
+class FakePage:
+    """
+    Answers NETWORK_STATE_SCRIPT with the resources fetched since the last check.
+    """
+    def __init__(self, fetched):
+        self.fetched = list(fetched)
+
+    def execute_script(self, script):
+        return ["complete", self.fetched.pop(0) if self.fetched else 0, 0]
+
+
+def test_network_idle_counts_resources_since_the_last_check(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(waits.time, "monotonic", lambda: now[0])
+    condition = waits.network_idle(quiet_period=0.3)
+    page = FakePage([250, 250, 0, 0])  # A full buffer still counts as activity
+    results = []
+    for _ in range(4):
+        results.append(condition(page))
+        now[0] += 0.2
+    assert results == [False, False, False, True]
@@ -0,0 +1,155 @@
+import requests
+import transcribe
+from episode_index import EpisodeIndex
+from http_backend import NotFound
+from job_store import JobStore, FAILED
+from retry_policy import CircuitBreaker, RetryPolicy, RetryRule, NOT_FOUND, SITE_DOWN
+
+
+class FakeBackend:
+    """
+    Stands in for HttpBackend: labs are listed as (episode, date) pairs and their
+    content is made up from the listing, with every lab opened counted.
+    """
+    usable = True
+
+    def __init__(self, labs):
+        self.labs = labs
+        self.opened = []
+
+    def record_patient(self, answered):
+        pass
+
+    def patient_search(self, patient):
+        return patient
+
+    def list_episodes(self, patient):
+        return list(range(len(self.labs)))
+
+    def episode_listing(self, lab):
+        return list(self.labs[lab])
+
+    def cumulative_history(self, lab):
+        self.opened.append(lab)
+        return "".join(f"Episode\t{episode}\nDate collected\t{date}\n" for episode, date in self.labs[lab])
+
+    def finish(self):
+        pass
+
+
+def test_rerun_of_finished_patient_fetches_every_lab(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    backend = FakeBackend([[("ST001", "01/01/2025")], [("ST002", "02/01/2025")]])
+    assert store.enqueue(["777"]) == ["777"]
+    transcribe.scrape_patient(backend, "777", store)
+    store.finish_patient("777")
+    assert store.enqueue(["777"]) == []
+
+    backend.labs[1].append(("ST003", "03/01/2025"))
+    rerun = FakeBackend(backend.labs)
+    assert store.enqueue(["777"], rerun_done=True) == ["777"]
+    content = transcribe.scrape_patient(rerun, "777", store)
+    assert rerun.opened == [0, 1]
+    assert "ST003" in content
+    store.close()
+
+
+def test_refresh_reopens_only_labs_with_new_episodes(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    index = EpisodeIndex(str(tmp_path / "episodes.sqlite"))
+    backend = FakeBackend([[("ST001", "01/01/2025")], [("ST002", "02/01/2025")]])
+    store.enqueue(["777"])
+    transcribe.scrape_patient(backend, "777", store, index)
+    store.finish_patient("777")
+
+    backend.labs[1].append(("ST003", "03/01/2025"))
+    refresh = FakeBackend(backend.labs)
+    store.enqueue(["777"], rerun_done=True)
+    content = transcribe.scrape_patient(refresh, "777", store, index)
+    assert refresh.opened == [1]
+    assert "ST001" in content and "ST003" in content
+    store.close()
+    index.close()
+
+
+def test_index_wins_over_a_stale_checkpoint(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    index = EpisodeIndex(str(tmp_path / "episodes.sqlite"))
+    backend = FakeBackend([[("ST001", "01/01/2025")], [("ST002", "02/01/2025")]])
+    store.enqueue(["777"])
+    transcribe.scrape_patient(backend, "777", store, index)  # Not finished, checkpoints are kept
+
+    backend.labs[1].append(("ST003", "03/01/2025"))
+    refresh = FakeBackend(backend.labs)
+    content = transcribe.scrape_patient(refresh, "777", store, index)
+    assert refresh.opened == [1]
+    assert "ST003" in content
+    store.close()
+    index.close()
+
+
+class MissingPatientBackend(FakeBackend):
+    def patient_search(self, patient):
+        raise NotFound(f"Patient {patient} not found")
+
+
+class UnusablePool:
+    def session(self):
+        raise AssertionError("The browser should not be tried for a patient that is not there")
+
+
+def test_patient_missing_over_http_is_not_tried_in_the_browser(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    store.enqueue(["777"])
+    transcribe.process_patient(UnusablePool(), "777", MissingPatientBackend([]), store)
+    assert store.patient_state("777")[0] == FAILED
+    assert "777" in (tmp_path / "fault_patients.txt").read_text()
+    store.close()
+
+
+class FakePage:
+    """
+    A page holding the given element IDs and body text.
+    """
+    current_url = "http://127.0.0.1/trakcarelab/csp/system.Home.cls#/Component/web.DEBDebtor.FindList"
+
+    def __init__(self, ids, text=""):
+        self.ids = ids
+        self.text = text
+
+    def find_elements(self, by, value):
+        return [value] if value in self.ids else []
+
+    def find_element(self, by, value):
+        return self
+
+
+def test_slow_search_is_not_taken_for_a_missing_patient():
+    page = FakePage({"web_DEBDebtor_FindList_0-item-HospitalMRN", "web_DEBDebtor_FindList_0-item-SurnameParam"})
+    assert transcribe.diagnose_timeout(page, "patient_search") is None
+
+
+def test_search_without_matches_is_a_missing_patient():
+    page = FakePage({"web_DEBDebtor_FindList_0-item-HospitalMRN"}, "MRN Surname\nNo matching records")
+    assert transcribe.diagnose_timeout(page, "patient_search") == NOT_FOUND
+
+
+class DeadSiteBackend(FakeBackend):
+    def cumulative_history(self, lab):
+        self.opened.append(lab)
+        raise requests.ConnectionError("Connection refused")
+
+
+def test_dead_site_over_http_is_retried_and_trips_the_breaker(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    breaker = CircuitBreaker(threshold=2, cooldown=0)
+    monkeypatch.setattr(transcribe, "policy", RetryPolicy({SITE_DOWN: RetryRule(2)}, breaker))
+    store = JobStore(str(tmp_path / "jobs.sqlite"))
+    store.enqueue(["777"])
+    backend = DeadSiteBackend([[("ST001", "01/01/2025")]])
+    transcribe.process_patient(UnusablePool(), "777", backend, store)
+    assert backend.opened == [0, 0]
+    assert breaker.failures == 2
+    assert store.patient_state("777")[0] == FAILED
+    store.close()
@@ -0,0 +1,14 @@
+from datetime import date
+from translate import parse_lab_results
+
+
+def test_chemistry_values_quoted_in_a_report_are_not_taken_as_results():
+    text = ("Episode\tXD01593975\nDate collected\t20/01/2025\n\n"
+            "Sodium 136 mmol/L 136 - 145\n\n"
+            "Episode\tXD04185146\nDate collected\t30/01/2025\n\n"
+            "CLINICAL:\nKnown CKD, Creatinine 300 umol/L last month.\n\n"
+            "PATHOLOGIST: Dr CJ Andrews\n")
+    results = parse_lab_results(text)
+    assert results.loc[date(2025, 1, 20), "Sodium"] == "136"
+    assert results.loc[date(2025, 1, 30), "Creatinine"] == '-'
+    assert "Creatinine 300 umol/L" in results.loc[date(2025, 1, 30), "Histopathology"]
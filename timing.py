@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+SPANS_FILE_VARIABLE = "LABLINK_SPANS_FILE"  # Lets worker processes write to the same spans file
+SPANS_RUN_VARIABLE = "LABLINK_SPANS_RUN"
+MAX_RECORDS = 100000  # Spans kept in memory when there is no spans file, the oldest are dropped
+
+
+def percentile(values, fraction):
+    """
+    Return the given percentile (0 to 1) of the values, interpolating between the nearest two.
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def summarise(records):
+    """
+    Return {step: {count, p50, p95, max, total, retries}} in seconds for span records.
+    """
+    by_step = {}
+    for record in records:
+        by_step.setdefault(record["step"], []).append(record)
+    summary = {}
+    for step, step_records in by_step.items():
+        seconds = [record["seconds"] for record in step_records]
+        summary[step] = {
+            "count": len(seconds),
+            "p50": percentile(seconds, 0.5),
+            "p95": percentile(seconds, 0.95),
+            "max": max(seconds),
+            "total": sum(seconds),
+            "retries": sum(max(record.get("attempts", 1) - 1, 0) for record in step_records),
+            "errors": sum(1 for record in step_records if "error" in record),
+        }
+    return summary
+
+def print_summary(summary):
+    for step, stats in sorted(summary.items(), key=lambda item: -item[1]["total"]):
+        print(f"Step {step}: {stats['count']} spans, p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s, "
+              f"max {stats['max']:.3f}s, total {stats['total']:.1f}s, "
+              f"{stats['retries']} retries, {stats['errors']} errors")
+
+def read_spans(path, run=None):
+    """
+    Read the span records of a spans file, optionally only those of one run.
+    """
+    records = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                if run is None or record.get("run") == run:
+                    records.append(record)
+    return records
+
+
+class Spans:
+    """
+    Timing spans of the steps of a run, appended as JSON lines to a file once one
+    is set, and otherwise kept in memory, up to MAX_RECORDS of the latest.
+
+    Every span has its step name, start time, duration in seconds, process, thread
+    and run id, plus whatever attributes the step adds, such as retry attempts or
+    payload sizes. The file is passed on to worker processes through the
+    environment, so a process pool writes all its spans to the same file.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = deque(maxlen=MAX_RECORDS)
+        self.path = os.environ.get(SPANS_FILE_VARIABLE)
+        self.run = os.environ.get(SPANS_RUN_VARIABLE) or uuid.uuid4().hex[:12]
+        self._file = None
+        self._file_pid = None
+
+    def configure(self, path):
+        """
+        Append spans to path from now on, in this process and in worker processes started after.
+        """
+        with self._lock:
+            self.path = path
+            os.environ[SPANS_FILE_VARIABLE] = path
+            os.environ[SPANS_RUN_VARIABLE] = self.run
+
+    def record(self, step, seconds, start=None, **attributes):
+        record = {"step": step, "start": start if start is not None else time.time() - seconds,
+                  "seconds": round(seconds, 6), "pid": os.getpid(),
+                  "thread": threading.current_thread().name, "run": self.run, **attributes}
+        with self._lock:
+            if self.path is None:
+                self.records.append(record)
+            else:
+                # A forked worker must not share the parent's file buffer
+                if self._file is None or self._file_pid != os.getpid():
+                    self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+                    self._file_pid = os.getpid()
+                self._file.write(json.dumps(record, default=str) + "\n")
+
+    @contextmanager
+    def span(self, step, **attributes):
+        """
+        Time the enclosed block as a step. The attributes dict is yielded so the
+        block can add to it, e.g. span["size"] = len(content). An exception leaving
+        the block is recorded under "error" and raised again.
+        """
+        start = time.time()
+        started = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(step, time.perf_counter() - started, start, **attributes)
+
+    def report(self):
+        """
+        Print and return the p50/p95 summary by step of this run. Spans of worker
+        processes are included when they were written to a spans file.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            records = list(self.records)
+        if self.path is not None and os.path.exists(self.path):
+            records = read_spans(self.path, self.run)
+        summary = summarise(records)
+        print_summary(summary)
+        return summary
+
+spans = Spans()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise a spans file by step.")
+    parser.add_argument("path", nargs="?", default="spans.jsonl")
+    parser.add_argument("--run", help="Only this run id, the latest run if not given")
+    parser.add_argument("--all", action="store_true", help="Summarise every run in the file together")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    records = read_spans(args.path)
+    if not args.all and records:
+        run = args.run or records[-1]["run"]
+        records = [record for record in records if record["run"] == run]
+    summary = summarise(records)
+    if args.json:
+        print(json.dumps(summary, indent=1))
+    else:
+        print_summary(summary)
@@ -11,31 +11,140 @@ from selenium.webdriver.common.by import By
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, ElementNotInteractableException
+from selenium.common.exceptions import TimeoutException, ElementNotInteractableException, WebDriverException
 from translate import translate
+from driver_pool import DriverPool
+from http_backend import HttpBackend, BASE_URL
+from job_store import JobStore
+from episode_index import EpisodeIndex
+from records import normalise_records, save_records
+from waits import network_idle, wait_times, DEFAULT_POLL
+from pipeline import LabPipeline
+from timing import spans
+from retry_policy import RetryPolicy, RetryError, classify, NOT_FOUND, SESSION_EXPIRED, SITE_DOWN, UNKNOWN
+from driver_bootstrap import chromedriver_path, make_lean, block_heavy_content, record_bootstrap, report_bootstrap
+from selenium.common.exceptions import SessionNotCreatedException
+from concurrent.futures import ThreadPoolExecutor
 import os
 import pyperclip
+import re
+import threading
 import time
 
-MAX_RETRIES = 3
-
+PATIENT_BUDGET = 900  # Seconds a patient may spend in steps and retries before it is given up
+POOL_SIZE = 3  # Number of logged-in browsers working through patients at once
+RECYCLE_AFTER = 25  # Patients served before a browser is replaced
+POLL_FREQUENCY = DEFAULT_POLL  # Seconds between checks while waiting for the page
+PARSE_WORKERS = 2  # Threads parsing labs while scraping continues, in streaming mode
+PARSE_QUEUE_SIZE = 20  # Labs waiting to be parsed before scrapers are held back
+LEAN_BROWSER = False  # Headless, eager page loads, no images, fonts or media
+DIRECT_NAVIGATION = False  # Open each lab's cumulative history by address instead of through the find list
+EPISODE_PLACEHOLDER = "__EPISODE__"  # Stands in for the episode number in a cumulative history address
+USE_HTTP_BACKEND = False  # Fetch over direct HTTP first, falling back to the browser
+JOB_STORE_PATH = "jobs.sqlite"  # Progress of every patient and lab, used to resume failed runs
+EPISODE_INDEX_PATH = "episodes.sqlite"  # Episodes already scraped, used by incremental runs
+TEXT_FOLDER = 'output files\\'  # Copied page text, one file per patient
+RECORDS_FOLDER = 'records//'  # Structured records, one JSON file per patient
+SHEETS_FOLDER = 'sheets//'  # Sheets built straight from structured records
+SPANS_PATH = "spans.jsonl"  # Timing of every step, one JSON line per step run
+LOGIN_PATH = "/trakcarelab/csp/system.Home.cls#/Component/SSUser.Logon"  # Logon page, after the site address
+NO_RECORDS_TEXT = "No matching records"  # Shown in the find list when a search has no results
+
+# Serialises the cumulative history table into records inside the page.
+# Rows are read in document order: "Episode" and "Date collected" rows set the
+# episode and date for the result rows after them. A "Date Collected" row with
+# several dates (the Full Blood Count table) makes later rows one value per date.
+HISTORY_RECORDS_SCRIPT = """
+    var root = document.querySelector('[id^="web_EPVisitTestSet_CumulativeHistoryView_0"]');
+    root = root ? (root.closest('md-content, form, section') || document.body) : document.body;
+    var datePattern = /^\\d{2}\\/\\d{2}\\/\\d{4}$/;
+    var valuePattern = /^[<>]?\\d|^(Positive|Negative)/i;
+    var records = [], episode = '', date = '', columnDates = [];
+    root.querySelectorAll('tr').forEach(function (row) {
+        var cells = Array.from(row.querySelectorAll('td, th')).map(function (cell) { return cell.innerText.trim(); });
+        if (cells.length < 2) { return; }
+        var label = cells[0].toLowerCase();
+        if (label === 'episode') { episode = cells[1]; return; }
+        if (label === 'date collected') {
+            var dates = cells.slice(1).filter(function (cell) { return datePattern.test(cell); });
+            columnDates = dates.length > 1 ? dates : [];
+            if (dates.length) { date = dates[0]; }
+            return;
+        }
+        if (columnDates.length) {
+            cells.slice(1, columnDates.length + 1).forEach(function (value, i) {
+                if (value) { records.push({test: cells[0], value: value, collected: columnDates[i], episode: episode}); }
+            });
+        } else if (date && valuePattern.test(cells[1])) {
+            var flagged = row.querySelector('[class*="flag"], [class*="abnormal"]');
+            records.push({test: cells[0], value: cells[1], flag: flagged ? flagged.innerText.trim() : '',
+                          unit: cells[2] || '', reference_range: cells[3] || '', collected: date, episode: episode});
+        }
+    });
+    return records;
+"""
+
+CREDENTIALS = {"username": 'MP0819174', "password": 'Dermatology2025'}
+
+fault_lock = threading.Lock()
+
+# Retries by failure class, with a circuit breaker shared by every worker
+policy = RetryPolicy()
+
+
+def step_driver(args):
+    """
+    Find the driver among a step's arguments, given directly or through its wait.
+    """
+    for arg in args:
+        if isinstance(arg, webdriver.Remote):
+            return arg
+        if isinstance(arg, WebDriverWait):
+            return arg._driver
+    return None
+
+def diagnose_timeout(driver, step):
+    """
+    Look at the page after a wait ran out to tell why: the browser's error page
+    means the site is down, the logon form means the session expired, and a find
+    list without rows that says it has no matching records means the patient is
+    not there. A find list still without rows and without that caption is a slow
+    search. Returns None when the page looks fine and was just slow.
+    """
+    try:
+        if driver.current_url.startswith("chrome-error://"):
+            return SITE_DOWN
+        if step != "login" and driver.find_elements(By.ID, "SSUser_Logon_0-item-USERNAME"):
+            return SESSION_EXPIRED
+        if step == "patient_search" and not driver.find_elements(By.ID, "web_DEBDebtor_FindList_0-row-0-item-Episodes") \
+                and NO_RECORDS_TEXT in driver.find_element(By.TAG_NAME, "body").text:
+            return NOT_FOUND
+    except WebDriverException:
+        return None
+    return None
 
 def retry_operation(operation, *args):
     """
-    Retry a given operation up to MAX_RETRIES times.
-    Stops and raises an error after MAX_RETRIES failures.
+    Run a step, retrying it as the retry policy allows for the kind of failure:
+    stale or covered elements are retried after a short backoff, a dead site after
+    a long one, and a missing patient or an expired session not at all.
+    Raises RetryError, a RuntimeError, once the step fails for good.
+    Each call is timed as a span of the operation, with its attempts, last failure
+    class and, for text or lists, the size of what it returned.
     """
-    for attempt in range(MAX_RETRIES):
-        try:
-            return operation(*args)  # Attempt the operation
-        except Exception as e:
-            print(f"Error in {operation.__name__}: {e}. This was Attempt  {attempt + 1} of {MAX_RETRIES}.")
-            if attempt == MAX_RETRIES - 1:  # If last attempt, stop execution
-                raise RuntimeError(f"{operation.__name__} failed after {MAX_RETRIES} attempts.") from e
-
-def setup_driver():
+    driver = step_driver(args)
+    diagnose = (lambda error, step: diagnose_timeout(driver, step)) if driver is not None else None
+    with spans.span(operation.__name__) as span:
+        result = policy.run(operation, *args, diagnose=diagnose, attempts_seen=span)
+        if isinstance(result, (str, list)):
+            span["size"] = len(result)
+        return result
+
+def setup_driver(lean=LEAN_BROWSER):
     """
     Step 1: Set up the web driver
+    The chromedriver binary is only resolved once and then reused.
+    With lean=True the browser runs headless with eager page loads and without images, fonts or media.
     """
     # Driver Set Up
     print("Setting up driver...")
@@ -47,25 +156,30 @@ def setup_driver():
     chrome_options.add_argument('--disable-dev-shm-usage')  # Overcome limited resource issues
     chrome_options.add_argument('--log-level=3')  # Suppress logs
     chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])  # Disable logging
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(options=chrome_options, service=service)
+    if lean:
+        make_lean(chrome_options)
+    try:
+        driver = webdriver.Chrome(options=chrome_options, service=Service(chromedriver_path()))
+    except SessionNotCreatedException:
+        # The cached driver no longer matches the installed Chrome
+        driver = webdriver.Chrome(options=chrome_options, service=Service(chromedriver_path(refresh=True)))
+    if lean:
+        block_heavy_content(driver)
     return driver
 
-def login(driver, credentials,wait):
+def login(driver, credentials,wait,site_url=BASE_URL):
     """
     Step 2: Log in to the website with credentials.
+    site_url is the site's address, e.g. a local mock_trakcare.py for benchmarks.
     """
     # Perform login
     print(f"Logging in with credentials: {credentials}")
-    website = 'https://trakcarelabwebview.nhls.ac.za/trakcarelab/csp/system.Home.cls#/Component/SSUser.Logon'
+    website = site_url.rstrip('/') + LOGIN_PATH
     driver.get(website)
 
-    
-
     #Wait for the login page elements
     username_id = "SSUser_Logon_0-item-USERNAME"
     password_id = "SSUser_Logon_0-item-PASSWORD"
-    time.sleep(1)
 
     username_element = wait.until(EC.presence_of_element_located((By.ID, username_id)))
     password_element = wait.until(EC.presence_of_element_located((By.ID, password_id)))
@@ -76,7 +190,6 @@ def login(driver, credentials,wait):
     username_element.send_keys(credentials['username'])
     password_element.clear()
     password_element.send_keys(credentials['password'] + Keys.ENTER) 
-    time.sleep(1)
     record_id = "web_DEBDebtor_FindList_0-item-HospitalMRN"
     record_element = wait.until(EC.presence_of_element_located((By.ID, record_id))) ## STEP 1 - If this can be found then the User has logged in
     # Placeholder for actual login logic
@@ -94,19 +207,28 @@ def patient_search(patient_id,wait,driver):
     record_element.send_keys(patient_id + Keys.ENTER) 
     click_element_id = "web_DEBDebtor_FindList_0-row-0-item-Episodes"  # Element to click
     click_element = wait.until(EC.presence_of_element_located((By.ID, click_element_id)))
-    time.sleep(1)
+    wait.until(network_idle())  # Let the rest of the find list arrive before it is counted
     print('Patient Found')
 
-def copy_homepage_content(driver,wait):
+def return_to_find_list(driver, wait):
+    """
+    Go back from the cumulative history and wait until the find list is shown again.
+    """
+    driver.back()
+    wait.until(EC.visibility_of_element_located((By.ID, "web_DEBDebtor_FindList_0-row-0-item-Episodes")))
+    wait.until(network_idle())
+
+def copy_homepage_content(driver,wait,go_back=True):
     """
     Step 3: Copy and return homepage content.
+    Goes back to the find list afterwards unless go_back is False.
     """
     print("Copying homepage content...")
     ## Waiting for the Page to load
-    time.sleep(1)
     history_caption_id =   "web_EPVisitTestSet_CumulativeHistoryView_0-header-caption"
     history_page_element = wait.until(EC.presence_of_element_located((By.ID,history_caption_id)))
     history_page_element.click()
+    wait.until(network_idle())
 
 
     # Use JavaScript to extract the content
@@ -117,11 +239,31 @@ def copy_homepage_content(driver,wait):
         raise ValueError("Copied content is empty. Must retry")
 
 
-    driver.back()
-    time.sleep(1)
+    if go_back:
+        return_to_find_list(driver, wait)
     # Placeholder for content scraping
     return copied_content
 
+def copy_history_records(driver, wait, go_back=True):
+    """
+    Step 3 (structured): serialise the cumulative history table into result records
+    instead of copying the page text.
+    """
+    print("Copying cumulative history records...")
+    history_caption_id =   "web_EPVisitTestSet_CumulativeHistoryView_0-header-caption"
+    history_page_element = wait.until(EC.presence_of_element_located((By.ID,history_caption_id)))
+    history_page_element.click()
+    wait.until(network_idle())
+
+    records = driver.execute_script(HISTORY_RECORDS_SCRIPT)
+
+    if not records:
+        raise ValueError("No records found in the cumulative history. Must retry")
+
+    if go_back:
+        return_to_find_list(driver, wait)
+    return records
+
 def count_labs(driver):
     rows = driver.find_elements(By.XPATH, '//md-icon[starts-with(@id, "web_DEBDebtor_FindList_0-row-")]')
     num_of_labs = len(rows)
@@ -129,22 +271,87 @@ def count_labs(driver):
     print("Number of Labs:", num_of_labs)
     return num_of_labs
 
-def open_folder(wait,lab):
-    time.sleep(1)
-    if lab >= 1:
+def open_folder(wait,lab,collapse_prior=True):
+    if lab >= 1 and collapse_prior:
         prior_element_id = "web_DEBDebtor_FindList_0-row-"+ str(lab-1)+ "-item-Episodes"
-        prior_element = click_elemment = wait.until(EC.presence_of_element_located((By.ID, prior_element_id)))
+        prior_element = click_elemment = wait.until(EC.element_to_be_clickable((By.ID, prior_element_id)))
         prior_element.click()
 
     click_element_id = "web_DEBDebtor_FindList_0-row-"+ str(lab)+ "-item-Episodes"  # Element to click
-    click_element = wait.until(EC.presence_of_element_located((By.ID, click_element_id)))
+    click_element = wait.until(EC.element_to_be_clickable((By.ID, click_element_id)))
     click_element.click()
 
     misc_element_id = "web_EPVisitNumber_List_"+ str(lab) +"_0-row-0-misc-actionButton"
-    misc_element = wait.until(EC.presence_of_element_located((By.ID, misc_element_id)))
-    time.sleep(1)
+    misc_element = wait.until(EC.element_to_be_clickable((By.ID, misc_element_id)))  # Episode list has rendered
     print("Labs Found")
 
+def read_episode_lists(driver, labs):
+    """
+    Read the episode numbers and collected dates listed under expanded lab rows,
+    for all the given labs in one query.
+    Returns a list per lab of (episode, date) with date None where none is shown.
+    """
+    texts_per_lab = driver.execute_script("""
+        return arguments[0].map(function (prefix) {
+            var rows = {};
+            document.querySelectorAll('[id^="' + prefix + '"]').forEach(function (element) {
+                var match = element.id.match(/-row-(\\d+)/);
+                if (match && (!(match[1] in rows) || element.innerText.length > rows[match[1]].length)) {
+                    rows[match[1]] = element.innerText;
+                }
+            });
+            return Object.keys(rows).sort(function (a, b) { return a - b; }).map(function (key) { return rows[key]; });
+        });
+    """, ["web_EPVisitNumber_List_" + str(lab) + "_0-row-" for lab in labs])
+
+    listings = []
+    for row_texts in texts_per_lab:
+        listed = []
+        for text in row_texts:
+            episode_match = re.search(r"\b([A-Z]{1,4}\d{6,10})\b", text)
+            date_match = re.search(r"\d{2}/\d{2}/\d{4}", text)
+            if episode_match:
+                listed.append((episode_match.group(1), date_match.group(0) if date_match else None))
+        listings.append(listed)
+    return listings
+
+def read_episode_list(driver, lab):
+    """
+    Read the episode numbers and collected dates listed under an expanded lab row.
+    """
+    return read_episode_lists(driver, [lab])[0]
+
+def expand_all_labs(driver, wait, labs):
+    """
+    Expand the episode list of every lab row without collapsing any, so that
+    every lab's episodes are on the page at once. Rows already expanded are left alone.
+    """
+    for lab in range(labs):
+        misc_element_id = "web_EPVisitNumber_List_"+ str(lab) +"_0-row-0-misc-actionButton"
+        if driver.find_elements(By.ID, misc_element_id):
+            continue
+        click_element_id = "web_DEBDebtor_FindList_0-row-"+ str(lab)+ "-item-Episodes"
+        wait.until(EC.element_to_be_clickable((By.ID, click_element_id))).click()
+        wait.until(EC.presence_of_element_located((By.ID, misc_element_id)))
+    print("All labs expanded")
+
+def open_history_route(driver, wait, url):
+    """
+    Go straight to a cumulative history view by its address.
+    """
+    driver.get(url)
+    history_caption_id =   "web_EPVisitTestSet_CumulativeHistoryView_0-header-caption"
+    wait.until(EC.presence_of_element_located((By.ID,history_caption_id)))
+    wait.until(network_idle())
+    print("Patient Data is found")
+
+def open_find_list(driver, wait, url):
+    """
+    Go back to the find list by its address.
+    """
+    driver.get(url)
+    wait.until(EC.presence_of_element_located((By.ID, "web_DEBDebtor_FindList_0-item-HospitalMRN")))
+
 def write_to_file(patient):
     with open("fault_patients.txt", "a") as file:
         file.write("Patient ID:" +  str(patient))
@@ -152,89 +359,411 @@ def write_to_file(patient):
 def find_history(wait,lab):
 
     misc_element_id = "web_EPVisitNumber_List_"+ str(lab) +"_0-row-0-misc-actionButton"
-    misc_element = wait.until(EC.presence_of_element_located((By.ID, misc_element_id)))
+    misc_element = wait.until(EC.element_to_be_clickable((By.ID, misc_element_id)))
     misc_element.click()
 
     cum_history_id = "tc_ActionMenu-link-CumulativeHistory"
-    cum_history_element = wait.until(EC.presence_of_element_located((By.ID, cum_history_id)))
+    cum_history_element = wait.until(EC.element_to_be_clickable((By.ID, cum_history_id)))
     print("Cumulative history found")
 
 def find_data(wait):
 
     
     cum_history_id = "tc_ActionMenu-link-CumulativeHistory"
-    cum_history_element = wait.until(EC.presence_of_element_located((By.ID, cum_history_id)))
+    cum_history_element = wait.until(EC.element_to_be_clickable((By.ID, cum_history_id)))
     cum_history_element.click()
 
 
     history_caption_id =   "web_EPVisitTestSet_CumulativeHistoryView_0-header-caption"
     history_caption_element = wait.until(EC.presence_of_element_located((By.ID,history_caption_id)))
-    time.sleep(1)
+    wait.until(network_idle())  # Results are loaded after the view's caption
 
     print("Patient Data is found")
 
 
-def main():
-    patients  = ["25821273","187773908","132978255","639089310","23203490","136724358","22850861","134911767","69830727","51978906","24502099","19800127","26943928","187773908"]
+def is_logged_in(driver):
+    """
+    Check whether the driver still holds a logged-in session.
+    An expired session sends the page back to the logon form.
+    """
+    if driver.find_elements(By.ID, "SSUser_Logon_0-item-USERNAME"):
+        return False
+    return bool(driver.find_elements(By.ID, "web_DEBDebtor_FindList_0-item-HospitalMRN"))
 
-    for patient in patients:
-        try:
-            # Step 1: Retry setting up the driver
-            driver = retry_operation(setup_driver)
-            
-            # Step 2: Retry logging in
-            username = 'MP0819174'
-            password = 'Dermatology2025'
+class SeleniumBackend:
+    """
+    The scraping steps on a logged-in web driver, clicking through the UI.
+    Offers the same steps as http_backend.HttpBackend.
 
-            wait = WebDriverWait(driver,60) ## Setting waiting between steps
+    With direct=True every lab row is expanded once and all episode numbers are
+    read in one query. The first lab is opened through the menus and the address
+    of its cumulative history becomes a template, so the other labs are opened by
+    address without going back to the find list in between.
+    """
+    def __init__(self, driver, wait, direct=False):
+        self.driver = driver
+        self.wait = wait
+        self.direct = direct
+        self.last_opened = None  # Row left expanded by the previous lab
+        self.patient = None
+        self.find_list_url = None
+        self.on_find_list = True
+        self.listings = {}  # Listed (episode, date) pairs of every lab, read up front in direct mode
+        self.route_template = None  # Cumulative history address with EPISODE_PLACEHOLDER for the episode
+
+    def login(self, credentials):
+        retry_operation(login, self.driver, credentials, self.wait)
+
+    def patient_search(self, patient):
+        if self.on_find_list:
+            self.find_list_url = self.driver.current_url  # Where finish() goes back to
+        retry_operation(patient_search,patient,self.wait,self.driver)
+        self.last_opened = None
+        self.patient = patient
+        self.on_find_list = True
+        return patient
+
+    def list_episodes(self, patient):
+        """
+        Labs are opened by their row in the find list, so the rows stand in for the episodes.
+        """
+        labs = int(retry_operation(count_labs,self.driver))
+        if self.direct:
+            retry_operation(expand_all_labs, self.driver, self.wait, labs)
+            self.listings = dict(enumerate(retry_operation(read_episode_lists, self.driver, range(labs))))
+        return list(range(labs))
+
+    def _open(self, lab):
+        if self.last_opened != lab:
+            # Only collapse the previous row if it was expanded, labs may be skipped on resume
+            retry_operation(open_folder, self.wait, lab, self.last_opened == lab - 1)
+            self.last_opened = lab
+
+    def episode_listing(self, lab):
+        """
+        Expand the lab's row and return its listed (episode, date) pairs.
+        """
+        if self.direct:
+            return self.listings.get(lab, [])
+        self._open(lab)
+        return retry_operation(read_episode_list, self.driver, lab)
+
+    def _show_history(self, lab):
+        """
+        Bring up the lab's cumulative history view.
+        Returns True if it was opened from the find list, so the copy step should go back to it.
+        """
+        listed = self.listings.get(lab)
+        episode = listed[0][0] if listed else None
+        if self.route_template and episode:
+            retry_operation(open_history_route, self.driver, self.wait, self.route_template.replace(EPISODE_PLACEHOLDER, episode))
+            self.on_find_list = False
+            return False
+
+        if not self.on_find_list:
+            # Left the find list by address, go back to it and search again
+            self.finish()
+            self.patient_search(self.patient)
+            self.list_episodes(self.patient)
+        if not self.direct:
+            self._open(lab)
+        retry_operation(find_history, self.wait, lab)
+        retry_operation(find_data, self.wait)
+        if self.direct and episode and episode in self.driver.current_url:
+            self.route_template = self.driver.current_url.replace(episode, EPISODE_PLACEHOLDER)
+        return True
+
+    def cumulative_history(self, lab):
+        go_back = self._show_history(lab)
+        return retry_operation(copy_homepage_content, self.driver, self.wait, go_back)
+
+    def cumulative_records(self, lab):
+        """
+        Return the cumulative history of a lab as structured result records.
+        """
+        go_back = self._show_history(lab)
+        return normalise_records(retry_operation(copy_history_records, self.driver, self.wait, go_back), lab + 1)
+
+    def finish(self):
+        """
+        Return to the find list if the last lab was opened by address, ready for the next patient.
+        """
+        if not self.on_find_list:
+            retry_operation(open_find_list, self.driver, self.wait, self.find_list_url)
+            self.on_find_list = True
+
+class RetryingBackend:
+    """
+    Runs the steps of a backend that does not retry them itself, such as
+    http_backend.HttpBackend, through retry_operation. Its failures then get the
+    retry policy's backoff and trip the shared circuit breaker like browser steps.
+    """
+    STEPS = ("patient_search", "list_episodes", "episode_listing", "cumulative_history")
 
-            retry_operation(login, driver, {"username": username, "password": password}, wait)
-            retry_operation(patient_search,patient,wait,driver)
-            labs = int(retry_operation(count_labs,driver))
+    def __init__(self, backend):
+        self.backend = backend
 
-            patient_textfile_content = ''
+    def __getattr__(self, name):
+        step = getattr(self.backend, name)
+        if name in self.STEPS:
+            return lambda *args: retry_operation(step, *args)
+        return step
 
-            for lab in range(labs):
-                try:
-                    retry_operation(open_folder, wait, lab)
-                    retry_operation(find_history, wait, lab)
-                    retry_operation(find_data, wait)
-                    content = retry_operation(copy_homepage_content, driver, wait)
-                    patient_textfile_content += f"\n Lab : {lab+1} {content}\n"
-                except RuntimeError as e:
-                    raise RuntimeError(f"Failed while processing lab {lab+1}: {e}") from e
+def scrape_patient(backend, patient, store=None, index=None, pipeline=None):
+    """
+    Search for a patient and copy the cumulative history of every lab.
+    With a job store, every lab is checkpointed as soon as it is copied and
+    labs checkpointed by an earlier run are not fetched again.
+    With an episode index, a lab whose episode list holds no new episodes reuses
+    the content stored for it, and labs older than the patient's watermark are skipped;
+    checkpoints are not used then, as a lab may have gained episodes since.
+    With a pipeline, every lab is handed over for parsing as soon as it is copied.
+    """
+    handle = backend.patient_search(patient)
+    episodes = backend.list_episodes(handle)
+    checkpoints = store.start_patient(patient, len(episodes)) if store is not None else {}
+
+    patient_textfile_content = ''
+    submitted = 0
 
+    for lab, episode in enumerate(episodes):
+        try:
+            content = None
+            if index is not None:
+                # The index knows whether the lab gained episodes since it was last
+                # copied, which a checkpoint cannot tell, so it goes first
+                listed = backend.episode_listing(episode)
+                content = index.unchanged_content(patient, listed)
+                if content is not None:
+                    print(f"Lab {lab+1} has no new episodes, reusing stored content")
+                elif index.before_watermark(patient, listed):
+                    print(f"Lab {lab+1} is older than the watermark, skipping")
+                    continue
+            elif checkpoints.get(lab, (None,))[0] == str(episode):
+                print(f"Lab {lab+1} already captured, skipping")
+                content = checkpoints[lab][1]
+
+            if content is None:
+                content = backend.cumulative_history(episode)
+                if index is not None:
+                    index.record_lab(patient, listed, content)
+            if store is not None:
+                store.save_lab(patient, lab, episode, content)
+            patient_textfile_content += f"\n Lab : {lab+1} {content}\n"
+            if pipeline is not None:
+                pipeline.submit_lab(patient, lab+1, content)
+                submitted += 1
+        except RuntimeError as e:
+            raise RetryError(f"Failed while processing lab {lab+1}: {e}", getattr(e, "failure", UNKNOWN)) from e
+
+    backend.finish()
+    if pipeline is not None:
+        pipeline.finish_patient(patient, submitted)
+    return patient_textfile_content
+
+def scrape_patient_records(backend, patient):
+    """
+    Search for a patient and collect the structured records of every lab.
+    """
+    handle = backend.patient_search(patient)
+    episodes = backend.list_episodes(handle)
 
+    patient_records = []
+    for lab, episode in enumerate(episodes):
+        try:
+            patient_records.extend(backend.cumulative_records(episode))
+        except RuntimeError as e:
+            raise RetryError(f"Failed while processing lab {lab+1}: {e}", getattr(e, "failure", UNKNOWN)) from e
+
+    backend.finish()
+    return patient_records
+
+def process_patient_records(pool, patient, direct=DIRECT_NAVIGATION):
+    """
+    Scrape one patient's structured records on a pooled driver and build their sheet from them.
+    Failures are logged to fault_patients.txt.
+    """
+    try:
+        with policy.budget(PATIENT_BUDGET), pool.session() as (driver, wait):
+            patient_records = scrape_patient_records(SeleniumBackend(driver, wait, direct), patient)
+        save_records(patient_records, str(patient), RECORDS_FOLDER, SHEETS_FOLDER)
+        print(f"{len(patient_records)} records saved for patient {patient}")
+    except RuntimeError as error:
+        print(f"Critical failure: {error}")
+        with fault_lock, open('fault_patients.txt','a') as file:
+            file.write(f"Patient ID: {patient}\n")
+            file.write(f"Problem: {error}\n")
+            file.write("-" * 40 + "\n")  # Divider for readability
+
+def scrape_with_browser(pool, patient, direct=DIRECT_NAVIGATION, store=None, index=None, pipeline=None):
+    """
+    Scrape a patient on a pooled driver. If the session expires part way, the
+    driver is replaced by a newly logged-in one and the patient is tried once more;
+    with a job store the labs captured before are not fetched again.
+    """
+    try:
+        with pool.session() as (driver, wait):
+            return scrape_patient(SeleniumBackend(driver, wait, direct), patient, store, index, pipeline)
+    except RetryError as error:
+        if error.failure != SESSION_EXPIRED:
+            raise
+        print(f"Session expired while scraping patient {patient}, logging in again")
+        if pipeline is not None:
+            pipeline.discard_patient(patient)
+    with pool.session() as (driver, wait):
+        return scrape_patient(SeleniumBackend(driver, wait, direct), patient, store, index, pipeline)
+
+def process_patient(pool, patient, http_backend=None, store=None, index=None, direct=DIRECT_NAVIGATION, pipeline=None):
+    """
+    Scrape one patient and write their text file.
+    Uses the HTTP backend when given and still usable, its steps retried by the
+    retry policy, and a pooled driver if that fails for any reason other than the
+    patient not being found or the site being down.
+    With a pipeline the labs are parsed as they arrive and the pipeline writes
+    the sheet, and the text file if it was asked to.
+    Every step of the patient shares a budget of PATIENT_BUDGET seconds.
+    Failures are logged to fault_patients.txt and the job store.
+    """
+    try:
+        with policy.budget(PATIENT_BUDGET), spans.span("patient", patient=str(patient)) as span:
+            patient_textfile_content = None
+            if http_backend is not None and http_backend.usable:
+                try:
+                    patient_textfile_content = scrape_patient(RetryingBackend(http_backend), patient, store, index, pipeline)
+                    span["backend"] = "http"
+                    http_backend.record_patient(True)
+                except Exception as e:
+                    failure = getattr(e, "failure", None) or classify(e)
+                    if failure == NOT_FOUND:
+                        http_backend.record_patient(True)  # Answered as expected, just without rows
+                    if failure in (NOT_FOUND, SITE_DOWN):
+                        # The browser would find the same empty find list, or the same dead site
+                        raise RetryError(f"Patient {patient} failed over HTTP ({failure}): {e}", failure) from e
+                    http_backend.record_patient(False)
+                    print(f"HTTP backend failed for patient {patient}: {e}. Falling back to the browser.")
+                    if pipeline is not None:
+                        pipeline.discard_patient(patient)
+
+            if patient_textfile_content is None:
+                patient_textfile_content = scrape_with_browser(pool, patient, direct, store, index, pipeline)
+                span["backend"] = "browser"
+            span["size"] = len(patient_textfile_content)
+
+        if pipeline is None:
             # Use an absolute path for the textfiles directory
-            output_file_path = 'output files\\' + str(patient) + '.txt'
+            output_file_path = TEXT_FOLDER + str(patient) + '.txt'
 
             # Write to the file
             with open(output_file_path, 'w', encoding='utf-8') as file:
                 file.write(patient_textfile_content)
 
             print(f"Textfile Content successfully copied to {output_file_path}")
+        if store is not None:
+            store.finish_patient(patient)
+
+
+        # Proceed with the translation
+        # process_text_files('textfiles\\','sheets\\')
+        # translate(patient_textfile_content, patient)
+
+    except RuntimeError as error:
+
+        print(f"Critical failure: {error}")
+        if store is not None:
+            store.fail_patient(patient, error)
+        if pipeline is not None:
+            pipeline.discard_patient(patient)
 
+        file_name = 'fault_patients.txt'
+        with fault_lock, open(file_name,'a') as file:
+            file.write(f"Patient ID: {patient}\n")
+            file.write(f"Problem: {error}\n")
+            file.write("-" * 40 + "\n")  # Divider for readability
+
+
+def make_driver_pool(pool_size=POOL_SIZE, recycle_after=RECYCLE_AFTER, poll_frequency=POLL_FREQUENCY, lean_browser=LEAN_BROWSER, site_url=BASE_URL):
+    """
+    Create the pool of browsers shared by the scraping threads, logged in to site_url.
+    """
+    return DriverPool(
+        pool_size,
+        create_driver=lambda: retry_operation(setup_driver, lean_browser),
+        authenticate=lambda driver, wait: retry_operation(login, driver, CREDENTIALS, wait, site_url),
+        is_authenticated=is_logged_in,
+        recycle_after=recycle_after,
+        poll_frequency=poll_frequency,
+        on_started=record_bootstrap,
+    )
+
+def connect_http_backend(pool_size=POOL_SIZE, site_url=BASE_URL):
+    """
+    Log in over direct HTTP. Returns the backend, or None if the login failed.
+    """
+    http_backend = HttpBackend(CREDENTIALS, base_url=site_url, pool_size=pool_size)
+    try:
+        http_backend.login(CREDENTIALS)
+    except Exception as e:
+        print(f"HTTP login failed: {e}. Using the browser for every patient.")
+        http_backend.close()
+        return None
+    return http_backend
+
+def main(pool_size=POOL_SIZE, recycle_after=RECYCLE_AFTER, use_http=USE_HTTP_BACKEND, rerun_done=False, incremental=False, since=None, structured=False, poll_frequency=POLL_FREQUENCY, direct_navigation=DIRECT_NAVIGATION, lean_browser=LEAN_BROWSER,
+         streaming=False, parse_workers=PARSE_WORKERS, keep_text=True, spans_path=SPANS_PATH, site_url=BASE_URL):
+    """
+    Scrape every patient in the list.
+    For a periodic refresh pass rerun_done=True and incremental=True, so finished
+    patients are visited again but only labs with new episodes are opened.
+    since (dd/mm/yyyy) sets every patient's watermark for incremental runs.
+    structured=True reads result records out of the page instead of its text and
+    builds the sheets from them directly; it always uses the browser.
+    direct_navigation=True opens labs by address after the first, see SeleniumBackend.
+    lean_browser=True starts headless browsers that skip images, fonts and media.
+    streaming=True parses each lab while scraping continues and writes the sheets
+    straight away; keep_text=False then skips the intermediate text files.
+    Step timings are appended to spans_path, and summarised at the end of the run.
+    site_url points the browsers and the HTTP backend at another copy of the site.
+    """
+    patients  = ["25821273","187773908","132978255","639089310","23203490","136724358","22850861","134911767","69830727","51978906","24502099","19800127","26943928","187773908"]
 
-            # Proceed with the translation
-            # process_text_files('textfiles\\','sheets\\')
-            # translate(patient_textfile_content, patient)
-        
-
-        
-        except RuntimeError as error:
-            
-            print(f"Critical failure: {error}")
-           
-            file_name = 'fault_patients.txt'
-            with open(file_name,'a') as file:
-                file.write
-                file.write(f"Patient ID: {patient}\n")
-                file.write(f"Problem: {error}\n")
-                file.write("-" * 40 + "\n")  # Divider for readability
-        
-        finally:
-            print("Cleaning up resources...")
-            driver.quit()
+    if spans_path is not None:
+        spans.configure(spans_path)
+
+    # Duplicates are collapsed and patients finished by an earlier run are left out
+    store = JobStore(JOB_STORE_PATH)
+    patients = store.enqueue(patients, rerun_done)
+    print(f"{len(patients)} patients to scrape")
+    index = EpisodeIndex(EPISODE_INDEX_PATH) if incremental else None
+    if index is not None and since is not None:
+        for patient in patients:
+            index.set_since(patient, since)
+
+    pool = make_driver_pool(pool_size, recycle_after, poll_frequency, lean_browser, site_url)
+    http_backend = connect_http_backend(pool_size, site_url) if use_http else None
+
+    pipeline = None
+    if streaming:
+        pipeline = LabPipeline(parse_workers, PARSE_QUEUE_SIZE, TEXT_FOLDER if keep_text else None)
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            if structured:
+                list(executor.map(lambda patient: process_patient_records(pool, patient, direct_navigation), patients))
+            else:
+                list(executor.map(lambda patient: process_patient(pool, patient, http_backend, store, index, direct_navigation, pipeline), patients))
+    finally:
+        print("Cleaning up resources...")
+        pool.close()
+        if pipeline is not None:
+            pipeline.close()
+        wait_times.report()
+        report_bootstrap()
+        spans.report()
+        if http_backend is not None:
+            http_backend.close()
+        store.close()
+        if index is not None:
+            index.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,140 +1,445 @@
+import argparse
+import numpy as np
 import pandas as pd
 import re
+from batch import run_batch, report_errors
+from manifest import Manifest, fingerprint
+from timing import spans
+from bisect import bisect_left
 from datetime import datetime
 import os
+
+output_folder = 'output sheets\\'
+
+fbc_tests = {"White Cell Count", "Red Cell Count", "Haemoglobin",
+             "Haematocrit", "MCH", "MCV", "Platelet Count"}  # Ensure Platelet Count and Red Cell Count are included
+
+# Chemistry and Histopathology tests searched for in every episode
+lab_tests = {
+    "Urine protein": r"Urine protein\s+([\d.]+)?\s*g/L",
+    "Urine protein creat ratio": r"Urine protein\s+creat ratio\s+([\d.]+)?\s*H?\s*g/mmol creat",
+    "Creatinine": r"Creatinine\s+(\d+)\s*L?\s*umol/L",
+    "Sodium": r"Sodium\s+(\d+)\s*mmol/L",
+    "Urea": r"Urea\s+([\d.]+)\s+mmol/L",
+    "Calcium": r"Calcium\s+([\d.]+)\s+mmol/L",
+    "Histopathology": r"CLINICAL:(.*?)(?=PATHOLOGIST:)",
+    "LA": r"Lupus Anticoagulant:.*?Normalised LAC Ratio\s+([\d.]+\s*[A-Za-z]?)",
+    # "Neutrophils %": r"Neutrophils %\n(\d+\.\d+)",
+    # "Neutrophils": r"Neutrophils\n(\d+\.\d+)\n",
+    # "Lymphocytes %": r"Lymphocytes %\n(\d+\.\d+)",
+    # "Lymphocytes": r"Lymphocytes\n(\d+\.\d+)\n",
+    # "Monocytes %": r"Monocytes %\n(\d+\.\d+)",
+    # "Monocytes": r"Monocytes\n(\d+\.\d+)\n",
+    # "Eosinophils %": r"Eosinophils %\n(\d+\.\d+)",
+    # "Eosinophils": r"Eosinophils\n(\d+\.\d+)\n",
+    # "Basophils %": r"Basophils %\n(\d+\.\d+)",
+    # "Basophils": r"Basophils\n(\d+\.\d+)\n",
+    # "Immature Cells %": r"Immature Cells %\n(\d+\.\d+)",
+    # "Immature Cells": r"Immature Cells\n(\d+\.\d+)\n"
+}
+
+# Units of the Full Blood Count tests, which the cumulative history table leaves out
+fbc_test_units = {
+    "White Cell Count": "x10^9/L",
+    "Red Cell Count": "x10^12/L",
+    "Haemoglobin": "g/dL",
+    "Haematocrit": "L/L",
+    "MCV": "fL",
+    "MCH": "pg",
+    "Platelet Count": "x10^9/L",
+}
+
+# Units of the chemistry tests, kept with their results in the results store
+lab_test_units = {
+    "Urine protein": "g/L",
+    "Urine protein creat ratio": "g/mmol creat",
+    "Creatinine": "umol/L",
+    "Sodium": "mmol/L",
+    "Urea": "mmol/L",
+    "Calcium": "mmol/L",
+}
+
+# Bump when the parsing logic changes in a way that changes its output.
+# Changes to the test dicts are picked up by the pattern fingerprints below on
+# their own, and only send back the files the changed tests can affect.
+PARSER_REVISION = 2
+parser_version = fingerprint(PARSER_REVISION)
+
+# Full Blood Count header that starts every block, and the block's collected dates
+FBC_HEADER = "Date Collected\t"
+fbc_date_run_pattern = re.compile(r"[\d/\s]*")
+fbc_date_pattern = re.compile(r"\d{2}/\d{2}/\d{4}")
+
+def fbc_line_pattern(tests):
+    """
+    Compile a regex for the block lines of the given tests, with the values after the
+    first tab. Test names are written with "Count" shortened to "Cou" in the text.
+    Matches start at the newline before the line, which lets the scan skip ahead fast.
+    """
+    names = [test.replace('Count', 'Cou') for test in sorted(tests)]
+    names = [name for name in names if name.replace('Cou', 'Count') in tests]
+    return re.compile(r"\n[^\S\t\n]*(?P<test>" + "|".join(re.escape(name) for name in names) +
+                      r")[^\S\t\n]*(?:\t(?P<values>[^\n]*))?$", re.MULTILINE)
+
+fbc_line = fbc_line_pattern(fbc_tests)
+
 # Full Blood Count Parsing Function
-def parse_fbc_section(text_section):
-    date_line = re.search(r"Date Collected\s+([\d\/\s]+)", text_section)
-    if not date_line:
-        return None, None
-    dates = re.findall(r"\d{2}/\d{2}/\d{4}", date_line.group(1))
-    
-    results_dict = {}
-    test_lines = text_section.strip().split('\n')[1:]  # Skip date line
-    for line in test_lines:
-        if line.strip():
-            parts = line.split('\t')
-            test_name = parts[0].strip().replace('Cou', 'Count')
-            results = parts[1:]
-            results_dict[test_name] = results
-    return dates, results_dict
+def parse_fbc_blocks(text):
+    """
+    Yield (dates, {test: values}) for every Full Blood Count block, reading only the
+    lines of the tests in fbc_tests. A block runs to the next block, and where a
+    test has several lines in a block the last one is used.
+    """
+    position = text.find(FBC_HEADER)
+    while position != -1:
+        start = position + len(FBC_HEADER)
+        position = text.find(FBC_HEADER, start)
+        end = len(text) if position == -1 else position
 
-def consolidate_fbc_data(text):
-    fbc_tests = {"White Cell Count", "Red Cell Count", "Haemoglobin", 
-                 "Haematocrit", "MCH", "MCV", "Platelet Count"}  # Ensure Platelet Count and Red Cell Count are included
-    sections = text.split("Date Collected\t")[1:]
-    full_data = {}
-    for section in sections:
-        dates, results_dict = parse_fbc_section("Date Collected\t" + section)
+        run = fbc_date_run_pattern.match(text, start, end)
+        dates = fbc_date_pattern.findall(run.group())
         if not dates:
             continue
-        for test_name, results in results_dict.items():
-            if test_name in fbc_tests:
-                for date, result in zip(dates, results):
-                    date_key = datetime.strptime(date, '%d/%m/%Y').date()
-                    full_data.setdefault(test_name, {}).setdefault(date_key, []).append(result)
 
-    return pd.DataFrame(full_data)
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        first_line_end = text.find('\n', start, end)
+        results = {}
+        if first_line_end != -1:
+            for line in fbc_line.finditer(text, first_line_end, end):
+                values = line.group('values')
+                results[line.group('test').replace('Cou', 'Count')] = values.split('\t') if values is not None else []
+        yield dates, results
+
+def consolidate_fbc_data(text):
+    """
+    Gather every Full Blood Count block into one frame of tests by collected date,
+    holding one value per cell. Where a date is in several blocks the first value is kept.
+    """
+    records = []
+    parsed_dates = {}  # Blocks repeat the same dates, so parse each one once
+    for dates, results in parse_fbc_blocks(text):
+        for date in dates:
+            if date not in parsed_dates:
+                parsed_dates[date] = datetime.strptime(date, '%d/%m/%Y').date()
+        for test_name, values in results.items():
+            records.extend((test_name, parsed_dates[date], value) for date, value in zip(dates, values))
+    if not records:
+        return pd.DataFrame()
+
+    # Fill one test x date array and build the frame from it in a single step
+    tests = list(dict.fromkeys(test_name for test_name, _, _ in records))
+    dates = sorted({date for _, date, _ in records})
+    columns = {test_name: index for index, test_name in enumerate(tests)}
+    rows = {date: index for index, date in enumerate(dates)}
+    values = np.full((len(dates), len(tests)), np.nan, dtype=object)
+    for test_name, date, value in reversed(records):
+        values[rows[date], columns[test_name]] = value
+    return pd.DataFrame(values, index=dates, columns=tests)
+
+def leading_literal(pattern):
+    r"""
+    Return the literal text every match of a regex starts with, e.g. "Creatinine"
+    for r"Creatinine\s+(\d+)". A match can only start where this text occurs.
+    """
+    literal = ''
+    for index, char in enumerate(pattern):
+        if char in '\\.^$*+?{}[]|()':
+            if char in '*+?{' and literal:
+                literal = literal[:-1]  # The last character is optional or repeated
+            break
+        literal += char
+    return literal
+
+# Test table compiled once: (test, regex, leading literal, whether the value is free text)
+lab_test_table = [(test, re.compile(pattern, re.DOTALL), leading_literal(pattern), test in ["Histopathology", "LA"])
+                  for test, pattern in lab_tests.items()]
+
+# Fingerprint of each test's pattern, and the text every match of it contains, for the manifest
+pattern_versions = {**{test: fingerprint("fbc", test) for test in fbc_tests},
+                    **{test: fingerprint(pattern) for test, pattern in lab_tests.items()}}
+pattern_keywords = {**{test: test.replace('Count', 'Cou').lower() for test in fbc_tests},
+                    **{test: literal.lower() or None for test, _, literal, _ in lab_test_table}}
+
+# Episode boundaries and "Date collected" lines. Each is found with its own literal-led
+# scan, which is several times faster than one alternation over both.
+episode_boundary_pattern = re.compile(r'Episode\s+\w+')
+date_collected_pattern = re.compile(r'Date collected\s+(\d{2}/\d{2}/\d{4})')
+
+def tokenize_episodes(text):
+    r"""
+    Index the episodes of a cumulative history by offset.
+    Returns (start, end, collected date) for every episode, where the date is the
+    first "Date collected" of the episode, or None if it has none. The episodes are
+    the same stretches of text re.split(r'Episode\s+\w+', text) gives.
+    """
+    boundaries = [(match.start(), match.end()) for match in episode_boundary_pattern.finditer(text)]
+    dates = date_collected_pattern.finditer(text)
+    date = next(dates, None)
+    episodes = []
+    for index, (_, start) in enumerate(boundaries):
+        end = boundaries[index + 1][0] if index + 1 < len(boundaries) else len(text)
+        while date is not None and date.start() < start:
+            date = next(dates, None)
+        collected = date.group(1) if date is not None and date.end() <= end else None
+        episodes.append((start, end, collected))
+    return episodes
+
+# Headers that start a section of an episode, and the tests read from that section.
+# Chemistry tests are read from the text before the first header, so a value quoted
+# in a report or a Full Blood Count table is never taken for a chemistry result.
+section_tests = {
+    FBC_HEADER: (),
+    "CLINICAL:": ("Histopathology",),
+    "Lupus Anticoagulant:": ("LA",),
+}
+
+# lab_test_table split by section, with the chemistry tests under None
+section_test_table = {header: [entry for entry in lab_test_table if entry[0] in tests] for header, tests in section_tests.items()}
+section_test_table[None] = [entry for entry in lab_test_table if not any(entry[0] in tests for tests in section_tests.values())]
+
+def index_sections(text):
+    """
+    Return the offsets of every section header in the text, by header.
+    """
+    offsets = {}
+    for header in section_tests:
+        found = offsets[header] = []
+        position = text.find(header)
+        while position != -1:
+            found.append(position)
+            position = text.find(header, position + len(header))
+    return offsets
+
+def episode_sections(offsets, start, end):
+    """
+    Split an episode at its section headers, given their offsets from index_sections.
+    Returns {header: (start, end)} for the headers found in the episode, and under
+    None the text before the first of them.
+    """
+    starts = []
+    for header, found in offsets.items():
+        index = bisect_left(found, start)
+        if index < len(found) and found[index] < end:
+            starts.append((found[index], header))
+    starts.sort()
+    sections = {None: (start, starts[0][0] if starts else end)}
+    for index, (position, header) in enumerate(starts):
+        sections[header] = (position, starts[index + 1][0] if index + 1 < len(starts) else end)
+    return sections
 
 # Chemistry and Histopathology Results Parsing Function
 def parse_lab_results(text):
-    episodes = re.split(r'Episode\s+\w+', text)[1:]
     results = {}
-    for episode in episodes:
-        date_match = re.search(r'Date collected\s+(\d{2}/\d{2}/\d{4})', episode)
-        if not date_match:
+    parsed_dates = {}  # The same episode shows up in several labs, so parse each date once
+    offsets = index_sections(text)
+    for start, end, collected in tokenize_episodes(text):
+        if collected is None:
             continue
-        date = datetime.strptime(date_match.group(1), '%d/%m/%Y').date()
-        tests = {
-        "Urine protein": r"Urine protein\s+([\d.]+)?\s*g/L",
-        "Urine protein creat ratio": r"Urine protein\s+creat ratio\s+([\d.]+)?\s*H?\s*g/mmol creat",
-        "Creatinine": r"Creatinine\s+(\d+)\s*L?\s*umol/L",
-        "Sodium": r"Sodium\s+(\d+)\s*mmol/L",
-        "Urea": r"Urea\s+([\d.]+)\s+mmol/L",
-        "Calcium": r"Calcium\s+([\d.]+)\s+mmol/L",        
-        "Histopathology": r"CLINICAL:(.*?)(?=PATHOLOGIST:)",
-        "LA": r"Lupus Anticoagulant:.*?Normalised LAC Ratio\s+([\d.]+\s*[A-Za-z]?)",
-        # "Neutrophils %": r"Neutrophils %\n(\d+\.\d+)",
-        # "Neutrophils": r"Neutrophils\n(\d+\.\d+)\n",
-        # "Lymphocytes %": r"Lymphocytes %\n(\d+\.\d+)",
-        # "Lymphocytes": r"Lymphocytes\n(\d+\.\d+)\n",
-        # "Monocytes %": r"Monocytes %\n(\d+\.\d+)",
-        # "Monocytes": r"Monocytes\n(\d+\.\d+)\n",
-        # "Eosinophils %": r"Eosinophils %\n(\d+\.\d+)",
-        # "Eosinophils": r"Eosinophils\n(\d+\.\d+)\n",
-        # "Basophils %": r"Basophils %\n(\d+\.\d+)",
-        # "Basophils": r"Basophils\n(\d+\.\d+)\n",
-        # "Immature Cells %": r"Immature Cells %\n(\d+\.\d+)",
-        # "Immature Cells": r"Immature Cells\n(\d+\.\d+)\n"
-    }
-
-
-
-        results.setdefault(date, {test: '-' for test in tests})
-        for test, pattern in tests.items():
-            match = re.search(pattern, episode, re.DOTALL)
-            if match:
-                result_value = match.group(1).strip() if test in ["Histopathology", "LA"] else f"{match.group(1)} - {match.group(2)}" if len(match.groups()) > 1 else match.group(1)
-                results[date][test] = result_value
+        date = parsed_dates.get(collected)
+        if date is None:
+            date = parsed_dates[collected] = datetime.strptime(collected, '%d/%m/%Y').date()
+        results.setdefault(date, {test: '-' for test in lab_tests})
+        for header, (section_start, section_end) in episode_sections(offsets, start, end).items():
+            for test, regex, literal, free_text in section_test_table[header]:
+                # Start searching where the test's name first appears in its section
+                position = text.find(literal, section_start, section_end)
+                if position == -1:
+                    continue
+                match = regex.search(text, position, section_end)
+                if match:
+                    result_value = match.group(1).strip() if free_text else f"{match.group(1)} - {match.group(2)}" if len(match.groups()) > 1 else match.group(1)
+                    results[date][test] = result_value
     return pd.DataFrame.from_dict(results, orient='index')
 
 
 
-def translate (text_content,id):
-    
-    # Get DataFrames from both functions
-    fbc_df = consolidate_fbc_data(text_content)
-    chem_df = parse_lab_results(text_content)
-
+def combine_results(fbc_df, chem_df):
+    """
+    Combine the Full Blood Count and chemistry results into one sheet,
+    with tests as rows and collected dates as columns.
+    """
     # Combine the dataframes
     combined_df = pd.concat([fbc_df, chem_df], axis=1).sort_index()
 
     # Convert index to datetime objects
     combined_df.index = pd.to_datetime(combined_df.index, format='%Y-%m-%d').date
 
-    # Since you want to remove list handling for cleaner data access, here's a more straightforward approach:
-    for col in combined_df.columns:
-        combined_df[col] = combined_df[col].apply(lambda x: x[0] if isinstance(x, list) and x != ['-'] else x)
-
     # Transpose the DataFrame so that columns become rows and vice versa
     combined_df = combined_df.transpose()
     # print(combined_df)
+    return combined_df
+
+def translation_sheet(results):
+    """
+    Lay {test: {collected date: raw value}} out as combine_results does, keeping
+    the tests in the order given, so a sheet can be rebuilt from stored results.
+    """
+    by_date = pd.DataFrame.from_dict(results, orient='columns')
+    fbc_columns = [test for test in by_date.columns if test in fbc_tests]
+    return combine_results(by_date[fbc_columns], by_date.drop(columns=fbc_columns))
 
+def save_translation(combined_df, id, folder=None):
+    """
+    Save a patient's combined sheet to the output folder, or the given folder, and return its path.
+    """
     # Now save the transposed DataFrame to Excel
-    output_file_path = 'output sheets\\' + str(id) + '.xlsx'
+    output_file_path = os.path.join(folder, str(id) + '.xlsx') if folder else output_folder + str(id) + '.xlsx'
     with pd.ExcelWriter(output_file_path, date_format='yyyy-mm-dd', datetime_format='yyyy-mm-dd') as writer:
         combined_df.to_excel(writer, index_label='Test/Date')
 
     print(f"Excel file saved: {output_file_path}")
+    return output_file_path
+
+def translate_text(text_content, id):
+    """
+    Parse a patient's text into the combined sheet, timing the extract and consolidate phases.
+    """
+    with spans.span("translate.extract", patient=str(id), size=len(text_content)) as span:
+        # Get DataFrames from both functions
+        fbc_df = consolidate_fbc_data(text_content)
+        chem_df = parse_lab_results(text_content)
+        span["dates"] = len(fbc_df) + len(chem_df)
+    with spans.span("translate.consolidate", patient=str(id)) as span:
+        combined_df = combine_results(fbc_df, chem_df)
+        span["cells"] = combined_df.size
+    return combined_df
+
+def translate (text_content,id):
+    combined_df = translate_text(text_content, id)
+    with spans.span("translate.save", patient=str(id)):
+        return save_translation(combined_df, id)
 
-def process_files_in_folder(folder_path):
+def produced_tests(combined_df):
+    """
+    Return the tests of a combined sheet that have a result on any date.
+    """
+    found = combined_df.notna() & (combined_df != '-')
+    return set(combined_df.index[found.any(axis=1)])
+
+def process_file(file_path):
+    """
+    Run the translate function on one .txt file, named after the file.
+    """
+    return translate_file(file_path)[0]
+
+def translate_file(file_path):
+    """
+    Like process_file, but returns (sheet path, tests with a result) for the manifest.
+    """
+    # Extract file name without extension
+    file_base_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    # Read the file content
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+        print(file_path)
+
+    combined_df = translate_text(content, file_base_name)
+    with spans.span("translate.save", patient=file_base_name):
+        return save_translation(combined_df, file_base_name), produced_tests(combined_df)
+
+def translation_rows(file_path):
+    """
+    Translate one .txt file into long-format results store rows.
+    """
+    from results_store import result_rows
+    with open(file_path, 'r', encoding='utf-8') as file:
+        content = file.read()
+    patient_id = os.path.splitext(os.path.basename(file_path))[0]
+    combined_df = translate_text(content, patient_id)
+    return result_rows(patient_id, combined_df.to_dict(orient='index'), {**fbc_test_units, **lab_test_units})
+
+def process_files_in_folder(folder_path, workers=1, chunksize=1, force=False, store_folder=None, db_path=None):
     """
     Process all .txt files in the given folder by running the translate function on each file.
 
+    Files already translated by the current parser, and whose content has not
+    changed since, are skipped using the manifest next to the output sheets.
+    After a test's pattern changes, only the files that had a result for it or
+    hold its leading text are translated again.
+
     Args:
         folder_path (str): Path to the folder containing .txt files.
+        workers (int): Number of worker processes. 1 processes the files one at a time.
+        chunksize (int): Number of files sent to a worker at a time.
+        force (bool): Translate unchanged files again.
+        store_folder (str): Append the results to the results store in this folder
+            instead of saving one sheet per patient.
+        db_path (str): Load the results into this results database instead of
+            saving one sheet per patient.
+
+    Returns:
+        list: (file path, output, error) per processed file, in file name order.
+        The output is the sheet path, or the result rows with store_folder or db_path set.
+        A failing file is reported and does not stop the rest of the batch.
     """
-    try:
-        for file_name in os.listdir(folder_path):
-            if file_name.endswith(".txt"):
-                # Extract file name without extension
-                file_base_name = os.path.splitext(file_name)[0]
+    store = database = None
+    if store_folder is not None and db_path is not None:
+        raise ValueError("Give either a results store or a results database, not both")
+    if store_folder is not None:
+        from results_store import ResultsStore
+        store = ResultsStore(store_folder)
+        manifest = Manifest(os.path.join(store_folder, 'manifest-translate.json'))
+    elif db_path is not None:
+        from results_db import ResultsDatabase
+        database = ResultsDatabase(db_path)
+        manifest = Manifest(os.path.splitext(db_path)[0] + '-translate-manifest.json')
+    else:
+        manifest = Manifest(output_folder + 'manifest.json')
+    file_paths = []
+    skipped = 0
+    for file_name in sorted(os.listdir(folder_path)):
+        if file_name.endswith(".txt"):
+            file_path = os.path.join(folder_path, file_name)
+            if not force and manifest.is_current(file_path, parser_version, pattern_versions, pattern_keywords):
+                skipped += 1
+                continue
+            file_paths.append(file_path)
+    print(f"{skipped} files unchanged since the last run, {len(file_paths)} to translate.")
 
-                # Read the file content
-                file_path = os.path.join(folder_path, file_name)
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    # print(content)
-                    print(file_path)
+    outcomes = run_batch(translation_rows if store is not None or database is not None else translate_file, file_paths, workers, chunksize)
+    report_errors(outcomes)
 
-                # Run the translate function
-                translate(content, file_base_name)
-    except Exception as e:
-        print("Hello")
-        # print(f"An error occurred: {e}")
+    for index, (file_path, output, error) in enumerate(outcomes):
+        if error is None:
+            if store is not None:
+                tests = set(output['test'])
+                store.append('translate', output, os.path.splitext(os.path.basename(file_path))[0])
+                output = store.partition('translate')
+            elif database is not None:
+                tests = set(output['test'])
+                database.load('translate', output, os.path.splitext(os.path.basename(file_path))[0])
+                output = db_path
+            else:
+                output, tests = output
+                outcomes[index] = (file_path, output, error)
+            manifest.record(file_path, parser_version, output, pattern_versions, tests)
+    if store is not None:
+        store.close()
+    if database is not None:
+        database.close()
+    manifest.save()
+    return outcomes
 
 
 # Example usage
 if __name__ == "__main__":
-    folder_path = "output files"  # Replace with the path to your folder
-    process_files_in_folder(folder_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Translate lab text files into Excel sheets.")
+    parser.add_argument("folder_path", nargs="?", default="output files", help="Folder containing the .txt files")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--chunksize", type=int, default=1, help="Files sent to a worker at a time")
+    parser.add_argument("--force", action="store_true", help="Translate unchanged files again")
+    parser.add_argument("--store", nargs="?", const="results store//", default=None,
+                        help="Append the results to this results store instead of writing sheets")
+    parser.add_argument("--db", nargs="?", const="results.sqlite", default=None,
+                        help="Load the results into this results database instead of writing sheets")
+    parser.add_argument("--spans", nargs="?", const="spans.jsonl", default=None,
+                        help="Append step timings to this file and print a summary at the end")
+    args = parser.parse_args()
+
+    if args.spans is not None:
+        spans.configure(args.spans)
+    process_files_in_folder(args.folder_path, args.workers, args.chunksize, args.force, args.store, args.db)
+    if args.spans is not None:
+        spans.report()
@@ -0,0 +1,88 @@
+import sys
+import threading
+import time
+from selenium.webdriver.support.ui import WebDriverWait
+
+DEFAULT_POLL = 0.1  # Seconds between checks of a wait condition
+
+# Page state used to decide whether the page has stopped loading: the document's
+# ready state, the number of resources fetched since the last check and, on
+# AngularJS pages, the number of $http requests still pending. The resource
+# timings are cleared at every check: pooled pages stay on one document for many
+# patients, and once the browser's buffer (250 entries) is full new resources are
+# no longer counted.
+NETWORK_STATE_SCRIPT = """
+    var pending = 0;
+    try { pending = angular.element(document.body).injector().get('$http').pendingRequests.length; } catch (e) {}
+    var fetched = performance.getEntriesByType('resource').length;
+    performance.clearResourceTimings();
+    return [document.readyState, fetched, pending];
+"""
+
+
+class WaitTimes:
+    """
+    How long each wait took, collected by step name from every thread.
+    Only the count, total and longest wait are kept per step, so a long-running
+    service does not collect every wait.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}  # {step: [count, total seconds, longest seconds]}
+
+    def record(self, step, seconds):
+        with self._lock:
+            totals = self.durations.setdefault(step, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+
+    def report(self):
+        """
+        Print and return count, mean and max wait in seconds for every step.
+        """
+        with self._lock:
+            summary = {step: (count, total / count, longest)
+                       for step, (count, total, longest) in self.durations.items()}
+        for step, (count, mean, longest) in sorted(summary.items()):
+            print(f"Wait {step}: {count} waits, mean {mean:.2f}s, max {longest:.2f}s")
+        return summary
+
+wait_times = WaitTimes()
+
+
+class MeasuredWait(WebDriverWait):
+    """
+    WebDriverWait that records how long every wait actually took.
+    Waits are recorded under the name of the step function that called until,
+    unless a step name is given.
+    """
+    def __init__(self, driver, timeout=60, poll_frequency=DEFAULT_POLL, recorder=None):
+        super().__init__(driver, timeout, poll_frequency=poll_frequency)
+        self.recorder = recorder or wait_times
+
+    def until(self, method, message="", step=None):
+        step = step or sys._getframe(1).f_code.co_name
+        start = time.perf_counter()
+        try:
+            return super().until(method, message)
+        finally:
+            self.recorder.record(step, time.perf_counter() - start)
+
+
+class network_idle:
+    """
+    Wait condition that holds once the page has finished loading and no new
+    requests have started for quiet_period seconds.
+    """
+    def __init__(self, quiet_period=0.3):
+        self.quiet_period = quiet_period
+        self.quiet_since = None
+
+    def __call__(self, driver):
+        ready_state, fetched, pending = driver.execute_script(NETWORK_STATE_SCRIPT)
+        now = time.monotonic()
+        if ready_state != 'complete' or pending or fetched or self.quiet_since is None:
+            self.quiet_since = now
+            return False
+        return now - self.quiet_since >= self.quiet_period